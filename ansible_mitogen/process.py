@@ -27,11 +27,19 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 from __future__ import absolute_import
+import errno
+import fcntl
+import hashlib
 import logging
 import os
 import socket
+import stat
+import struct
 import sys
 
+import ansible
+import ansible.errors
+
 import mitogen
 import mitogen.core
 import mitogen.master
@@ -47,6 +55,53 @@ import ansible_mitogen.services
 LOG = logging.getLogger(__name__)
 
 
+def get_daemon_path():
+    """
+    Return the UNIX socket path of the persistent MuxProcess for the current
+    user, creating its private directory if necessary. The name is keyed on
+    the Ansible and Mitogen versions and locations, so an upgrade never
+    attaches to a daemon running old code, and on ``SSH_AUTH_SOCK``, so a
+    daemon never authenticates using another login session's agent.
+    """
+    dirname = (os.environ.get('MITOGEN_DAEMON_DIR') or
+               os.path.expanduser('~/.ansible/mitogen'))
+    try:
+        os.makedirs(dirname, 0700)
+    except OSError:
+        e = sys.exc_info()[1]
+        if e.args[0] != errno.EEXIST:
+            raise
+
+    st = os.stat(dirname)
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP|stat.S_IWOTH):
+        raise ansible.errors.AnsibleError(
+            'Mitogen daemon directory %r must be owned by the current user '
+            'and writable by no other user.' % (dirname,)
+        )
+
+    key = hashlib.sha1(repr((
+        ansible.__version__,
+        os.path.dirname(ansible.__file__),
+        mitogen.__version__,
+        os.path.dirname(mitogen.__file__),
+        os.path.dirname(os.path.abspath(__file__)),
+        sys.executable,
+        os.environ.get('SSH_AUTH_SOCK'),
+    ))).hexdigest()
+    return os.path.join(dirname, 'mux-%s.sock' % (key[:16],))
+
+
+def lock_daemon_path(path):
+    """
+    Block until an exclusive lock associated with the daemon socket `path` is
+    acquired, returning the file descriptor holding it. Closing the
+    descriptor releases the lock.
+    """
+    fd = os.open(path + '.lock', os.O_RDWR|os.O_CREAT, 0600)
+    fcntl.lockf(fd, fcntl.LOCK_EX)
+    return fd
+
+
 class MuxProcess(object):
     """
     Implement a subprocess forked from the Ansible top-level, as a safe place
@@ -83,6 +138,23 @@ class MuxProcess(object):
     #: forked WorkerProcesses to contact the MuxProcess
     unix_listener_path = None
 
+    #: If not :data:`None`, the MuxProcess is started as a daemon that
+    #: outlives the top-level process and is reused by later runs, keeping
+    #: its connections and module cache warm. It exits once no top-level
+    #: process has been attached for this many seconds, and shuts down
+    #: contexts left unused for as long. Set by the ``MITOGEN_DAEMON_TTL``
+    #: environment variable.
+    daemon_ttl = None
+
+    #: In the top-level process when :attr:`daemon_ttl` is set, a connection
+    #: to the daemon held open for the life of the process, preventing the
+    #: daemon exiting while it is in use.
+    lease_sock = None
+
+    #: In the top-level process while the daemon is started, the descriptor
+    #: holding the lock returned by :func:`lock_daemon_path`.
+    _lock_fd = None
+
     #: Singleton.
     _instance = None
 
@@ -94,11 +166,87 @@ class MuxProcess(object):
         The parent process picks a UNIX socket path the child will use prior to
         fork, creates a socketpair used essentially as a semaphore, then blocks
         waiting for the child to indicate the UNIX socket is ready for use.
+
+        When :attr:`daemon_ttl` is set, the child is instead a persistent
+        daemon listening on a per-user path, which is reused if already
+        running.
         """
-        if cls.worker_sock is not None:
+        if cls.worker_sock is not None or cls.lease_sock is not None:
             return
 
-        cls.unix_listener_path = mitogen.unix.make_socket_path()
+        cls.daemon_ttl = float(os.environ.get('MITOGEN_DAEMON_TTL', 0)) or None
+        if cls.daemon_ttl:
+            cls._start_daemon()
+        else:
+            cls.unix_listener_path = mitogen.unix.make_socket_path()
+            cls._fork()
+
+    @classmethod
+    def _start_daemon(cls):
+        """
+        Attach to the persistent MuxProcess, starting it if it is not running.
+        The lock is held throughout, so a daemon found running cannot decide
+        to exit before the lease is established.
+        """
+        cls.unix_listener_path = get_daemon_path()
+        cls._lock_fd = lock_daemon_path(cls.unix_listener_path)
+        try:
+            cls.lease_sock = cls._attach()
+            if cls.lease_sock is None:
+                cls._fork()
+                cls.worker_sock.close()
+                cls.worker_sock = None
+                os.waitpid(cls.child_pid, 0)
+                cls.lease_sock = cls._attach()
+        finally:
+            os.close(cls._lock_fd)
+            cls._lock_fd = None
+
+        if cls.lease_sock is None:
+            raise ansible.errors.AnsibleError(
+                'Could not attach to the Mitogen daemon at %r.' % (
+                    cls.unix_listener_path,
+                )
+            )
+        mitogen.core.set_cloexec(cls.lease_sock.fileno())
+
+    @classmethod
+    def _attach(cls):
+        """
+        Connect to the daemon and complete the :mod:`mitogen.unix` handshake,
+        returning the connected socket, or :data:`None` if no daemon is
+        listening. No messages are exchanged over the connection.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(cls.unix_listener_path)
+            sock.send(struct.pack('>L', os.getpid()))
+            if len(sock.recv(12)) == 12:
+                return sock
+        except socket.error:
+            pass
+        sock.close()
+        return None
+
+    @classmethod
+    def _detach(cls):
+        """
+        In the daemon, leave the top-level process's session and standard IO,
+        then fork again so the daemon does not become a zombie if it exits
+        first.
+        """
+        os.close(cls._lock_fd)
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+
+        fd = os.open(os.devnull, os.O_RDWR)
+        for stdfd in 0, 1, 2:
+            os.dup2(fd, stdfd)
+        os.close(fd)
+
+    @classmethod
+    def _fork(cls):
         cls.worker_sock, cls.child_sock = socket.socketpair()
         mitogen.core.set_cloexec(cls.worker_sock)
         mitogen.core.set_cloexec(cls.child_sock)
@@ -112,6 +260,8 @@ class MuxProcess(object):
         else:
             cls.worker_sock.close()
             cls.worker_sock = None
+            if cls.daemon_ttl:
+                cls._detach()
             self = cls()
             self.worker_main()
             sys.exit()
@@ -127,8 +277,68 @@ class MuxProcess(object):
 
         # Let the parent know our listening socket is ready.
         self.child_sock.send('1')
-        # Block until the socket is closed, which happens on parent exit.
-        self.child_sock.recv(1)
+        if self.daemon_ttl:
+            self.child_sock.close()
+            self._daemon_main()
+        else:
+            # Block until the socket is closed, which happens on parent exit.
+            self.child_sock.recv(1)
+
+    def _daemon_main(self):
+        """
+        Wait until no client has been connected for :attr:`daemon_ttl`
+        seconds, then unlink the listening socket and shut down. The socket
+        is unlinked while holding the lock, so a concurrent :meth:`start`
+        either attaches first, keeping the daemon alive, or finds no daemon
+        and starts a replacement. The lock is never taken on the broker
+        thread, since :meth:`start` holds it while awaiting the broker's
+        reply to its handshake.
+        """
+        self._idle_timer = None
+        self._idle_latch = mitogen.core.Latch()
+        mitogen.core.listen(self.listener, 'connect', self._rearm_idle_timer)
+        self.router.broker.defer(self._rearm_idle_timer)
+        while True:
+            timer = self._idle_latch.get()
+            if timer is not self._idle_timer:
+                continue  # A client came and went since the timer fired.
+
+            fd = lock_daemon_path(self.listener.path)
+            try:
+                if not self.listener.clients:
+                    LOG.debug('%r: idle for %ds, exiting',
+                              self, self.daemon_ttl)
+                    os.unlink(self.listener.path)
+                    break
+            finally:
+                os.close(fd)
+
+        self.router.broker.shutdown()
+        self.router.broker.join()
+
+    def _rearm_idle_timer(self, stream=None):
+        """
+        Respond to a client connecting or disconnecting by cancelling the
+        idle timer, and restarting it if no clients remain. Runs on the
+        broker thread.
+        """
+        if stream is not None:
+            mitogen.core.listen(stream, 'disconnect', self._rearm_idle_timer)
+        if self._idle_timer is not None:
+            self.router.broker.cancel(self._idle_timer)
+            self._idle_timer = None
+        if not self.listener.clients:
+            self._idle_timer = self.router.broker.call_later(
+                self.daemon_ttl,
+                self._on_idle_timeout,
+            )
+
+    def _on_idle_timeout(self):
+        """
+        Wake :meth:`_daemon_main` with the timer that expired. Cancelled
+        timers never fire, so it is always the current one.
+        """
+        self._idle_latch.put(self._idle_timer)
 
     def _setup_master(self):
         """
@@ -153,7 +363,10 @@ class MuxProcess(object):
         self.pool = mitogen.service.Pool(
             router=self.router,
             services=[
-                ansible_mitogen.services.ContextService(self.router),
+                ansible_mitogen.services.ContextService(
+                    router=self.router,
+                    idle_ttl=self.daemon_ttl,
+                ),
                 ansible_mitogen.services.FileService(self.router),
             ],
             size=int(os.environ.get('MITOGEN_POOL_SIZE', '16')),
@@ -167,4 +380,6 @@ class MuxProcess(object):
         happen explicitly, but Ansible provides no hook to allow it.
         """
         self.pool.stop()
-        os.unlink(self.listener.path)
+        if not self.daemon_ttl:
+            # The daemon unlinks its socket itself, before deciding to exit.
+            os.unlink(self.listener.path)
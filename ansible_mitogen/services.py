@@ -44,6 +44,7 @@ import os.path
 import pprint
 import sys
 import threading
+import time
 import zlib
 
 import mitogen
@@ -76,8 +77,8 @@ class ContextService(mitogen.service.Service):
     max_message_size = 1000
     max_interpreters = int(os.getenv('MITOGEN_MAX_INTERPRETERS', '20'))
 
-    def __init__(self, *args, **kwargs):
-        super(ContextService, self).__init__(*args, **kwargs)
+    def __init__(self, router, idle_ttl=None):
+        super(ContextService, self).__init__(router)
         self._lock = threading.Lock()
         #: Records the :meth:`get` result dict for successful calls, returned
         #: for identical subsequent calls. Keyed by :meth:`key_from_kwargs`.
@@ -95,22 +96,115 @@ class ContextService(mitogen.service.Service):
         self._lru_by_via = {}
         #: :meth:`key_from_kwargs` result by Context.
         self._key_by_context = {}
+        #: via= Context by Context, for contexts created via another.
+        self._via_by_context = {}
+        #: Time each context's reference count last fell to zero.
+        self._idle_since_by_context = {}
+        #: Mapping of client context ID -> {Context: reference count}, for
+        #: references returned by :meth:`get` to a client that may exit
+        #: without calling :meth:`put`. They are released when the client's
+        #: stream disconnects. Entries are removed as :meth:`put` releases
+        #: them, so a long-lived client holds only its outstanding references.
+        self._refs_by_client = {}
+        #: If not :data:`None`, seconds a context may remain unreferenced
+        #: before it is shut down. Contexts still acting as via= for another
+        #: context are kept until that context is shut down.
+        self.idle_ttl = idle_ttl
+        if idle_ttl is not None:
+            self._reap_timer = router.broker.periodic(
+                max(1.0, idle_ttl / 10.0),
+                self._reap_idle,
+            )
 
     @mitogen.service.expose(mitogen.service.AllowParents())
     @mitogen.service.arg_spec({
         'context': mitogen.core.Context
     })
-    def put(self, context):
+    def put(self, msg, context):
         """
         Return a reference, making it eligable for recycling once its reference
         count reaches zero.
         """
         LOG.debug('%r.put(%r)', self, context)
-        if self._refs_by_context.get(context, 0) == 0:
-            LOG.warning('%r.put(%r): refcount was 0. shutdown_all called?',
-                        self, context)
+        self._lock.acquire()
+        try:
+            if self._refs_by_context.get(context, 0) == 0:
+                LOG.warning('%r.put(%r): refcount was 0. shutdown_all called?',
+                            self, context)
+                return
+            refs = self._refs_by_client.get(msg.src_id, {})
+            if refs.get(context):
+                refs[context] -= 1
+                if not refs[context]:
+                    del refs[context]
+            self._release(context, 1)
+        finally:
+            self._lock.release()
+
+    def _release(self, context, count):
+        """
+        Drop `count` references to `context`, recording when it became idle.
+        The lock must be held.
+        """
+        refs = self._refs_by_context.get(context)
+        if refs:
+            self._refs_by_context[context] = max(0, refs - count)
+            if refs <= count:
+                self._idle_since_by_context[context] = time.time()
+
+    def _add_client_ref(self, src_id, context):
+        """
+        Record a reference to `context` returned to the client `src_id`, and
+        arrange to release it should the client disconnect without calling
+        :meth:`put`.
+        """
+        if src_id == mitogen.context_id:
             return
-        self._refs_by_context[context] -= 1
+
+        self._lock.acquire()
+        try:
+            refs = self._refs_by_client.get(src_id)
+            first = refs is None
+            if first:
+                refs = self._refs_by_client[src_id] = {}
+            refs[context] = refs.get(context, 0) + 1
+        finally:
+            self._lock.release()
+
+        if first:
+            stream = self.router.stream_by_id(src_id)
+            if stream is None:
+                self._on_client_disconnect(src_id)
+            else:
+                stream._broker.defer(self._watch_client, src_id, stream)
+
+    def _watch_client(self, src_id, stream):
+        """
+        Subscribe to disconnection of the stream for client `src_id`. Runs on
+        the stream's Broker thread, so the stream cannot disconnect between
+        the check and subscribing.
+        """
+        if self.router.stream_by_id(src_id) is not stream:
+            self._on_client_disconnect(src_id)
+        else:
+            mitogen.core.listen(stream, 'disconnect',
+                                lambda: self._on_client_disconnect(src_id))
+
+    def _on_client_disconnect(self, src_id):
+        """
+        Release every reference still held by the client `src_id`.
+        """
+        self._lock.acquire()
+        try:
+            refs = self._refs_by_client.pop(src_id, {})
+            for context, count in refs.items():
+                if count:
+                    LOG.debug('%r: releasing %d references to %r held by '
+                              'departed client %d', self, count, context,
+                              src_id)
+                    self._release(context, count)
+        finally:
+            self._lock.release()
 
     def key_from_kwargs(self, **kwargs):
         """
@@ -142,6 +236,58 @@ class ContextService(mitogen.service.Service):
             self._lock.release()
         return count
 
+    def _forget(self, context):
+        """
+        Delete any record of `context`. The lock must be held.
+        """
+        key = self._key_by_context.pop(context)
+        self._response_by_key.pop(key, None)
+        self._refs_by_context.pop(context, None)
+        self._idle_since_by_context.pop(context, None)
+        self._lru_by_via.pop(context, None)
+        via = self._via_by_context.pop(context, None)
+        lru = self._lru_by_via.get(via)
+        if lru and context in lru:
+            lru.remove(context)
+        self._forget_client_refs(context)
+
+    def _forget_client_refs(self, context):
+        """
+        Delete any client's references to `context`. The lock must be held.
+        """
+        for refs in self._refs_by_client.itervalues():
+            refs.pop(context, None)
+
+    def _reap_idle(self):
+        """
+        Shut down contexts that have been unreferenced for longer than
+        :attr:`idle_ttl`, other than those still acting as via= for another
+        context. This method runs in the Broker thread and must not block.
+        """
+        deadline = time.time() - self.idle_ttl
+        self._lock.acquire()
+        try:
+            idle = [
+                context
+                for context, refs in self._refs_by_context.items()
+                if refs == 0
+                and not self._lru_by_via.get(context)
+                and self._idle_since_by_context.get(context, 0) < deadline
+            ]
+            for context in idle:
+                self._forget(context)
+        finally:
+            self._lock.release()
+
+        for context in idle:
+            LOG.info('%r: shutting down %r, idle for over %ds',
+                     self, context, self.idle_ttl)
+            context.shutdown()
+
+    def on_shutdown(self):
+        if self.idle_ttl is not None:
+            self.router.broker.cancel(self._reap_timer)
+
     def _shutdown(self, context, lru=None, new_context=None):
         """
         Arrange for `context` to be shut down, and optionally add `new_context`
@@ -156,7 +302,10 @@ class ContextService(mitogen.service.Service):
         try:
             del self._response_by_key[key]
             del self._refs_by_context[context]
+            self._forget_client_refs(context)
             del self._key_by_context[context]
+            self._idle_since_by_context.pop(context, None)
+            self._via_by_context.pop(context, None)
             if lru:
                 lru.remove(context)
             if new_context:
@@ -205,15 +354,18 @@ class ContextService(mitogen.service.Service):
         # in _latches_by_key below.
         self._lock.acquire()
         try:
-            for context, key in list(self._key_by_context.items()):
-                if context.context_id in stream.routes:
+            for context_id in stream.routes:
+                context = self.router.context_by_id(context_id, create=False)
+                key = self._key_by_context.pop(context, None)
+                if key is not None:
                     LOG.info('Dropping %r due to disconnect of %r',
                              context, stream)
                     self._response_by_key.pop(key, None)
                     self._latches_by_key.pop(key, None)
                     self._refs_by_context.pop(context, None)
+                    self._idle_since_by_context.pop(context, None)
+                    self._via_by_context.pop(context, None)
                     self._lru_by_via.pop(context, None)
-                    self._refs_by_context.pop(context, None)
         finally:
             self._lock.release()
 
@@ -247,6 +399,7 @@ class ContextService(mitogen.service.Service):
 
         context = method(via=via, **spec['kwargs'])
         if via:
+            self._via_by_context[context] = via
             self._update_lru(context, spec, via)
         else:
             # For directly connected contexts, listen to the associated
@@ -268,6 +421,7 @@ class ContextService(mitogen.service.Service):
 
         self._key_by_context[context] = key
         self._refs_by_context[context] = 0
+        self._idle_since_by_context[context] = time.time()
         return {
             'context': context,
             'home_dir': home_dir,
@@ -333,6 +487,7 @@ class ContextService(mitogen.service.Service):
                     e1, e2, e3 = result
                     raise e1, e2, e3
                 via = result['context']
+                self._add_client_ref(msg.src_id, via)
             except mitogen.core.StreamError as e:
                 return {
                     'context': None,
@@ -351,12 +506,13 @@ class FileService(mitogen.service.Service):
     the service by a trusted context before they will be served to an untrusted
     context.
 
-    The file service nominally lives on the mitogen.service.Pool() threads
-    shared with ContextService above, however for simplicity it also maintains
-    a dedicated thread from where file chunks are scheduled.
+    The file service lives on the mitogen.service.Pool() threads shared with
+    ContextService above, which read file chunks ahead of each stream. The
+    chunks are pumped into the stream by its Broker thread, driven by the
+    'pause' and 'resume' signals of each stream.
 
-    The scheduler thread is responsible for dividing transfer requests up among
-    the physical streams that connect to those contexts, and ensure each stream
+    The scheduler is responsible for dividing transfer requests up among the
+    physical streams that connect to those contexts, and ensure each stream
     never has an excessive amount of data buffered in RAM at any time.
 
     Transfers proceeed one-at-a-time per stream. When multiple contexts exist
@@ -372,15 +528,18 @@ class FileService(mitogen.service.Service):
            file available to any untrusted context.
         2. Untrusted context creates a mitogen.core.Receiver() to receive
            file chunks. It then calls fetch(path, recv.to_sender()), which sets
-           up the transfer. The fetch() method returns the final file size and
-           notifies the dedicated thread of the transfer request.
-        3. The dedicated thread wakes from perpetual sleep, looks up the stream
-           used to communicate with the untrusted context, and begins pumping
-           128KiB-sized chunks until that stream's output queue reaches a
-           limit (1MiB).
-        4. The thread sleeps for 10ms, wakes, and pumps new chunks as necessary
-           to refill any drained output queue, which are being asynchronously
-           drained by the Stream implementation running on the Broker thread.
+           up the transfer. The fetch() method returns the final file size
+           after reading up to 1MiB of 128KiB-sized chunks ahead, and handing
+           them to the Broker thread owning the stream used to communicate
+           with the untrusted context.
+        3. That Broker thread pumps the chunks as raw messages, avoiding
+           pickle on both ends, until they run out or that stream's output
+           queue reaches its high watermark (1MiB), at which point the stream
+           is paused. Once less than half of the read-ahead remains, the
+           Broker asks the service pool to read more by sending read_ahead()
+           to itself.
+        4. When the Stream implementation drains the output queue to its low
+           watermark, the stream fires 'resume', and more chunks are pumped.
         5. Once the last chunk has been pumped for a single transfer,
            Sender.close() is called causing the receive loop in
            target.py::_get_file() to exit, and allows that code to compare the
@@ -388,22 +547,19 @@ class FileService(mitogen.service.Service):
            value of the fetch() method.
         6. If the sizes mismatch, the caller is informed, which will discard
            the result and log an error.
-        7. Once all chunks have been pumped for all transfers, the dedicated
-           thread stops waking at 10ms intervals and resumes perpetual sleep.
+        7. If the stream disconnects, any remaining transfers on it are
+           discarded.
 
     Shutdown:
         1. process.py calls service.Pool.shutdown(), which arranges for all the
            service pool threads to exit and be joined, guranteeing no new
            requests can arrive, before calling Service.on_shutdown() for each
            registered service.
-        2. FileService.on_shutdown() marks the dedicated thread's queue as
-           closed, causing the dedicated thread to wake immediately. It will
-           throw an exception that begins shutdown of the main loop.
-        3. The main loop calls Sender.close() prematurely for every pending
-           transfer, causing any Receiver loops in the target contexts to exit
-           early. The file size check fails, and the partially downloaded file
-           is discarded, and an error is logged.
-        4. Control exits the file transfer function in every target, and
+        2. FileService.on_shutdown() calls Sender.close() prematurely for
+           every pending transfer, causing any Receiver loops in the target
+           contexts to exit early. The file size check fails, and the
+           partially downloaded file is discarded, and an error is logged.
+        3. Control exits the file transfer function in every target, and
            graceful target shutdown can proceed normally, without the
            associated thread needing to be forcefully killed.
     """
@@ -411,131 +567,255 @@ class FileService(mitogen.service.Service):
     max_message_size = 1000
     unregistered_msg = 'Path is not registered with FileService.'
 
-    #: Maximum size of any stream's output queue before we temporarily stop
-    #: pumping more file chunks on that stream. The queue may overspill by up
-    #: to mitogen.core.CHUNK_SIZE-1 bytes (128KiB-1).
-    max_queue_size = 1048576
-
-    #: Time spent by the scheduler thread asleep when it has no more data to
-    #: pump, but while at least one transfer remains active. With
-    #: max_queue_size=1MiB and a sleep of 10ms, maximum throughput on any
-    #: single stream is 112MiB/sec, which is >5x what SSH can handle on my
-    #: laptop.
-    sleep_delay_secs = 0.01
+    #: Bytes of file data read ahead of each stream by the service pool, and
+    #: waiting to be pumped into the stream by its Broker thread. The pool is
+    #: asked for more once less than half remains.
+    read_ahead_size = 1048576
 
     def __init__(self, router):
         super(FileService, self).__init__(router)
         #: Mapping of registered path -> file size.
         self._size_by_path = {}
-        #: Queue used to communicate from service to scheduler thread.
-        self._queue = mitogen.core.Latch()
-        #: Mapping of Stream->[(Sender, file object)].
+        #: Mapping of Stream->[(Sender, file object)] of transfers whose file
+        #: is still being read.
         self._pending_by_stream = {}
-        self._thread = threading.Thread(target=self._scheduler_main)
-        self._thread.start()
+        #: Mapping of Stream->[(Sender, chunk)] read by the service pool and
+        #: awaiting the Broker. A chunk of :data:`None` marks the end of the
+        #: sender's file.
+        self._ready_by_stream = {}
+        #: Mapping of Stream->total size of its chunks in
+        #: :attr:`_ready_by_stream`.
+        self._ready_bytes = {}
+        #: Mapping of Stream->file object for streams whose files are being
+        #: read by a service pool thread. At most one thread reads for each
+        #: stream.
+        self._reading = {}
+        #: Streams whose signals we are subscribed to.
+        self._listened = set()
+        self._closed = False
+        #: Protects all of the above, since pool threads read ahead while each
+        #: stream's Broker thread, which may differ between streams when the
+        #: router is sharded, pumps chunks.
+        self._lock = threading.Lock()
 
     def on_shutdown(self):
         """
-        Respond to shutdown of the service pool by marking our queue closed.
-        This causes :meth:`_sleep_on_queue` to wake immediately and return
-        :data:`False`, causing the scheduler main thread to exit.
+        Respond to shutdown of the service pool by abandoning every pending
+        transfer.
+        """
+        self.router.broker.defer(self._on_shutdown)
+
+    def _on_shutdown(self):
+        LOG.debug('%r._on_shutdown()', self)
+        self._lock.acquire()
+        try:
+            self._closed = True
+            # Send close() on every sender to give targets a chance to shut
+            # down gracefully. The pool has exitted, so no file is being read.
+            for stream in list(self._listened):
+                for sender, fp in self._forget(stream):
+                    if sender:
+                        sender.close()
+                    if fp:
+                        fp.close()
+        finally:
+            self._lock.release()
+
+    def _forget(self, stream):
+        """
+        Discard the state for `stream`, returning `(sender, file object)` for
+        each transfer that has not finished. Either may be :data:`None`, since
+        a transfer may have been fully read but not pumped, and the file being
+        read by a pool thread is left for it to close. Must be called with
+        :attr:`_lock` held.
+        """
+        reading = self._reading.pop(stream, None)
+        result = [(sender, fp is not reading and fp or None)
+                  for sender, fp in self._pending_by_stream.pop(stream, ())]
+        senders = set(sender for sender, _ in result)
+        for sender, chunk in self._ready_by_stream.pop(stream, ()):
+            if chunk is None:
+                senders.discard(sender)  # Fully read; close() is due.
+            elif sender not in senders:
+                senders.add(sender)
+                result.append((sender, None))
+        self._ready_bytes.pop(stream, None)
+        return result
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'context_id': int,
+    })
+    def read_ahead(self, context_id):
+        """
+        Read file chunks for the stream connected to `context_id` until
+        :attr:`read_ahead_size` bytes are ready or every transfer on it is
+        fully read, then hand them to the stream's Broker thread. Invoked on a
+        service pool thread by a message from :meth:`_pump`.
         """
-        self._queue.close()
+        stream = self.router.stream_by_id(context_id)
+        if stream is None:
+            LOG.debug('%r.read_ahead(): context %d disconnected',
+                      self, context_id)
+        else:
+            self._read_ahead(stream)
+        return self.NO_REPLY
 
-    def _pending_bytes(self, stream):
+    def _read_ahead(self, stream):
+        """
+        Implement :meth:`read_ahead`. The caller must have recorded `stream`
+        in :attr:`_reading`.
         """
-        Defer a function call to the Broker thread in order to accurately
-        measure the bytes pending in `stream`'s queue.
+        self._lock.acquire()
+        try:
+            while True:
+                pending = self._pending_by_stream.get(stream)
+                if not (pending and
+                        self._ready_bytes[stream] < self.read_ahead_size):
+                    self._reading.pop(stream, None)
+                    break
+
+                sender, fp = pending[0]
+                self._reading[stream] = fp
+                self._lock.release()
+                try:
+                    s = fp.read(mitogen.core.CHUNK_SIZE)
+                finally:
+                    self._lock.acquire()
+
+                if self._pending_by_stream.get(stream) is not pending:
+                    # The stream disconnected while we were reading.
+                    fp.close()
+                    return
+
+                self._ready_by_stream[stream].append((sender, s or None))
+                self._ready_bytes[stream] += len(s)
+                if not s:
+                    # This file is fully read. Remove our entry from the
+                    # pending list, and delete the stream's entry in the
+                    # pending map if no more transfers remain.
+                    fp.close()
+                    pending.pop(0)
+                    if not pending:
+                        del self._pending_by_stream[stream]
+        finally:
+            self._lock.release()
+
+        stream._broker.defer(self._pump, stream)
 
-        This must be done synchronized with the Broker, as OS scheduler
-        uncertainty could cause Sender.send()'s deferred enqueues to be
-        processed very late, making the output queue look much emptier than it
-        really is (or is about to become).
+    def _pump(self, stream):
         """
-        latch = mitogen.core.Latch()
-        self.router.broker.defer(lambda: latch.put(stream.pending_bytes()))
-        return latch.get()
-
-    def _schedule_pending(self, stream, pending):
-        """
-        Consider the pending file transfers for a single stream, pumping new
-        file chunks into the stream's queue while its size is below the
-        configured limit.
-
-        :param mitogen.core.Stream stream:
-            Stream to pump chunks for.
-        :param pending:
-            Corresponding list from :attr:`_pending_by_stream`.
-        """
-        while pending and self._pending_bytes(stream) < self.max_queue_size:
-            sender, fp = pending[0]
-            s = fp.read(mitogen.core.CHUNK_SIZE)
-            if s:
-                sender.send(s)
-                continue
-
-            # Empty read, indicating this file is fully transferred. Mark the
-            # sender closed (causing the corresponding Receiver loop in the
-            # target to exit), close the file handle, remove our entry from the
-            # pending list, and delete the stream's entry in the pending map if
-            # no more sends remain.
-            sender.close()
-            fp.close()
-            pending.pop(0)
-            if not pending:
-                del self._pending_by_stream[stream]
+        Pump chunks read ahead for `stream` into its queue until it is paused,
+        and ask the service pool for more once less than half of
+        :attr:`read_ahead_size` remains. Runs on the stream's Broker thread.
 
-    def _sleep_on_queue(self):
+        Chunks are enqueued directly on the stream rather than routed, since
+        routing may defer the send to another thread, and the loop would never
+        observe the stream pausing.
         """
-        Sleep indefinitely (no active transfers) or for
-        :attr:`sleep_delay_secs` (active transfers) waiting for a new transfer
-        request to arrive from the :meth:`fetch` method.
+        self._lock.acquire()
+        try:
+            ready = self._ready_by_stream.get(stream)
+            if ready is None:
+                return  # Disconnected or shut down.
+
+            while ready and not stream.output_paused:
+                sender, s = ready.pop(0)
+                if s is None:
+                    # Mark the sender closed, causing the corresponding
+                    # Receiver loop in the target to exit.
+                    sender.close()
+                    continue
+                self._ready_bytes[stream] -= len(s)
+                msg = mitogen.core.Message.raw(s, handle=sender.dst_handle,
+                                               flags=mitogen.core.FLAG_BULK)
+                msg.dst_id = sender.context.context_id
+                stream._send(msg)
+
+            if (stream in self._reading or
+                    stream not in self._pending_by_stream or
+                    2 * self._ready_bytes[stream] >= self.read_ahead_size):
+                return
+            self._reading[stream] = None
+        finally:
+            self._lock.release()
 
-        If a new request arrives, add it to the appropriate list in
-        :attr:`_pending_by_stream`.
+        self.router.route(
+            mitogen.core.Message.pickled(
+                ('read_ahead', {'context_id': stream.remote_id}),
+                dst_id=mitogen.context_id,
+                handle=self.handle,
+            )
+        )
 
-        :returns:
-            :data:`True` the scheduler's queue is still open,
-            :meth:`on_shutdown` hasn't been called yet, otherwise
-            :data:`False`.
+    def _on_resume(self, stream):
         """
-        if self._pending_by_stream:
-            timeout = self.sleep_delay_secs
-        else:
-            timeout = None
+        Respond to `stream` draining to its low watermark by pumping more
+        chunks.
+        """
+        self._pump(stream)
 
+    def _on_disconnect(self, stream):
+        """
+        Respond to `stream` disconnecting by discarding its transfers.
+        """
+        self._lock.acquire()
         try:
-            sender, fp = self._queue.get(timeout=timeout)
-        except mitogen.core.LatchError:
-            return False
-        except mitogen.core.TimeoutError:
-            return True
-
-        LOG.debug('%r._sleep_on_queue(): setting up %r for %r',
-                  self, fp.name, sender)
-        stream = self.router.stream_by_id(sender.context.context_id)
-        pending = self._pending_by_stream.setdefault(stream, [])
-        pending.append((sender, fp))
-        return True
-
-    def _scheduler_main(self):
-        """
-        Scheduler thread's main function. Sleep until
-        :meth:`_sleep_on_queue` indicates the queue has been shut down,
-        pumping pending file chunks each time we wake.
-        """
-        while self._sleep_on_queue():
-            for stream, pending in list(self._pending_by_stream.items()):
-                self._schedule_pending(stream, pending)
-
-        # on_shutdown() has been called. Send close() on every sender to give
-        # targets a chance to shut down gracefully.
-        LOG.debug('%r._scheduler_main() shutting down', self)
-        for _, pending in self._pending_by_stream.items():
-            for sender, fp in pending:
-                sender.close()
+            self._listened.discard(stream)
+            abandoned = self._forget(stream)
+        finally:
+            self._lock.release()
+
+        for sender, fp in abandoned:
+            if fp:
+                LOG.debug('%r: abandoning %r for %r', self, fp.name, sender)
                 fp.close()
 
+    def _listen(self, stream):
+        """
+        Subscribe to signals from `stream`. Must be called with :attr:`_lock`
+        held.
+        """
+        if stream not in self._listened:
+            self._listened.add(stream)
+            mitogen.core.listen(stream, 'resume',
+                                lambda: self._on_resume(stream))
+            mitogen.core.listen(stream, 'disconnect',
+                                lambda: self._on_disconnect(stream))
+
+    def _start_transfer(self, stream, sender, fp):
+        """
+        Add a transfer requested by :meth:`fetch` to the appropriate list in
+        :attr:`_pending_by_stream`, and begin reading it ahead unless a pool
+        thread is already reading for the stream. Runs on the service pool
+        thread that invoked :meth:`fetch`.
+        """
+        # Keep chunks from delaying RPC replies and module loads on the stream.
+        sender.bulk = True
+        self._lock.acquire()
+        try:
+            closed = self._closed
+            if not closed:
+                LOG.debug('%r._start_transfer(): setting up %r for %r',
+                          self, fp.name, sender)
+                self._listen(stream)
+                self._pending_by_stream.setdefault(stream, []).append(
+                    (sender, fp)
+                )
+                self._ready_by_stream.setdefault(stream, [])
+                self._ready_bytes.setdefault(stream, 0)
+                idle = stream not in self._reading
+                if idle:
+                    self._reading[stream] = None
+        finally:
+            self._lock.release()
+
+        if closed:
+            sender.close()
+            fp.close()
+        elif idle:
+            self._read_ahead(stream)
+
     @mitogen.service.expose(policy=mitogen.service.AllowParents())
     @mitogen.service.arg_spec({
         'path': basestring
@@ -576,5 +856,6 @@ class FileService(mitogen.service.Service):
 
         LOG.debug('Serving %r', path)
         fp = open(path, 'rb', mitogen.core.CHUNK_SIZE)
-        self._queue.put((sender, fp))
+        stream = self.router.stream_by_id(sender.context.context_id)
+        self._start_transfer(stream, sender, fp)
         return self._size_by_path[path]
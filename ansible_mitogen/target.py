@@ -93,8 +93,7 @@ def _get_file(context, path, out_fp):
         }
     )
 
-    for chunk in recv:
-        s = chunk.unpickle()
+    for s in recv.iter_bytes():
         LOG.debug('_get_file(%r): received %d bytes', path, len(s))
         out_fp.write(s)
 
@@ -29,6 +29,7 @@
 import collections
 import errno
 import fcntl
+import heapq
 import imp
 import itertools
 import logging
@@ -77,6 +78,37 @@ SHUTDOWN = 106
 LOAD_MODULE = 107
 IS_DEAD = 999
 
+#: :py:attr:`Message.flags` bit indicating :py:attr:`Message.data` is opaque
+#: bytes rather than a pickle.
+FLAG_RAW = 0x01
+
+#: :py:attr:`Message.flags` bit indicating :py:attr:`Message.data` is in the
+#: compact encoding rather than a pickle.
+FLAG_COMPACT = 0x02
+
+#: :py:attr:`Message.flags` bit indicating the message body begins with a table
+#: of :py:attr:`Message.buffers` lengths, and that the sender accepts replies
+#: carrying out-of-band buffers.
+FLAG_OOB = 0x04
+
+#: Message header flag indicating the body was compressed by the sending
+#: stream's zlib context. It is never set in :py:attr:`Message.flags`, since
+#: each hop decompresses on receipt and may recompress on transmit.
+FLAG_ZLIB = 0x08
+
+#: :py:attr:`Message.flags` bit indicating the message is one frame of a larger
+#: message. The data begins with a 4 byte fragment ID unique to the source
+#: context, followed by the next part of the original message body.
+FLAG_FRAGMENT = 0x10
+
+#: :py:attr:`Message.flags` bit set on every frame of a fragmented message
+#: except the last.
+FLAG_MORE = 0x20
+
+#: :py:attr:`Message.flags` bit placing the message in the bulk lane of every
+#: stream it crosses, behind all control traffic.
+FLAG_BULK = 0x40
+
 PY3 = sys.version_info > (3,)
 if PY3:
     b = lambda s: s.encode('latin-1')
@@ -85,6 +117,22 @@ else:
 
 CHUNK_SIZE = 131072
 _tls = threading.local()
+_fragment_ids = itertools.count(1)
+
+try:
+    _memoryview = memoryview
+except NameError:
+    _memoryview = None
+
+
+def tail_view(s, start):
+    """Return a view of `s` beginning at `start` without copying, using
+    :class:`memoryview` where available, otherwise :func:`buffer`."""
+    if not start:
+        return s
+    if _memoryview is None:
+        return buffer(s, start)
+    return _memoryview(s)[start:]
 
 
 if __name__ == 'mitogen.core':
@@ -205,7 +253,7 @@ def io_op(func, *args):
     while True:
         try:
             return func(*args), False
-        except (select.error, OSError):
+        except (select.error, OSError, IOError):
             e = sys.exc_info()[1]
             _vv and IOLOG.debug('io_op(%r) -> OSError: %s', func, e)
             if e[0] == errno.EINTR:
@@ -275,23 +323,286 @@ def enable_profiling():
                 fp.close()
 
 
+_int_struct = struct.Struct('>l')
+_len_struct = struct.Struct('>L')
+_float_struct = struct.Struct('>d')
+_sender_struct = struct.Struct('>LL')
+_header_struct = struct.Struct('>LLLLLLL')
+
+
+def _compact_len(w, tag, n):
+    if n < 256:
+        w(tag + chr(n))
+    else:
+        w(tag.upper() + _len_struct.pack(n))
+
+
+def _compact_encode(obj, w, bufs):
+    t = type(obj)
+    if t is str:
+        if bufs is not None and len(obj) >= Message.oob_threshold:
+            w('b' + _len_struct.pack(len(bufs)))
+            bufs.append(obj)
+        else:
+            _compact_len(w, 's', len(obj))
+            w(obj)
+    elif t is int and -0x80000000 <= obj <= 0x7fffffff:
+        w('i' + _int_struct.pack(obj))
+    elif t is tuple or t is list:
+        _compact_len(w, (t is tuple and 't') or 'l', len(obj))
+        for item in obj:
+            _compact_encode(item, w, bufs)
+    elif t is dict:
+        _compact_len(w, 'd', len(obj))
+        for key, value in obj.iteritems():
+            _compact_encode(key, w, bufs)
+            _compact_encode(value, w, bufs)
+    elif obj is None:
+        w('n')
+    elif t is bool:
+        w((obj and '1') or '0')
+    elif t is int:
+        s = str(obj)
+        w('I' + _len_struct.pack(len(s)) + s)
+    elif t is long:
+        # Tagged apart from int, since small longs would otherwise decode as
+        # int.
+        s = str(obj)
+        w('g' + _len_struct.pack(len(s)) + s)
+    elif t is float:
+        w('f' + _float_struct.pack(obj))
+    elif t is unicode:
+        s = obj.encode('utf-8')
+        _compact_len(w, 'u', len(s))
+        w(s)
+    elif isinstance(obj, Context):
+        w('c' + _len_struct.pack(obj.context_id))
+        _compact_encode(obj.name, w, bufs)
+    elif isinstance(obj, Sender):
+        w('r' + _sender_struct.pack(obj.context.context_id, obj.dst_handle))
+    elif isinstance(obj, CallError):
+        w('e')
+        _compact_encode(obj[0], w, bufs)
+    else:
+        raise TypeError('cannot encode %r' % (t,))
+
+
+def compact_dumps(obj, buffers=None):
+    """Serialize `obj` using the compact encoding, raising
+    :py:class:`TypeError` if it contains a type the encoding lacks. If
+    `buffers` is a list, large strings are appended to it rather than copied
+    into the result."""
+    bits = []
+    _compact_encode(obj, bits.append, buffers)
+    return ''.join(bits)
+
+
+def pickle_dumps(obj, buffers=None):
+    """Pickle `obj`. If `buffers` is a list, strings of at least
+    :py:attr:`Message.oob_threshold` bytes are appended to it and replaced in
+    the pickle by their index, in the style of pickle protocol 5."""
+    if buffers is None:
+        return cPickle.dumps(obj, protocol=2)
+
+    def persistent_id(obj, threshold=Message.oob_threshold):
+        if type(obj) is str and len(obj) >= threshold:
+            buffers.append(obj)
+            return len(buffers) - 1
+
+    fp = BytesIO()
+    pickler = cPickle.Pickler(fp, 2)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return fp.getvalue()
+
+
+def _decode_str(msg, s, pos):
+    n = ord(s[pos])
+    return s[pos+1:pos+1+n], pos + 1 + n
+
+
+def _decode_long_str(msg, s, pos):
+    n, = _len_struct.unpack_from(s, pos)
+    return s[pos+4:pos+4+n], pos + 4 + n
+
+
+def _decode_unicode(msg, s, pos):
+    obj, pos = _decode_str(msg, s, pos)
+    return obj.decode('utf-8'), pos
+
+
+def _decode_long_unicode(msg, s, pos):
+    obj, pos = _decode_long_str(msg, s, pos)
+    return obj.decode('utf-8'), pos
+
+
+def _decode_items(msg, s, pos, n):
+    items = []
+    append = items.append
+    for x in xrange(n):
+        obj, pos = _compact_decoders[s[pos]](msg, s, pos + 1)
+        append(obj)
+    return items, pos
+
+
+def _decode_list(msg, s, pos):
+    return _decode_items(msg, s, pos + 1, ord(s[pos]))
+
+
+def _decode_long_list(msg, s, pos):
+    return _decode_items(msg, s, pos + 4, _len_struct.unpack_from(s, pos)[0])
+
+
+def _decode_tuple(msg, s, pos):
+    items, pos = _decode_list(msg, s, pos)
+    return tuple(items), pos
+
+
+def _decode_long_tuple(msg, s, pos):
+    items, pos = _decode_long_list(msg, s, pos)
+    return tuple(items), pos
+
+
+def _decode_dict(msg, s, pos):
+    items, pos = _decode_items(msg, s, pos + 1, 2 * ord(s[pos]))
+    return dict(zip(items[::2], items[1::2])), pos
+
+
+def _decode_long_dict(msg, s, pos):
+    n, = _len_struct.unpack_from(s, pos)
+    items, pos = _decode_items(msg, s, pos + 4, 2 * n)
+    return dict(zip(items[::2], items[1::2])), pos
+
+
+def _decode_int(msg, s, pos):
+    return _int_struct.unpack_from(s, pos)[0], pos + 4
+
+
+def _decode_big_int(msg, s, pos):
+    obj, pos = _decode_long_str(msg, s, pos)
+    return int(obj), pos
+
+
+def _decode_long(msg, s, pos):
+    obj, pos = _decode_long_str(msg, s, pos)
+    return long(obj), pos
+
+
+def _decode_float(msg, s, pos):
+    return _float_struct.unpack_from(s, pos)[0], pos + 8
+
+
+def _decode_context(msg, s, pos):
+    context_id, = _len_struct.unpack_from(s, pos)
+    name, pos = _compact_decoders[s[pos+4]](msg, s, pos + 5)
+    return msg._unpickle_context(context_id, name), pos
+
+
+def _decode_sender(msg, s, pos):
+    context_id, handle = _sender_struct.unpack_from(s, pos)
+    return msg._unpickle_sender(context_id, handle), pos + 8
+
+
+def _decode_buffer(msg, s, pos):
+    index, = _len_struct.unpack_from(s, pos)
+    return msg._load_buffer(index), pos + 4
+
+
+def _decode_call_error(msg, s, pos):
+    text, pos = _compact_decoders[s[pos]](msg, s, pos + 1)
+    return _unpickle_call_error(text), pos
+
+
+_compact_decoders = {
+    's': _decode_str,
+    'S': _decode_long_str,
+    'u': _decode_unicode,
+    'U': _decode_long_unicode,
+    'l': _decode_list,
+    'L': _decode_long_list,
+    't': _decode_tuple,
+    'T': _decode_long_tuple,
+    'd': _decode_dict,
+    'D': _decode_long_dict,
+    'i': _decode_int,
+    'I': _decode_big_int,
+    'g': _decode_long,
+    'f': _decode_float,
+    'n': lambda msg, s, pos: (None, pos),
+    '1': lambda msg, s, pos: (True, pos),
+    '0': lambda msg, s, pos: (False, pos),
+    'c': _decode_context,
+    'r': _decode_sender,
+    'e': _decode_call_error,
+    'b': _decode_buffer,
+}
+
+
+def compact_loads(s, msg):
+    """Deserialize the compact encoding `s`, constructing contexts and senders
+    using the router of the :py:class:`Message` `msg`."""
+    try:
+        obj, pos = _compact_decoders[s[0]](msg, s, 1)
+    except KeyError:
+        raise ValueError('bad tag')
+    if pos != len(s):
+        raise ValueError('truncated or trailing data')
+    return obj
+
+
+#: Value of :py:attr:`Message._unpickled` until the message is deserialized.
+_NOT_UNPICKLED = object()
+
+
 class Message(object):
-    dst_id = None
-    src_id = None
-    auth_id = None
-    handle = None
-    reply_to = None
-    data = ''
-    _unpickled = object()
+    # A router may handle hundreds of thousands of messages per second, so
+    # avoid the per-instance dict and the cost of populating it.
+    __slots__ = ('dst_id', 'src_id', 'auth_id', 'handle', 'reply_to', 'flags',
+                 'data', 'buffers', 'router', 'receiver', '_unpickled')
+
+    #: Codec used by :py:meth:`pickled` when none is given: 0 for pickle, or
+    #: :py:data:`FLAG_COMPACT` for the compact encoding. cPickle is faster
+    #: than the compact encoding, so it is preferred unless only the pure
+    #: Python pickle module is available.
+    codec = (cPickle.__name__ == 'pickle' and not PY3 and FLAG_COMPACT) or 0
+
+    #: Strings at least this long are sent as out-of-band
+    #: :py:attr:`buffers` when the codec includes :py:data:`FLAG_OOB`.
+    oob_threshold = 32768
+
+    def __init__(self, dst_id=None, src_id=None, auth_id=None, handle=None,
+                 reply_to=None, flags=0, data='', buffers=(), router=None,
+                 receiver=None):
+        self.dst_id = dst_id
+        if src_id is None:
+            src_id = mitogen.context_id
+        self.src_id = src_id
+        if auth_id is None:
+            auth_id = mitogen.context_id
+        self.auth_id = auth_id
+        self.handle = handle
+        self.reply_to = reply_to
+        self.flags = flags
+        assert isinstance(data, str)
+        self.data = data
+        #: When :py:data:`FLAG_OOB` is set, large strings referenced by
+        #: :py:attr:`data` that travel as separate segments of the frame.
+        self.buffers = buffers
+        self.router = router
+        self.receiver = receiver
+        self._unpickled = _NOT_UNPICKLED
+
+    #: Attributes preserved by pickling: the header fields and body only,
+    #: since the router and receiver are local to this process.
+    _pickled_fields = ('dst_id', 'src_id', 'auth_id', 'handle', 'reply_to',
+                       'flags', 'data', 'buffers')
 
-    router = None
-    receiver = None
+    def __getstate__(self):
+        return dict((name, getattr(self, name))
+                    for name in self._pickled_fields)
 
-    def __init__(self, **kwargs):
-        self.src_id = mitogen.context_id
-        self.auth_id = mitogen.context_id
-        vars(self).update(kwargs)
-        assert isinstance(self.data, str)
+    def __setstate__(self, state):
+        self.__init__(**state)
 
     def _unpickle_context(self, context_id, name):
         return _unpickle_context(self.router, context_id, name)
@@ -299,6 +610,12 @@ class Message(object):
     def _unpickle_sender(self, context_id, dst_handle):
         return _unpickle_sender(self.router, context_id, dst_handle)
 
+    def _load_buffer(self, index):
+        if not (isinstance(index, (int, long)) and
+                0 <= index < len(self.buffers)):
+            raise ValueError('bad out-of-band buffer reference')
+        return self.buffers[index]
+
     def _find_global(self, module, func):
         """Return the class implementing `module_name.class_name` or raise
         `StreamError` if the module is not whitelisted."""
@@ -316,15 +633,46 @@ class Message(object):
     def is_dead(self):
         return self.reply_to == IS_DEAD
 
+    @property
+    def is_raw(self):
+        return bool(self.flags & FLAG_RAW)
+
+    @property
+    def is_bulk(self):
+        return bool(self.flags & FLAG_BULK)
+
     @classmethod
     def dead(cls, **kwargs):
         return cls(reply_to=IS_DEAD, **kwargs)
 
     @classmethod
-    def pickled(cls, obj, **kwargs):
+    def raw(cls, data, **kwargs):
+        self = cls(data=data, **kwargs)
+        self.flags |= FLAG_RAW
+        return self
+
+    @classmethod
+    def pickled(cls, obj, codec=None, **kwargs):
         self = cls(**kwargs)
+        if codec is None:
+            codec = cls.codec
+        buffers = None
+        if codec & FLAG_OOB:
+            buffers = []
+            self.flags |= FLAG_OOB
+        if codec & FLAG_COMPACT:
+            try:
+                self.data = compact_dumps(obj, buffers)
+                self.flags |= FLAG_COMPACT
+                self.buffers = buffers or ()
+                return self
+            except TypeError:
+                # Unsupported type, fall back to pickle.
+                if buffers:
+                    del buffers[:]
         try:
-            self.data = cPickle.dumps(obj, protocol=2)
+            self.data = pickle_dumps(obj, buffers)
+            self.buffers = buffers or ()
         except cPickle.PicklingError:
             e = sys.exc_info()[1]
             self.data = cPickle.dumps(CallError(e), protocol=2)
@@ -332,22 +680,36 @@ class Message(object):
 
     def reply(self, msg, router=None, **kwargs):
         if not isinstance(msg, Message):
-            msg = Message.pickled(msg)
+            msg = Message.pickled(msg,
+                                  codec=self.flags & (FLAG_COMPACT | FLAG_OOB))
         msg.dst_id = self.src_id
         msg.handle = self.reply_to
-        vars(msg).update(kwargs)
+        for name, value in kwargs.iteritems():
+            setattr(msg, name, value)
         (self.router or router).route(msg)
 
     def unpickle(self, throw=True, throw_dead=True):
-        """Deserialize `data` into an object."""
+        """Deserialize `data` into an object, or return it unchanged if the
+        message is raw."""
         _vv and IOLOG.debug('%r.unpickle()', self)
         if throw_dead and self.is_dead:
             raise ChannelError(ChannelError.remote_msg)
+        if self.flags & FLAG_RAW:
+            return self.data
 
         obj = self._unpickled
-        if obj is Message._unpickled:
+        if obj is _NOT_UNPICKLED and self.flags & FLAG_COMPACT:
+            try:
+                obj = compact_loads(self.data, self)
+                self._unpickled = obj
+            except (TypeError, ValueError, IndexError, RuntimeError,
+                    struct.error):
+                e = sys.exc_info()[1]
+                raise StreamError('invalid message: %s', e)
+        elif obj is _NOT_UNPICKLED:
             fp = BytesIO(self.data)
             unpickler = cPickle.Unpickler(fp)
+            unpickler.persistent_load = self._load_buffer
             try:
                 unpickler.find_global = self._find_global
             except AttributeError:
@@ -368,16 +730,19 @@ class Message(object):
         return obj
 
     def __repr__(self):
-        return 'Message(%r, %r, %r, %r, %r, %r..%d)' % (
+        return 'Message(%r, %r, %r, %r, %r, %#x, %r..%d)' % (
             self.dst_id, self.src_id, self.auth_id, self.handle,
-            self.reply_to, (self.data or '')[:50], len(self.data)
+            self.reply_to, self.flags, (self.data or '')[:50], len(self.data)
         )
 
 
 class Sender(object):
-    def __init__(self, context, dst_handle):
+    def __init__(self, context, dst_handle, bulk=False):
         self.context = context
         self.dst_handle = dst_handle
+        #: If :data:`True`, messages are sent in the bulk lane of each stream,
+        #: so they never delay control traffic. Not preserved by pickling.
+        self.bulk = bulk
 
     def __repr__(self):
         return 'Sender(%r, %r)' % (self.context, self.dst_handle)
@@ -385,15 +750,27 @@ class Sender(object):
     def __reduce__(self):
         return _unpickle_sender, (self.context.context_id, self.dst_handle)
 
+    def _flags(self):
+        return (self.bulk and FLAG_BULK) or 0
+
     def close(self):
         """Indicate this channel is closed to the remote side."""
         _vv and IOLOG.debug('%r.close()', self)
-        self.context.send(Message.dead(handle=self.dst_handle))
+        self.context.send(Message.dead(handle=self.dst_handle,
+                                       flags=self._flags()))
 
     def send(self, data):
         """Send `data` to the remote."""
         _vv and IOLOG.debug('%r.send(%r..)', self, repr(data)[:100])
-        self.context.send(Message.pickled(data, handle=self.dst_handle))
+        self.context.send(Message.pickled(data, handle=self.dst_handle,
+                                          flags=self._flags()))
+
+    def send_bytes(self, data):
+        """Send the string `data` to the remote as a raw message, skipping
+        pickle on both ends."""
+        _vv and IOLOG.debug('%r.send_bytes(%r..)', self, data[:100])
+        self.context.send(Message.raw(data, handle=self.dst_handle,
+                                      flags=self._flags()))
 
 
 def _unpickle_sender(router, context_id, dst_handle):
@@ -455,11 +832,18 @@ class Receiver(object):
         while True:
             try:
                 msg = self.get()
-                msg.unpickle()  # Cause .remote_msg to be thrown.
+                if not msg.is_raw:
+                    msg.unpickle()  # Cause .remote_msg to be thrown.
                 yield msg
             except ChannelError:
                 return
 
+    def iter_bytes(self):
+        """Yield the data of each raw message received until the channel is
+        closed, without unpickling."""
+        for msg in self:
+            yield msg.unpickle()
+
 
 class Channel(Sender, Receiver):
     def __init__(self, router, context, dst_handle, handle=None):
@@ -756,7 +1140,13 @@ class Side(object):
         if self.fd is None:
             return None
 
-        written, disconnected = io_op(os.write, self.fd, s)
+        try:
+            written, disconnected = io_op(os.write, self.fd, s)
+        except OSError:
+            e = sys.exc_info()[1]
+            if e[0] != errno.EAGAIN:
+                raise
+            return 0
         if disconnected:
             return None
         return written
@@ -791,8 +1181,55 @@ class Stream(BasicStream):
     #: :py:attr:`Message.auth_id` of every message received on this stream.
     auth_id = None
 
+    #: Queued packets smaller than this are coalesced by :meth:`on_transmit`
+    #: into a single write of at most this many bytes.
+    max_transmit_size = 4 * CHUNK_SIZE
+
+    #: When :meth:`pending_bytes` reaches this, :attr:`output_paused` is set
+    #: and the ``pause`` signal fires. Bulk producers should stop sending
+    #: until ``resume``.
+    output_high_watermark = 8 * CHUNK_SIZE
+
+    #: When a paused stream drains to this, :attr:`output_paused` is cleared
+    #: and the ``resume`` signal fires.
+    output_low_watermark = 2 * CHUNK_SIZE
+
+    #: :data:`True` between the ``pause`` and ``resume`` signals.
+    output_paused = False
+
+    #: Codec negotiated at bootstrap for calls made over this stream, as a
+    #: :py:attr:`Message.flags` bit, or :data:`None` to use
+    #: :py:attr:`Message.codec`.
+    codec = None
+
+    #: If :data:`True`, the peer understands :py:data:`FLAG_OOB`, so calls
+    #: made over this stream may carry out-of-band buffers.
+    oob = False
+
+    #: If not :data:`None`, the zlib level used to compress messages written
+    #: to this stream. Negotiated at bootstrap, since the peer compresses its
+    #: own output using the same level.
+    zlib_level = None
+
+    #: Messages whose body is smaller than this are not compressed.
+    zlib_threshold = 512
+
+    #: If not :data:`None`, messages originating in this context whose body
+    #: exceeds this many bytes are split into frames of at most this size.
+    #: Frames are interleaved with other traffic, forwarded individually by
+    #: intermediate contexts, and reassembled at the destination, or by the
+    #: last hop before a peer that does not support fragmentation.
+    #: Negotiated at bootstrap.
+    fragment_size = None
+
+    #: Limit on the total size of partially reassembled messages buffered by
+    #: the stream, as a multiple of :py:attr:`Router.max_message_size`.
+    #: Exceeding it disconnects the stream.
+    reassembly_factor = 2
+
     def __init__(self, router, remote_id, **kwargs):
         self._router = router
+        self._broker = router.broker_for(remote_id)
         self.remote_id = remote_id
         self.name = 'default'
         self.sent_modules = set()
@@ -801,10 +1238,60 @@ class Stream(BasicStream):
         self._output_buf = collections.deque()
         self._input_buf_len = 0
         self._output_buf_len = 0
+        #: Bytes of the first element of :attr:`_input_buf` already consumed.
+        self._input_offset = 0
+        #: Bytes of the first element of :attr:`_output_buf` already written.
+        self._output_offset = 0
+        #: Held while touching :attr:`_output_buf` or writing to
+        #: :attr:`transmit_side` when :attr:`Router.direct_write` is enabled,
+        #: since :meth:`_send_direct` may then do both from a thread other
+        #: than the broker.
+        self._output_lock = threading.Lock()
+        #: One element for each message :meth:`_send_direct` has deferred to
+        #: the broker that is not yet queued. List methods are atomic.
+        self._direct_deferred = []
+        #: Set under :attr:`_output_lock` before the descriptors are closed.
+        self._output_closed = False
+        #: zlib contexts shared by every compressed message in each direction,
+        #: created on first use.
+        self._compressor = None
+        self._decompressor = None
+        #: `(generator, key)` yielding the frames of control lane messages
+        #: being fragmented, served in turn whenever :attr:`_output_buf`
+        #: drains.
+        self._fragmenting = collections.deque()
+        #: Bulk lane messages, queued one at a time once :attr:`_output_buf`
+        #: and :attr:`_fragmenting` are empty.
+        self._bulk_buf = collections.deque()
+        #: `(generator, key)` for the bulk lane message being fragmented.
+        self._bulk_frames = None
+        #: Map of `(dst_id, handle)` for each message being fragmented to the
+        #: list of later messages for the same handle, which must not
+        #: overtake it.
+        self._fragment_backlog = {}
+        #: Map of `(src_id, fragment ID)` to `[size, chunks]` for messages
+        #: being reassembled. Frames are only added once their source has
+        #: been verified against this stream.
+        self._reassembly = {}
+        #: Total size of every entry in :attr:`_reassembly`.
+        self._reassembly_size = 0
+        #: Keys of :attr:`_reassembly` for messages in transit that could not
+        #: be reassembled, whose remaining frames are discarded.
+        self._dropping = set()
 
     def construct(self):
         pass
 
+    def get_codec(self):
+        """Return the :py:attr:`Message.flags` codec bits for calls made over
+        this stream."""
+        codec = self.codec
+        if codec is None:
+            codec = Message.codec
+        if self.oob:
+            codec |= FLAG_OOB
+        return codec
+
     def on_receive(self, broker):
         """Handle the next complete message on the stream. Raise
         :py:class:`StreamError` on failure."""
@@ -814,28 +1301,51 @@ class Stream(BasicStream):
         if not buf:
             return self.on_disconnect(broker)
 
-        if self._input_buf and self._input_buf_len < 128:
-            self._input_buf[0] += buf
-        else:
-            self._input_buf.append(buf)
-
+        self._input_buf.append(buf)
         self._input_buf_len += len(buf)
         while self._receive_one(broker):
             pass
 
-    HEADER_FMT = '>LLLLLL'
-    HEADER_LEN = struct.calcsize(HEADER_FMT)
+    HEADER_FMT = _header_struct.format
+    HEADER_LEN = _header_struct.size
+
+    def _read_input(self, n):
+        """
+        Remove and return the next `n` bytes of :attr:`_input_buf`. Chunks are
+        never re-sliced to discard consumed bytes; instead
+        :attr:`_input_offset` tracks the read position within the first chunk,
+        so each byte is copied at most once on its way into a message.
+        """
+        bits = []
+        start = self._input_offset
+        self._input_buf_len -= n
+        while n:
+            head = self._input_buf[0]
+            bit = head[start:start+n]
+            bits.append(bit)
+            n -= len(bit)
+            start += len(bit)
+            if start == len(head):
+                self._input_buf.popleft()
+                start = 0
+
+        self._input_offset = start
+        return ''.join(bits)
 
     def _receive_one(self, broker):
         if self._input_buf_len < self.HEADER_LEN:
             return False
 
-        msg = Message()
-        msg.router = self._router
-        (msg.dst_id, msg.src_id, msg.auth_id,
-         msg.handle, msg.reply_to, msg_len) = struct.unpack(
-            self.HEADER_FMT,
-            self._input_buf[0][:self.HEADER_LEN],
+        # Rare: merge a header straddling chunk boundaries.
+        while len(self._input_buf[0]) - self._input_offset < self.HEADER_LEN:
+            head = self._input_buf.popleft()[self._input_offset:]
+            self._input_buf[0] = head + self._input_buf[0]
+            self._input_offset = 0
+
+        head = self._input_buf[0]
+        (dst_id, src_id, auth_id,
+         handle, reply_to, flags, msg_len) = _header_struct.unpack_from(
+            head, self._input_offset
         )
 
         if msg_len > self._router.max_message_size:
@@ -852,61 +1362,465 @@ class Stream(BasicStream):
             )
             return False
 
-        start = self.HEADER_LEN
-        prev_start = start
-        remain = total_len
-        bits = []
-        while remain:
-            buf = self._input_buf.popleft()
-            bit = buf[start:remain]
-            bits.append(bit)
-            remain -= len(bit) + start
-            prev_start = start
-            start = 0
-
-        msg.data = ''.join(bits)
-        self._input_buf.appendleft(buf[prev_start+len(bit):])
-        self._input_buf_len -= total_len
+        # The header lies within the first chunk, so skip it without copying.
+        self._input_buf_len -= self.HEADER_LEN
+        self._input_offset += self.HEADER_LEN
+        if self._input_offset == len(head):
+            self._input_buf.popleft()
+            self._input_offset = 0
+
+        msg = Message(dst_id, src_id, auth_id, handle, reply_to, flags,
+                      router=self._router)
+        read = self._read_input
+        if msg.flags & FLAG_ZLIB:
+            body = self._decompress(read(msg_len))
+            if body is None:
+                LOG.error('%r: invalid compressed message', self)
+                self.on_disconnect(broker)
+                return False
+            msg.flags &= ~FLAG_ZLIB
+            msg_len = len(body)
+            read = BytesIO(body).read
+
+        if msg.flags & FLAG_FRAGMENT and msg.dst_id == mitogen.context_id:
+            # Verify every frame, not just the last one routed, so a peer
+            # cannot add frames to a message from another source.
+            if not self._router._verify_source(msg, self):
+                read(msg_len)
+                return True
+            try:
+                body = self._reassemble(msg, read(msg_len))
+            except StreamError:
+                LOG.error('%r: %s', self, sys.exc_info()[1])
+                self.on_disconnect(broker)
+                return False
+            if body is None:
+                return True  # Await the remaining frames.
+            msg.flags &= ~(FLAG_FRAGMENT | FLAG_MORE)
+            msg_len = len(body)
+            read = BytesIO(body).read
+
+        # Frames in transit are forwarded without parsing.
+        if msg.flags & FLAG_FRAGMENT or not (msg.flags & FLAG_OOB):
+            msg.data = read(msg_len)
+        elif not self._read_buffers(msg, msg_len, read):
+            LOG.error('%r: invalid out-of-band buffer table', self)
+            self.on_disconnect(broker)
+            return False
         self._router._async_route(msg, self)
         return True
 
+    def _read_buffers(self, msg, msg_len, read):
+        """
+        Using `read`, read the body of a :py:data:`FLAG_OOB` message: a count,
+        that many buffer lengths, the serialized data, then each buffer. When
+        `read` is :meth:`_read_input`, each buffer is read from
+        :attr:`_input_buf` separately, so it is copied at most once and never
+        passes through the unpickler.
+        """
+        if msg_len < 4:
+            return False
+        count, = struct.unpack('>L', read(4))
+        msg_len -= 4
+        if 4 * count > msg_len:
+            return False
+        lengths = struct.unpack('>%dL' % (count,), read(4 * count))
+        data_len = msg_len - (4 * count) - sum(lengths)
+        if data_len < 0:
+            return False
+        msg.data = read(data_len)
+        msg.buffers = [read(n) for n in lengths]
+        return True
+
+    def _reassemble(self, msg, frame):
+        """Add `frame` to the message it belongs to, returning the complete
+        body once the last frame arrives, otherwise :data:`None`."""
+        if len(frame) < 4:
+            raise StreamError('fragment too short')
+        key = msg.src_id, frame[:4]
+        entry = self._reassembly.get(key)
+        if entry is None:
+            entry = self._reassembly[key] = [0, []]
+        entry[0] += len(frame) - 4
+        entry[1].append(frame[4:])
+        self._reassembly_size += len(frame) - 4
+        if entry[0] > self._router.max_message_size:
+            raise StreamError('Maximum message size exceeded (got %d, max %d)',
+                              entry[0], self._router.max_message_size)
+        limit = self.reassembly_factor * self._router.max_message_size
+        if self._reassembly_size > limit:
+            raise StreamError('Reassembly limit exceeded (got %d, max %d)',
+                              self._reassembly_size, limit)
+        if msg.flags & FLAG_MORE:
+            return None
+        del self._reassembly[key]
+        self._reassembly_size -= entry[0]
+        return ''.join(entry[1])
+
+    def _discard_reassembly(self, src_id):
+        """Forget partially reassembled messages from `src_id`, for example
+        once its route is deleted. Must be called on the stream's broker
+        thread."""
+        for key in [key for key in self._reassembly if key[0] == src_id]:
+            self._reassembly_size -= self._reassembly.pop(key)[0]
+        for key in [key for key in self._dropping if key[0] == src_id]:
+            self._dropping.discard(key)
+
+    def _decompress(self, s):
+        """Return the decompressed body `s` of a :py:data:`FLAG_ZLIB` message,
+        or :data:`None` if it is corrupt or would exceed
+        :py:attr:`Router.max_message_size`."""
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj()
+        limit = self._router.max_message_size
+        try:
+            body = self._decompressor.decompress(s, limit + 1)
+        except zlib.error:
+            return None
+        if self._decompressor.unconsumed_tail or len(body) > limit:
+            return None
+        return body
+
     def pending_bytes(self):
         return self._output_buf_len
 
-    def on_transmit(self, broker):
-        """Transmit buffered messages."""
-        _vv and IOLOG.debug('%r.on_transmit()', self)
+    def _coalesce_output(self):
+        """
+        Replace small packets at the head of :attr:`_output_buf` with a single
+        string of at most :attr:`max_transmit_size` bytes, so one write can
+        carry many replies or log records.
+        """
+        bits = []
+        size = 0
+        while self._output_buf:
+            buf = self._output_buf[0]
+            if self._output_offset:
+                buf = buf[self._output_offset:]
+            if bits and (size + len(buf) > self.max_transmit_size or
+                         len(buf) >= Message.oob_threshold):
+                break
+            self._output_buf.popleft()
+            self._output_offset = 0
+            bits.append(buf)
+            size += len(buf)
+        self._output_buf.appendleft(''.join(bits))
+
+    def _queue_frame(self, it, key):
+        """Queue the next frame from `it`, returning :data:`True` if more
+        remain. Once the last frame is queued, queue any messages held behind
+        it."""
+        size, frame = it.next()
+        for pkt in self._pack(frame):
+            self._output_buf.append(pkt)
+            self._output_buf_len += len(pkt)
+        self._output_buf_len -= size
+        if frame.flags & FLAG_MORE:
+            return True
+        for msg in self._fragment_backlog.pop(key):
+            self._enqueue(msg)
+        return False
+
+    def _refill(self):
+        """
+        If :attr:`_output_buf` is empty, fill it with the next frame of a
+        control lane message being fragmented, rotating them so concurrent
+        large messages share the stream, or failing that with the next bulk
+        lane frame or message. Return :data:`True` if there is output.
+        """
+        while not self._output_buf:
+            if self._fragmenting:
+                entry = self._fragmenting.popleft()
+                if self._queue_frame(*entry):
+                    self._fragmenting.append(entry)
+            elif self._bulk_frames:
+                if not self._queue_frame(*self._bulk_frames):
+                    self._bulk_frames = None
+            elif self._bulk_buf:
+                msg = self._bulk_buf.popleft()
+                self._output_buf_len -= self.HEADER_LEN + self._body_size(msg)
+                self._queue(msg)
+            else:
+                return False
+        return True
 
-        if self._output_buf:
-            buf = self._output_buf.popleft()
-            written = self.transmit_side.write(buf)
-            if not written:
-                _v and LOG.debug('%r.on_transmit(): disconnection detected', self)
-                self.on_disconnect(broker)
-                return
-            elif written != len(buf):
-                self._output_buf.appendleft(buffer(buf, written))
+    def _transmit(self):
+        while self._refill():
+            if (len(self._output_buf) > 1 and
+                    len(self._output_buf[0]) < Message.oob_threshold):
+                self._coalesce_output()
+
+            buf = self._output_buf[0]
+            written = self.transmit_side.write(
+                tail_view(buf, self._output_offset)
+            )
+            if written is None:
+                return False
 
             _vv and IOLOG.debug('%r.on_transmit() -> len %d', self, written)
             self._output_buf_len -= written
+            self._output_offset += written
+            if self._output_offset < len(buf):
+                # Short write or EAGAIN: the OS buffer is full.
+                break
+            self._output_buf.popleft()
+            self._output_offset = 0
+        return True
+
+    def on_transmit(self, broker):
+        """Transmit buffered messages, continuing until the buffer is drained
+        or the OS refuses more data."""
+        _vv and IOLOG.debug('%r.on_transmit()', self)
+        locked = self._router.direct_write
+        if locked:
+            self._output_lock.acquire()
+        try:
+            connected = self._transmit()
+        finally:
+            if locked:
+                self._output_lock.release()
+
+        if not connected:
+            _v and LOG.debug('%r.on_transmit(): disconnection detected', self)
+            self.on_disconnect(broker)
+            return
+
+        if self.output_paused and \
+                self._output_buf_len <= self.output_low_watermark:
+            self.output_paused = False
+            fire(self, 'resume')
 
         if not self._output_buf:
             broker._stop_transmit(self)
 
+    def _compress(self, data, buffers):
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(self.zlib_level)
+        compress = self._compressor.compress
+        bits = [compress(data)]
+        bits.extend(compress(buf) for buf in buffers)
+        bits.append(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        return ''.join(bits)
+
+    def _body(self, msg):
+        """Return the leading string of the body of `msg`, including any
+        buffer table, the :py:attr:`Message.buffers` that follow it, and the
+        total body size."""
+        data = msg.data
+        buffers = msg.buffers
+        if msg.flags & FLAG_FRAGMENT or not (msg.flags & FLAG_OOB):
+            return data, buffers, len(data)
+        lengths = [len(buf) for buf in buffers]
+        data = struct.pack('>L%dL' % (len(lengths),),
+                           len(lengths), *lengths) + data
+        return data, buffers, len(data) + sum(lengths)
+
+    def _iter_fragments(self, msg):
+        """Yield `(size, frame)` for each frame of `msg`, where `size` is the
+        number of body bytes it carries. Only one frame is held in memory
+        beyond `msg` itself."""
+        fragment_id = struct.pack('>L', _fragment_ids.next() & 0xffffffff)
+        data, buffers, _ = self._body(msg)
+        segments = collections.deque([data])
+        segments.extend(buffers)
+        offset = 0
+        flags = msg.flags | FLAG_FRAGMENT | FLAG_MORE
+        while segments:
+            bits = [fragment_id]
+            n = self.fragment_size
+            while n and segments:
+                seg = segments[0]
+                bit = seg[offset:offset+n]
+                bits.append(bit)
+                n -= len(bit)
+                offset += len(bit)
+                if offset == len(seg):
+                    segments.popleft()
+                    offset = 0
+            if not segments:
+                flags &= ~FLAG_MORE
+            yield self.fragment_size - n, Message(
+                dst_id=msg.dst_id, src_id=msg.src_id, auth_id=msg.auth_id,
+                handle=msg.handle, reply_to=msg.reply_to, flags=flags,
+                data=''.join(bits),
+            )
+
+    def _pack(self, msg):
+        """Return the segments of the frame for `msg`: the header and data,
+        followed by any :py:attr:`Message.buffers`, or when compressed, a
+        single string. Must be called with :attr:`_output_lock` held, since
+        the compressor's output depends on the order messages are packed."""
+        flags = msg.flags
+        data, buffers, size = self._body(msg)
+        if self.zlib_level is not None and size >= self.zlib_threshold:
+            data = self._compress(data, buffers)
+            flags |= FLAG_ZLIB
+            size = len(data)
+            buffers = ()
+        pkts = [_header_struct.pack(msg.dst_id, msg.src_id, msg.auth_id,
+                                    msg.handle, msg.reply_to or 0,
+                                    flags, size) + data]
+        pkts.extend(buffers)
+        return pkts
+
+    def _body_size(self, msg):
+        size = len(msg.data)
+        if msg.flags & FLAG_OOB and not (msg.flags & FLAG_FRAGMENT):
+            size += 4 + sum(4 + len(buf) for buf in msg.buffers)
+        return size
+
+    def _is_fragmented(self, msg):
+        return (self.fragment_size and
+                msg.src_id == mitogen.context_id and
+                not (msg.flags & FLAG_FRAGMENT) and
+                self._body_size(msg) > self.fragment_size)
+
+    def _enqueue(self, msg):
+        """Queue `msg` for transmission. Must be called with
+        :attr:`_output_lock` held."""
+        key = msg.dst_id, msg.handle
+        backlog = self._fragment_backlog.get(key)
+        if backlog is not None:
+            backlog.append(msg)
+        elif msg.flags & FLAG_FRAGMENT and not self.fragment_size:
+            # The peer cannot reassemble, so do it here.
+            msg = self._reassemble_in_transit(msg)
+            if msg is not None:
+                self._enqueue(msg)
+        elif msg.flags & FLAG_BULK:
+            self._bulk_buf.append(msg)
+            self._output_buf_len += self.HEADER_LEN + self._body_size(msg)
+        else:
+            self._queue(msg)
+
+    def _reassemble_in_transit(self, msg):
+        """Add frame `msg`, bound for a peer that does not support
+        fragmentation, to the message it belongs to. Return the complete
+        message once its last frame arrives, otherwise :data:`None`. A
+        message that cannot be reassembled is dropped, and its sender is sent
+        a dead reply."""
+        key = msg.src_id, msg.data[:4]
+        if key in self._dropping:
+            if not (msg.flags & FLAG_MORE):
+                self._dropping.discard(key)
+            return None
+
+        try:
+            body = self._reassemble(msg, msg.data)
+            if body is None:
+                return None
+            whole = Message(dst_id=msg.dst_id, src_id=msg.src_id,
+                            auth_id=msg.auth_id, handle=msg.handle,
+                            reply_to=msg.reply_to,
+                            flags=msg.flags & ~(FLAG_FRAGMENT | FLAG_MORE))
+            if not (whole.flags & FLAG_OOB):
+                whole.data = body
+            elif not self._read_buffers(whole, len(body), BytesIO(body).read):
+                raise StreamError('invalid out-of-band buffer table')
+            return whole
+        except StreamError:
+            LOG.error('%r: dropping %r: %s', self, msg, sys.exc_info()[1])
+            entry = self._reassembly.pop(key, None)
+            if entry is not None:
+                self._reassembly_size -= entry[0]
+            if msg.flags & FLAG_MORE:
+                self._dropping.add(key)
+            if msg.reply_to and not msg.is_dead:
+                msg.reply(Message.dead(), router=self._router)
+
+    def _queue(self, msg):
+        """Begin fragmenting `msg`, or pack it into :attr:`_output_buf`.
+        Must be called with :attr:`_output_lock` held."""
+        if self._is_fragmented(msg):
+            key = msg.dst_id, msg.handle
+            self._fragment_backlog[key] = []
+            entry = self._iter_fragments(msg), key
+            if msg.flags & FLAG_BULK:
+                self._bulk_frames = entry
+            else:
+                self._fragmenting.append(entry)
+            self._output_buf_len += self._body_size(msg)
+        else:
+            # Large buffers are queued as-is and written in place by
+            # _transmit(), rather than being copied into the packet.
+            for pkt in self._pack(msg):
+                self._output_buf.append(pkt)
+                self._output_buf_len += len(pkt)
+
     def _send(self, msg):
         _vv and IOLOG.debug('%r._send(%r)', self, msg)
-        pkt = struct.pack(self.HEADER_FMT, msg.dst_id, msg.src_id,
-                          msg.auth_id, msg.handle, msg.reply_to or 0,
-                          len(msg.data)) + msg.data
-        if not self._output_buf_len:
-            self._router.broker._start_transmit(self)
-        self._output_buf.append(pkt)
-        self._output_buf_len += len(pkt)
+        locked = self._router.direct_write
+        if locked:
+            self._output_lock.acquire()
+        try:
+            if not self._output_buf_len:
+                self._broker._start_transmit(self)
+            self._enqueue(msg)
+        finally:
+            if locked:
+                self._output_lock.release()
+        self._pause_if_full()
+
+    def _pause_if_full(self):
+        if self._output_buf_len >= self.output_high_watermark and \
+                not self.output_paused:
+            self.output_paused = True
+            fire(self, 'pause')
 
     def send(self, msg):
         """Send `data` to `handle`, and tell the broker we have output. May
         be called from any thread."""
-        self._router.broker.defer(self._send, msg)
+        self._broker.defer(self._send, msg)
+
+    def _send_deferred(self, msg):
+        self._send(msg)
+        self._direct_deferred.pop()
+
+    def _write_direct(self, pkt):
+        written = self.transmit_side.write(pkt)
+        if written == len(pkt):
+            return
+        # Queue the remainder, or on disconnection the whole packet, so the
+        # broker finishes the write or notices the disconnection itself.
+        self._output_buf.append(pkt)
+        self._output_offset = written or 0
+        self._output_buf_len += len(pkt) - self._output_offset
+        self._broker.defer(self._transmit_remainder)
+
+    def _transmit_remainder(self):
+        # Pausing must happen on the broker thread, like any signal.
+        self._broker._start_transmit(self)
+        self._pause_if_full()
+
+    def _send_direct(self, msg):
+        """Write `msg` to the stream from the calling thread if nothing is
+        queued ahead of it and the stream is not busy, otherwise defer it to
+        the broker. Used by :meth:`Router.route` when
+        :attr:`Router.direct_write` is enabled. May be called from any
+        thread."""
+        if self._output_lock.acquire(False):
+            try:
+                if not (self._output_buf_len or self._direct_deferred or
+                        self._output_closed or msg.buffers or
+                        self._is_fragmented(msg)):
+                    _vv and IOLOG.debug('%r._send_direct(%r)', self, msg)
+                    pkt, = self._pack(msg)
+                    self._write_direct(pkt)
+                    return
+            finally:
+                self._output_lock.release()
+
+        self._direct_deferred.append(None)
+        self._broker.defer(self._send_deferred, msg)
+
+    def on_disconnect(self, broker):
+        # Wait for any direct write in progress, and prevent new ones, since
+        # the descriptor number may be reused once closed.
+        self._output_lock.acquire()
+        try:
+            self._output_closed = True
+        finally:
+            self._output_lock.release()
+        super(Stream, self).on_disconnect(broker)
 
     def on_shutdown(self, broker):
         """Override BasicStream behaviour of immediately disconnecting."""
@@ -943,8 +1857,16 @@ class Context(object):
         msg.dst_id = self.context_id
         self.router.route(msg)
 
+    def send_many(self, msgs):
+        """Like :meth:`send`, but enqueue a sequence of messages using a single
+        wakeup of the broker. May be called from any thread."""
+        msgs = list(msgs)
+        for msg in msgs:
+            msg.dst_id = self.context_id
+        self.router.route_many(msgs)
+
     def send_async(self, msg, persist=False):
-        if self.router.broker._thread == threading.currentThread():  # TODO
+        if self.router._is_broker_thread():  # TODO
             raise SystemError('Cannot making blocking call on broker thread')
 
         receiver = Receiver(self.router, persist=persist, respondent=self)
@@ -976,43 +1898,129 @@ def _unpickle_context(router, context_id, name):
     return router.context_class(router, context_id, name)
 
 
+def _acquire_timeout(lock, timeout):
+    if PY3:
+        return lock.acquire(True, timeout)
+    # Python 2 has no timed acquire; poll in the manner of threading.Condition.
+    deadline = time.time() + timeout
+    delay = 0.0005
+    while not lock.acquire(False):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+    return True
+
+
+class FdWaiter(object):
+    """
+    Sleep a thread in :py:func:`select.select` on an eventfd where
+    :py:func:`os.eventfd` exists, otherwise on a pipe, and wake it by writing
+    to the descriptor. Sleeps remain interruptible and timed sleeps wake
+    without latency.
+    """
+    pool = []
+
+    def __init__(self):
+        if hasattr(os, 'eventfd'):
+            self.rfd = self.wfd = os.eventfd(0, os.EFD_CLOEXEC)
+            self._wake_s = struct.pack('=Q', 1)
+        else:
+            self.rfd, self.wfd = os.pipe()
+            set_cloexec(self.rfd)
+            set_cloexec(self.wfd)
+            self._wake_s = '\x7f'
+
+    def close(self):
+        os.close(self.rfd)
+        if self.wfd != self.rfd:
+            os.close(self.wfd)
+
+    def wait(self, timeout):
+        io_op(select.select, [self.rfd], [], [], timeout)
+
+    def wake(self):
+        try:
+            os.write(self.wfd, self._wake_s)
+        except OSError:
+            e = sys.exc_info()[1]
+            if e[0] != errno.EBADF:
+                raise
+
+    def consume(self):
+        if os.read(self.rfd, 8) != self._wake_s:
+            raise LatchError('internal error: received >1 wakeups')
+
+
+class LockWaiter(object):
+    """
+    Sleep a thread on a :py:class:`threading.Lock` held on its behalf, and
+    wake it by releasing the lock. No file descriptors are used, however on
+    Python 2 untimed sleeps cannot be interrupted by CTRL+C, and timed sleeps
+    poll.
+    """
+    pool = []
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lock.acquire()
+        self._acquired = False
+
+    def close(self):
+        pass
+
+    def wait(self, timeout):
+        if timeout is None:
+            self._acquired = self._lock.acquire()
+        else:
+            self._acquired = _acquire_timeout(self._lock, timeout)
+
+    def wake(self):
+        self._lock.release()
+
+    def consume(self):
+        if not self._acquired:
+            self._lock.acquire()
+
+
 class Latch(object):
     closed = False
-    _waking = 0
-    _sockets = []
+
+    #: Class used to sleep threads waiting in :py:meth:`get`, either
+    #: :py:class:`FdWaiter` or :py:class:`LockWaiter`.
+    waiter_class = FdWaiter
 
     def __init__(self):
         self._lock = threading.Lock()
-        self._queue = []
-        self._sleeping = []
+        self._queue = collections.deque()
+        self._sleeping = collections.deque()
 
     @classmethod
     def _on_fork(cls):
-        while cls._sockets:
-            rsock, wsock = cls._sockets.pop()
-            rsock.close()
-            wsock.close()
+        for klass in FdWaiter, LockWaiter:
+            while klass.pool:
+                klass.pool.pop().close()
 
     def close(self):
         self._lock.acquire()
         try:
             self.closed = True
-            while self._waking < len(self._sleeping):
-                self._wake(self._sleeping[self._waking])
-                self._waking += 1
+            while self._sleeping:
+                self._wake(self._sleeping.popleft(), None)
         finally:
             self._lock.release()
 
     def empty(self):
         return len(self._queue) == 0
 
-    def _tls_init(self):
-        if self._sockets:
-            return self._sockets.pop()
-        rsock, wsock = socket.socketpair()
-        set_cloexec(rsock.fileno())
-        set_cloexec(wsock.fileno())
-        return rsock, wsock
+    def _get_waiter(self):
+        try:
+            waiter = self.waiter_class.pool.pop()
+        except IndexError:
+            waiter = self.waiter_class()
+        waiter.woken = False
+        return waiter
 
     def get(self, timeout=None, block=True):
         _vv and IOLOG.debug('%r.get(timeout=%r, block=%r)',
@@ -1022,44 +2030,51 @@ class Latch(object):
         try:
             if self.closed:
                 raise LatchError()
-            i = len(self._sleeping)
-            if len(self._queue) > i:
-                _vv and IOLOG.debug('%r.get() -> %r', self, self._queue[i])
-                return self._queue.pop(i)
+            if self._queue:
+                _vv and IOLOG.debug('%r.get() -> %r', self, self._queue[0])
+                return self._queue.popleft()
             if not block:
                 raise TimeoutError()
-            rsock, wsock = self._tls_init()
-            self._sleeping.append(wsock)
+            waiter = self._get_waiter()
+            self._sleeping.append(waiter)
         finally:
             self._lock.release()
 
-        return self._get_sleep(timeout, block, rsock, wsock)
+        return self._get_sleep(timeout, block, waiter)
 
-    def _get_sleep(self, timeout, block, rsock, wsock):
+    def _get_sleep(self, timeout, block, waiter):
         _vv and IOLOG.debug('%r._get_sleep(timeout=%r, block=%r)',
                             self, timeout, block)
         e = None
         try:
-            io_op(select.select, [rsock], [], [], timeout)
+            waiter.wait(timeout)
         except Exception:
             e = sys.exc_info()[1]
 
         self._lock.acquire()
         try:
-            i = self._sleeping.index(wsock)
-            del self._sleeping[i]
-            self._sockets.append((rsock, wsock))
-            if i >= self._waking:
+            if not waiter.woken:
+                self._sleeping.remove(waiter)
+                waiter.pool.append(waiter)
+                if e:
+                    raise e
                 raise TimeoutError()
-            self._waking -= 1
-            if rsock.recv(2) != '\x7f':
-                raise LatchError('internal error: received >1 wakeups')
+            waiter.consume()
+            obj, waiter.obj = waiter.obj, None
+            waiter.pool.append(waiter)
             if e:
+                # We were woken but cannot return obj, so hand it to the next
+                # sleeper, or keep it at the head of the queue.
+                if not self.closed:
+                    if self._sleeping:
+                        self._wake(self._sleeping.popleft(), obj)
+                    else:
+                        self._queue.appendleft(obj)
                 raise e
             if self.closed:
                 raise LatchError()
-            _vv and IOLOG.debug('%r.get() wake -> %r', self, self._queue[i])
-            return self._queue.pop(i)
+            _vv and IOLOG.debug('%r.get() wake -> %r', self, obj)
+            return obj
         finally:
             self._lock.release()
 
@@ -1069,24 +2084,19 @@ class Latch(object):
         try:
             if self.closed:
                 raise LatchError()
-            self._queue.append(obj)
-
-            if self._waking < len(self._sleeping):
-                sock = self._sleeping[self._waking]
-                self._waking += 1
-                _vv and IOLOG.debug('%r.put() -> waking wfd=%r',
-                                    self, sock.fileno())
-                self._wake(sock)
+            if self._sleeping:
+                waiter = self._sleeping.popleft()
+                _vv and IOLOG.debug('%r.put() -> waking %r', self, waiter)
+                self._wake(waiter, obj)
+            else:
+                self._queue.append(obj)
         finally:
             self._lock.release()
 
-    def _wake(self, sock):
-        try:
-            os.write(sock.fileno(), '\x7f')
-        except OSError:
-            e = sys.exc_info()[1]
-            if e[0] != errno.EBADF:
-                raise
+    def _wake(self, waiter, obj):
+        waiter.obj = obj
+        waiter.woken = True
+        waiter.wake()
 
     def __repr__(self):
         return 'Latch(%#x, size=%d, t=%r)' % (
@@ -1112,7 +2122,7 @@ class Waker(BasicStream):
         self._deferred = []
 
         rfd, wfd = os.pipe()
-        self.receive_side = Side(self, rfd)
+        self.receive_side = Side(self, rfd, keep_alive=False)
         self.transmit_side = Side(self, wfd)
 
     def __repr__(self):
@@ -1133,14 +2143,21 @@ class Waker(BasicStream):
         finally:
             self._lock.release()
 
+    def on_shutdown(self, broker):
+        """
+        Remain open while the broker shuts down, so functions deferred by other
+        threads still run. The broker closes us just before it exits.
+        """
+        _v and LOG.debug('%r.on_shutdown()', self)
+
     def on_receive(self, broker):
         """
         Drain the pipe and fire callbacks. Reading multiple bytes is safe since
-        new bytes corresponding to future .defer() calls are written only after
-        .defer() takes _lock: either a byte we read corresponds to something
-        already on the queue by the time we take _lock, or a byte remains
-        buffered, causing another wake up, because it was written after we
-        released _lock.
+        bytes are written only after .defer() finds the queue empty while
+        holding _lock: either a byte we read corresponds to something already
+        on the queue by the time we take _lock, or a byte remains buffered,
+        causing another wake up, because it was written after we emptied the
+        queue.
         """
         _vv and IOLOG.debug('%r.on_receive()', self)
         self.receive_side.read(128)
@@ -1167,19 +2184,23 @@ class Waker(BasicStream):
         _vv and IOLOG.debug('%r.defer() [fd=%r]', self, self.transmit_side.fd)
         self._lock.acquire()
         try:
+            empty = not self._deferred
             self._deferred.append((func, args, kwargs))
         finally:
             self._lock.release()
 
-        # Wake the multiplexer by writing a byte. If the broker is in the midst
-        # of tearing itself down, the waker fd may already have been closed, so
-        # ignore EBADF here.
-        try:
-            self.transmit_side.write(b(' '))
-        except OSError:
-            e = sys.exc_info()[1]
-            if e[0] != errno.EBADF:
-                raise
+        # Wake the multiplexer by writing a byte, but only if the queue was
+        # empty: otherwise a byte is already buffered, or on_receive() has not
+        # yet taken the queue, and will find our entry when it does. If the
+        # broker is in the midst of tearing itself down, the waker fd may
+        # already have been closed, so ignore EBADF here.
+        if empty:
+            try:
+                self.transmit_side.write(b(' '))
+            except OSError:
+                e = sys.exc_info()[1]
+                if e[0] != errno.EBADF:
+                    raise
 
 
 class IoLogger(BasicStream):
@@ -1230,6 +2251,11 @@ class Router(object):
     context_class = Context
     max_message_size = 128 * 1048576
 
+    #: If :data:`True`, :meth:`route` writes messages for remote contexts
+    #: directly to the stream from the calling thread whenever nothing is
+    #: queued on it, rather than waking the broker to do so.
+    direct_write = False
+
     def __init__(self, broker):
         self.broker = broker
         listen(broker, 'exit', self._on_broker_exit)
@@ -1241,6 +2267,12 @@ class Router(object):
 
         #: context ID -> Stream
         self._stream_by_id = {}
+        #: Stream -> set of context IDs routed via it, so that disconnection
+        #: need not visit every known context.
+        self._ids_by_stream = {}
+        #: Serializes updates to :attr:`_stream_by_id` and
+        #: :attr:`_ids_by_stream`.
+        self._lock = threading.Lock()
         #: List of contexts to notify of shutdown.
         self._context_by_id = {}
         self._last_handle = itertools.count(1000)
@@ -1251,23 +2283,73 @@ class Router(object):
         return 'Router(%r)' % (self.broker,)
 
     def on_stream_disconnect(self, stream):
-        for context in self._context_by_id.values():
-            stream_ = self._stream_by_id.get(context.context_id)
-            if stream_ is stream:
-                del self._stream_by_id[context.context_id]
+        self._lock.acquire()
+        try:
+            context_ids = self._ids_by_stream.pop(stream, ())
+            for context_id in context_ids:
+                del self._stream_by_id[context_id]
+        finally:
+            self._lock.release()
+
+        for context_id in context_ids:
+            context = self._context_by_id.get(context_id)
+            if context:
                 context.on_disconnect()
 
+    def _add_route(self, target_id, stream):
+        """Arrange for messages to `target_id` to be sent via `stream`,
+        replacing any existing route."""
+        self._lock.acquire()
+        try:
+            self._discard_route(target_id)
+            self._stream_by_id[target_id] = stream
+            self._ids_by_stream.setdefault(stream, set()).add(target_id)
+        finally:
+            self._lock.release()
+
+    def _del_route(self, target_id):
+        """Forget the route to `target_id`, returning the stream it was
+        routed via, or :data:`None` if no route existed."""
+        self._lock.acquire()
+        try:
+            return self._discard_route(target_id)
+        finally:
+            self._lock.release()
+
+    def _discard_route(self, target_id):
+        # Must be called with _lock held.
+        stream = self._stream_by_id.pop(target_id, None)
+        if stream is not None:
+            context_ids = self._ids_by_stream[stream]
+            context_ids.discard(target_id)
+            if not context_ids:
+                del self._ids_by_stream[stream]
+        return stream
+
     def _on_broker_exit(self):
         while self._handle_map:
             _, (_, func, _) = self._handle_map.popitem()
             func(Message.dead())
 
+    def broker_for(self, context_id):
+        """Return the :class:`Broker` that will service the stream connected
+        to `context_id`."""
+        return self.broker
+
+    def _is_broker_thread(self):
+        """Return :data:`True` if the calling thread belongs to any broker
+        servicing this router."""
+        return self.broker._thread == threading.currentThread()
+
     def register(self, context, stream):
         _v and LOG.debug('register(%r, %r)', context, stream)
-        self._stream_by_id[context.context_id] = stream
+        self._add_route(context.context_id, stream)
         self._context_by_id[context.context_id] = context
-        self.broker.start_receive(stream)
-        listen(stream, 'disconnect', lambda: self.on_stream_disconnect(stream))
+        stream._broker.start_receive(stream)
+        # The stream's broker may not be ours, so handle disconnection on ours,
+        # the only thread that modifies the handle map.
+        listen(stream, 'disconnect',
+               lambda: self.broker.defer(self.on_stream_disconnect, stream))
 
     def add_handler(self, fn, handle=None, persist=True,
                     policy=None, respondent=None):
@@ -1287,6 +2369,13 @@ class Router(object):
         self._handle_map[handle] = persist, fn, policy
         return handle
 
+    def del_handler(self, handle):
+        """Remove the handler registered for `handle`.
+
+        :raises KeyError:
+            No handler is registered for `handle`."""
+        del self._handle_map[handle]
+
     def on_shutdown(self, broker):
         """Called during :py:meth:`Broker.shutdown`, informs callbacks
         registered with :py:meth:`add_handle_cb` the connection is dead."""
@@ -1326,34 +2415,53 @@ class Router(object):
         except Exception:
             LOG.exception('%r._invoke(%r): %r crashed', self, msg, fn)
 
+    def _async_route_many(self, msgs):
+        for msg in msgs:
+            self._async_route(msg)
+
+    def _is_too_large(self, msg):
+        size = len(msg.data)
+        if msg.buffers:
+            # Include the buffer table Stream._body() prepends.
+            size += 4 + sum(4 + len(buf) for buf in msg.buffers)
+        return size > self.max_message_size
+
+    def _verify_source(self, msg, stream):
+        """Return :data:`True` if `msg` could legitimately have arrived via
+        `stream`, setting its `auth_id` to the stream's if one is configured,
+        otherwise log an error and return :data:`False`."""
+        parent = self._stream_by_id.get(mitogen.parent_id)
+        expect = self._stream_by_id.get(msg.auth_id, parent)
+        if stream != expect:
+            LOG.error('%r: bad auth_id: got %r via %r, not %r: %r',
+                      self, msg.auth_id, stream, expect, msg)
+            return False
+
+        if msg.src_id != msg.auth_id:
+            expect = self._stream_by_id.get(msg.src_id, parent)
+            if stream != expect:
+                LOG.error('%r: bad src_id: got %r via %r, not %r: %r',
+                          self, msg.src_id, stream, expect, msg)
+                return False
+
+        if stream.auth_id is not None:
+            msg.auth_id = stream.auth_id
+        return True
+
     def _async_route(self, msg, stream=None):
         _vv and IOLOG.debug('%r._async_route(%r, %r)', self, msg, stream)
-        if len(msg.data) > self.max_message_size:
+        if self._is_too_large(msg):
             LOG.error('message too large (max %d bytes): %r',
                       self.max_message_size, msg)
             return
 
-        # Perform source verification.
-        if stream:
-            parent = self._stream_by_id.get(mitogen.parent_id)
-            expect = self._stream_by_id.get(msg.auth_id, parent)
-            if stream != expect:
-                LOG.error('%r: bad auth_id: got %r via %r, not %r: %r',
-                          self, msg.auth_id, stream, expect, msg)
-                return
-
-            if msg.src_id != msg.auth_id:
-                expect = self._stream_by_id.get(msg.src_id, parent)
-                if stream != expect:
-                    LOG.error('%r: bad src_id: got %r via %r, not %r: %r',
-                              self, msg.src_id, stream, expect, msg)
-                    return
-
-            if stream.auth_id is not None:
-                msg.auth_id = stream.auth_id
+        if stream and not self._verify_source(msg, stream):
+            return
 
         if msg.dst_id == mitogen.context_id:
-            return self._invoke(msg, stream)
+            # Handlers always run on our own broker, even when the message
+            # arrived via a stream owned by another one.
+            return self.broker.defer(self._invoke, msg, stream)
 
         stream = self._stream_by_id.get(msg.dst_id)
         if stream is None:
@@ -1366,23 +2474,220 @@ class Router(object):
                 msg.reply(Message.dead(), router=self)
             return
 
-        stream._send(msg)
+        # Immediate if we are already running on the stream's broker.
+        stream.send(msg)
+
+    def _route_direct(self, msg):
+        if msg.dst_id == mitogen.context_id or self._is_too_large(msg):
+            return False
+
+        stream = self._stream_by_id.get(msg.dst_id)
+        if stream is None:
+            stream = self._stream_by_id.get(mitogen.parent_id)
+            if stream is None:
+                return False
+
+        stream._send_direct(msg)
+        return True
 
     def route(self, msg):
-        self.broker.defer(self._async_route, msg)
+        if not (self.direct_write and self._route_direct(msg)):
+            self.broker.defer(self._async_route, msg)
+
+    def route_many(self, msgs):
+        if self.direct_write:
+            # Deferring a batch would allow later direct writes to overtake it.
+            for msg in msgs:
+                self.route(msg)
+        else:
+            self.broker.defer(self._async_route_many, list(msgs))
+
+
+class Poller(object):
+    """
+    A poller manages OS file descriptors the user is waiting to become
+    available for IO. The :meth:`poll` method blocks the calling thread until
+    one or more become ready. The default implementation is based on
+    :func:`select.select`.
+
+    Each descriptor has an associated `data` element, which is unique for each
+    readiness type, and defaults to being the same as the file descriptor. The
+    :meth:`poll` method yields the data associated with a descriptor, rather
+    than the descriptor itself, allowing concise loops like::
+
+        p = Poller()
+        p.start_receive(conn.fd, data=conn.on_read)
+        p.start_transmit(conn.fd, data=conn.on_write)
+
+        for callback in p.poll():
+            callback()  # invoke appropriate bound instance method
+
+    Registrations are stored in dictionaries keyed by file descriptor, so
+    adding and removing interest is constant time regardless of how many
+    descriptors are registered.
+    """
+    #: Increments on every :meth:`poll`, and is stored alongside each
+    #: registration. Used to avoid yielding registrations made during the
+    #: current iteration, whose descriptor may have been recycled.
+    _generation = 1
+
+    def __init__(self):
+        self._rfds = {}
+        self._wfds = {}
+
+    def __repr__(self):
+        return '%s(%#x)' % (type(self).__name__, id(self))
+
+    @property
+    def readers(self):
+        """
+        Return a list of `(fd, data)` tuples for every FD registered for
+        receive readiness.
+        """
+        return list((fd, data) for fd, (data, gen) in self._rfds.items())
+
+    @property
+    def writers(self):
+        """
+        Return a list of `(fd, data)` tuples for every FD registered for
+        transmit readiness.
+        """
+        return list((fd, data) for fd, (data, gen) in self._wfds.items())
+
+    def close(self):
+        """
+        Close any underlying OS resource used by the poller.
+        """
+        pass
+
+    def start_receive(self, fd, data=None):
+        """
+        Cause :meth:`poll` to yield `data` when `fd` is readable.
+        """
+        self._rfds[fd] = (data or fd, self._generation)
+
+    def stop_receive(self, fd):
+        """
+        Stop yielding readability events for `fd`.
+
+        Redundant calls to :meth:`stop_receive` are silently ignored, this may
+        change in future.
+        """
+        self._rfds.pop(fd, None)
+
+    def start_transmit(self, fd, data=None):
+        """
+        Cause :meth:`poll` to yield `data` when `fd` is writeable.
+        """
+        self._wfds[fd] = (data or fd, self._generation)
+
+    def stop_transmit(self, fd):
+        """
+        Stop yielding writeability events for `fd`.
+
+        Redundant calls to :meth:`stop_transmit` are silently ignored, this may
+        change in future.
+        """
+        self._wfds.pop(fd, None)
+
+    def _poll(self, timeout):
+        (rfds, wfds, _), _ = io_op(select.select,
+            self._rfds,
+            self._wfds,
+            (), timeout
+        )
+
+        for fd in rfds:
+            _vv and IOLOG.debug('%r: POLLIN for %r', self, fd)
+            data, gen = self._rfds.get(fd, (None, None))
+            if gen and gen < self._generation:
+                yield data
+
+        for fd in wfds:
+            _vv and IOLOG.debug('%r: POLLOUT for %r', self, fd)
+            data, gen = self._wfds.get(fd, (None, None))
+            if gen and gen < self._generation:
+                yield data
+
+    def poll(self, timeout=None):
+        """
+        Block the calling thread until one or more FDs are ready for IO.
+
+        :param float timeout:
+            If not :data:`None`, seconds to wait without an event before
+            returning an empty iterable.
+        :returns:
+            Iterable of `data` elements associated with ready FDs.
+        """
+        _vv and IOLOG.debug('%r.poll(%r)', self, timeout)
+        self._generation += 1
+        return self._poll(timeout)
+
+
+class Timer(object):
+    """
+    A function call scheduled by :meth:`Broker.call_at`,
+    :meth:`Broker.call_later` or :meth:`Broker.periodic`, to be run on the
+    broker thread. Timers cancelled using :meth:`Broker.cancel` are removed
+    from the broker's queue once they make up half of it, others remain queued
+    until they fall due, at which point they are discarded.
+    """
+    #: If not :data:`None`, seconds between repeated invocations.
+    interval = None
+    #: Set by :meth:`cancel`.
+    cancelled = False
+    #: :data:`True` while in the broker's queue. Only used on the broker
+    #: thread.
+    _queued = False
+    #: :data:`True` while counted in the broker's cancelled timers. Only used
+    #: on the broker thread.
+    _counted = False
+
+    def __init__(self, when, func, args, kwargs):
+        #: UNIX timestamp of the next invocation.
+        self.when = when
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return 'Timer(%r, when=%r, interval=%r)' % (self.func, self.when,
+                                                     self.interval)
+
+    def cancel(self):
+        """Prevent future invocations. May be called from any thread, however
+        an invocation already in progress on the broker thread is not
+        interrupted."""
+        self.cancelled = True
 
 
 class Broker(object):
+    #: :class:`Poller` subclass used to multiplex IO. Replaced by
+    #: :class:`mitogen.master.Broker` with the best implementation available
+    #: for the host OS.
+    poller_class = Poller
     _waker = None
     _thread = None
     shutdown_timeout = 3.0
+    #: Count of reasons besides streams to keep running during shutdown, such
+    #: as :class:`mitogen.master.ShardedRouter` brokers yet to exit. Only
+    #: modified on the broker thread.
+    _holds = 0
 
     def __init__(self):
         self._alive = True
+        #: Heap of (when, sequence, :class:`Timer`) ordered by due time.
+        self._timers = []
+        self._timer_seq = itertools.count()
+        #: Number of cancelled timers still in :attr:`_timers`.
+        self._cancelled = 0
         self._waker = Waker(self)
         self.defer = self._waker.defer
-        self._readers = [self._waker.receive_side]
-        self._writers = []
+        self.poller = self.poller_class()
+        self.poller.start_receive(
+            self._waker.receive_side.fd,
+            (self._waker.receive_side, self._waker.on_receive)
+        )
         self._thread = threading.Thread(
             target=_profile_hook,
             args=('broker', self._broker_main),
@@ -1391,33 +2696,102 @@ class Broker(object):
         self._thread.start()
         self._waker.broker_ident = self._thread.ident
 
-    def _list_discard(self, lst, value):
-        try:
-            lst.remove(value)
-        except ValueError:
-            pass
-
-    def _list_add(self, lst, value):
-        if value not in lst:
-            lst.append(value)
-
     def start_receive(self, stream):
         _vv and IOLOG.debug('%r.start_receive(%r)', self, stream)
-        assert stream.receive_side and stream.receive_side.fd is not None
-        self.defer(self._list_add, self._readers, stream.receive_side)
+        side = stream.receive_side
+        assert side and side.fd is not None
+        self.defer(self.poller.start_receive,
+                   side.fd, (side, stream.on_receive))
 
     def stop_receive(self, stream):
-        IOLOG.debug('%r.stop_receive(%r)', self, stream)
-        self.defer(self._list_discard, self._readers, stream.receive_side)
+        _vv and IOLOG.debug('%r.stop_receive(%r)', self, stream)
+        self.defer(self.poller.stop_receive, stream.receive_side.fd)
 
     def _start_transmit(self, stream):
-        IOLOG.debug('%r._start_transmit(%r)', self, stream)
-        assert stream.transmit_side and stream.transmit_side.fd is not None
-        self._list_add(self._writers, stream.transmit_side)
+        _vv and IOLOG.debug('%r._start_transmit(%r)', self, stream)
+        side = stream.transmit_side
+        assert side and side.fd is not None
+        self.poller.start_transmit(side.fd, (side, stream.on_transmit))
 
     def _stop_transmit(self, stream):
-        IOLOG.debug('%r._stop_transmit(%r)', self, stream)
-        self._list_discard(self._writers, stream.transmit_side)
+        _vv and IOLOG.debug('%r._stop_transmit(%r)', self, stream)
+        self.poller.stop_transmit(stream.transmit_side.fd)
+
+    def call_at(self, when, func, *args, **kwargs):
+        """Arrange for `func(*args, **kwargs)` to be invoked on the broker
+        thread once the UNIX timestamp `when` has passed. May be called from
+        any thread.
+
+        :returns: :class:`Timer` that may be passed to :meth:`cancel`."""
+        timer = Timer(when, func, args, kwargs)
+        self.defer(self._add_timer, timer)
+        return timer
+
+    def call_later(self, delay, func, *args, **kwargs):
+        """Like :meth:`call_at`, but invoke `func` after `delay` seconds."""
+        return self.call_at(time.time() + delay, func, *args, **kwargs)
+
+    def periodic(self, interval, func, *args, **kwargs):
+        """Like :meth:`call_later`, but invoke `func` every `interval` seconds
+        until the returned :class:`Timer` is cancelled. Invocations missed due
+        to a busy broker are not repeated."""
+        timer = Timer(time.time() + interval, func, args, kwargs)
+        timer.interval = interval
+        self.defer(self._add_timer, timer)
+        return timer
+
+    def cancel(self, timer):
+        """Cancel a :class:`Timer` returned by :meth:`call_at`,
+        :meth:`call_later` or :meth:`periodic`. May be called from any
+        thread."""
+        timer.cancel()
+        self.defer(self._on_cancel, timer)
+
+    def _on_cancel(self, timer):
+        # Compact the heap once cancelled timers make up half of it, so
+        # constantly rearmed timeouts do not grow it without bound.
+        if timer._queued and not timer._counted:
+            timer._counted = True
+            self._cancelled += 1
+            if 2 * self._cancelled > len(self._timers):
+                for _, _, other in self._timers:
+                    if other.cancelled:
+                        other._queued = other._counted = False
+                self._timers = [entry for entry in self._timers
+                                if not entry[2].cancelled]
+                heapq.heapify(self._timers)
+                self._cancelled = 0
+
+    def _add_timer(self, timer):
+        if not timer.cancelled:
+            timer._queued = True
+            heapq.heappush(self._timers,
+                           (timer.when, self._timer_seq.next(), timer))
+
+    def _pop_timer(self):
+        timer = heapq.heappop(self._timers)[2]
+        timer._queued = False
+        if timer._counted:
+            timer._counted = False
+            self._cancelled -= 1
+        return timer
+
+    def _run_timers(self):
+        now = time.time()
+        due = []
+        while self._timers and self._timers[0][0] <= now:
+            due.append(self._pop_timer())
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.func(*timer.args, **timer.kwargs)
+            except Exception:
+                LOG.exception('%r crashed', timer)
+            if timer.interval is not None:
+                timer.when = max(timer.when + timer.interval, now)
+                self._add_timer(timer)
 
     def _call(self, stream, func):
         try:
@@ -1427,26 +2801,29 @@ class Broker(object):
             stream.on_disconnect(self)
 
     def _loop_once(self, timeout=None):
-        _vv and IOLOG.debug('%r._loop_once(%r)', self, timeout)
-
-        #IOLOG.debug('readers = %r', self._readers)
-        #IOLOG.debug('writers = %r', self._writers)
-        (rsides, wsides, _), _ = io_op(select.select,
-            self._readers,
-            self._writers,
-            (), timeout
-        )
-
-        for side in rsides:
-            _vv and IOLOG.debug('%r: POLLIN for %r', self, side)
-            self._call(side.stream, side.stream.on_receive)
-
-        for side in wsides:
-            _vv and IOLOG.debug('%r: POLLOUT for %r', self, side)
-            self._call(side.stream, side.stream.on_transmit)
+        _vv and IOLOG.debug('%r._loop_once(%r, %r)',
+                            self, timeout, self.poller)
+        # Don't wake early for timers that were cancelled.
+        while self._timers and self._timers[0][2].cancelled:
+            self._pop_timer()
+        if self._timers:
+            delay = max(0, self._timers[0][0] - time.time())
+            if timeout is None or delay < timeout:
+                timeout = delay
+
+        for (side, func) in self.poller.poll(timeout):
+            self._call(side.stream, func)
+
+        if self._timers:
+            self._run_timers()
+
+    def _all_sides(self):
+        return set(data[0] for _, data in
+                   self.poller.readers + self.poller.writers)
 
     def keep_alive(self):
-        return sum((side.keep_alive for side in self._readers), 0)
+        return self._holds + sum((side.keep_alive
+                                  for _, (side, _) in self.poller.readers), 0)
 
     def _broker_main(self):
         try:
@@ -1455,7 +2832,7 @@ class Broker(object):
 
             fire(self, 'shutdown')
 
-            for side in set(self._readers).union(self._writers):
+            for side in self._all_sides():
                 self._call(side.stream, side.stream.on_shutdown)
 
             deadline = time.time() + self.shutdown_timeout
@@ -1468,12 +2845,16 @@ class Broker(object):
                           'more child processes still connected to '
                           'our stdout/stderr pipes.', self)
 
-            for side in set(self._readers).union(self._writers):
+            self._waker.on_disconnect(self)
+
+            for side in self._all_sides():
                 LOG.error('_broker_main() force disconnecting %r', side)
                 side.stream.on_disconnect(self)
         except Exception:
             LOG.exception('_broker_main() crashed')
 
+        self.poller.close()
+
         fire(self, 'exit')
 
     def shutdown(self):
@@ -1484,6 +2865,7 @@ class Broker(object):
 
     def join(self):
         self._thread.join()
+        fire(self, 'join')
 
     def __repr__(self):
         return 'Broker(%#x)' % (id(self),)
@@ -1507,8 +2889,14 @@ class ExternalContext(object):
         self.broker.shutdown()
 
     def _setup_master(self, max_message_size, profiling, parent_id,
-                      context_id, in_fd, out_fd):
+                      context_id, in_fd, out_fd, codec, oob, zlib_level,
+                      fragment_size):
         Router.max_message_size = max_message_size
+        if codec is not None:
+            Message.codec = codec
+        if oob:
+            # Every context reachable via the parent runs this same core.
+            Message.codec |= FLAG_OOB
         self.profiling = profiling
         if profiling:
             enable_profiling()
@@ -1530,6 +2918,10 @@ class ExternalContext(object):
                                 policy=has_parent_authority)
         self.stream = Stream(self.router, parent_id)
         self.stream.name = 'parent'
+        self.stream.codec = codec
+        self.stream.oob = oob
+        self.stream.zlib_level = zlib_level
+        self.stream.fragment_size = fragment_size
         self.stream.accept(in_fd, out_fd)
         self.stream.receive_side.keep_alive = False
 
@@ -1538,6 +2930,10 @@ class ExternalContext(object):
         listen(self.broker, 'exit', self._on_broker_exit)
 
         os.close(in_fd)
+
+    def _reap_first_stage(self):
+        # Only once the core source has been read from core_src_fd, since the
+        # first stage cannot exit until it has written all of it.
         try:
             os.wait()  # Reap first stage.
         except OSError:
@@ -1651,13 +3047,16 @@ class ExternalContext(object):
     def main(self, parent_ids, context_id, debug, profiling, log_level,
              max_message_size, version, in_fd=100, out_fd=1, core_src_fd=101,
              setup_stdio=True, setup_package=True, importer=None,
-             whitelist=(), blacklist=()):
+             whitelist=(), blacklist=(), codec=None, oob=False,
+             zlib_level=None, fragment_size=None):
         self._setup_master(max_message_size, profiling, parent_ids[0],
-                           context_id, in_fd, out_fd)
+                           context_id, in_fd, out_fd, codec, oob, zlib_level,
+                           fragment_size)
         try:
             try:
                 self._setup_logging(debug, log_level)
                 self._setup_importer(importer, core_src_fd, whitelist, blacklist)
+                self._reap_first_stage()
                 if setup_package:
                     self._setup_package()
                 self._setup_globals(version, context_id, parent_ids)
@@ -31,6 +31,7 @@ import os
 import random
 import sys
 import threading
+import time
 import traceback
 
 import mitogen.core
@@ -158,3 +159,172 @@ class Stream(mitogen.parent.Stream):
     def _connect_bootstrap(self, extra_fd):
         # None required.
         pass
+
+
+class Pool(object):
+    """
+    Keep `size` children forked by `router` connected and idle, so that an
+    isolated context can be acquired without waiting for a fork. Each call to
+    :meth:`get` hands out an idle child, and a background thread forks its
+    replacement. Children are forked from the current context, or from the
+    context `via` when it is not :data:`None`. Remaining keyword arguments
+    are passed to :meth:`Router.fork() <mitogen.parent.Router.fork>`.
+
+    Since idle children are forked ahead of time, they reflect the state of
+    their parent at the moment they were forked, not when they are acquired.
+    An idle child that disconnects is dropped from the pool and replaced.
+    """
+    #: Seconds to wait after :meth:`get` before forking the replacement, so
+    #: the fork and the new child's startup do not compete with the caller's
+    #: first calls to the context it acquired.
+    replenish_delay = 0.1
+
+    def __init__(self, router, size=4, via=None, **kwargs):
+        self.router = router
+        self.size = size
+        self.via = via
+        self.kwargs = kwargs
+        self.closed = False
+        self._lock = threading.Lock()
+        #: Idle contexts, or exceptions raised while forking them.
+        self._idle = mitogen.core.Latch()
+        #: Contexts in :attr:`_idle` that are still connected. Contexts that
+        #: disconnect are removed, and skipped by :meth:`get`.
+        self._connected = set()
+        #: For each child the background thread should fork, the UNIX time
+        #: after which it should be forked.
+        self._demand = mitogen.core.Latch()
+        for x in range(size):
+            self._demand.put(0)
+        self._thread = threading.Thread(
+            name='mitogen.fork.Pool',
+            target=self._replenish_main,
+        )
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def __repr__(self):
+        return 'Pool(size=%d, via=%r)' % (self.size, self.via)
+
+    def _fork(self):
+        context = self.router.fork(via=self.via, **self.kwargs)
+        # Fork streams connect without a handshake; wait for the child to
+        # finish ExternalContext.main() setup before calling it idle.
+        context.call(os.getpid)
+        return context
+
+    def _replenish_main(self):
+        while True:
+            try:
+                when = self._demand.get()
+            except mitogen.core.LatchError:
+                return
+
+            time.sleep(max(0, when - time.time()))
+            if self.closed:
+                return
+
+            try:
+                result = self._fork()
+            except Exception:
+                result = sys.exc_info()[1]
+                if not self.closed:
+                    LOG.error('%r: fork failed: %s', self, result)
+
+            self._lock.acquire()
+            try:
+                if not self.closed:
+                    if isinstance(result, mitogen.core.Context):
+                        self._watch(result)
+                    self._idle.put(result)
+                    result = None
+            finally:
+                self._lock.release()
+
+            if isinstance(result, mitogen.core.Context):
+                result.shutdown()
+
+    def _watch(self, context):
+        # Must be called with _lock held.
+        self._connected.add(context)
+        mitogen.core.listen(context, 'disconnect',
+                            lambda: self._on_idle_disconnect(context))
+
+    def _on_idle_disconnect(self, context):
+        self._lock.acquire()
+        try:
+            if context not in self._connected:
+                return  # Already handed out.
+            self._connected.discard(context)
+            LOG.debug('%r: idle %r disconnected, replacing it', self, context)
+            if not self.closed:
+                self._demand.put(0)
+        finally:
+            self._lock.release()
+
+    def _take(self, result):
+        """Return :data:`True` if `result` taken from :attr:`_idle` may be
+        handed out, or :data:`False` if it is a context that disconnected
+        while idle."""
+        if not isinstance(result, mitogen.core.Context):
+            return True
+        self._lock.acquire()
+        try:
+            if result not in self._connected:
+                return False
+            self._connected.discard(result)
+            return True
+        finally:
+            self._lock.release()
+
+    def get(self, timeout=None):
+        """
+        Return an idle :class:`mitogen.core.Context`, waiting up to `timeout`
+        seconds for one to be forked if none are available.
+
+        :raises mitogen.core.TimeoutError:
+            No child became available before `timeout` expired.
+        :raises mitogen.core.LatchError:
+            The pool has been closed.
+        :raises Exception:
+            The background thread failed to fork the child that would have
+            been returned.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            if timeout is not None:
+                timeout = max(0, deadline - time.time())
+            result = self._idle.get(timeout=timeout)
+            if self._take(result):
+                break
+
+        try:
+            self._demand.put(time.time() + self.replenish_delay)
+        except mitogen.core.LatchError:
+            pass
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        """
+        Stop forking children and shut down any that are idle. Contexts
+        already returned by :meth:`get` are unaffected.
+        """
+        self._lock.acquire()
+        try:
+            self.closed = True
+            self._demand.close()
+            idle = []
+            while not self._idle.empty():
+                result = self._idle.get()
+                if result in self._connected:
+                    idle.append(result)
+            self._idle.close()
+            self._connected.clear()
+        finally:
+            self._lock.release()
+
+        for context in idle:
+            context.shutdown()
@@ -653,8 +653,68 @@ class ModuleResponder(object):
             msg.reply((fullname, None, None, None, ()),
                       handle=mitogen.core.LOAD_MODULE)
 
+    def preload(self, context, fullnames):
+        """
+        Send the modules named by `fullnames`, along with their related
+        modules, to the importer of `context` without waiting for it to
+        request them, so that it starts with them cached. Modules that are
+        blacklisted or cannot be found are skipped, and left for `context` to
+        request as usual.
+
+        Since messages to `context` are delivered in order, this saves one
+        :data:`GET_MODULE <mitogen.core.GET_MODULE>` round trip per module if
+        called before any function depending on them is called in `context`.
+        The modules are sent from the broker thread, where :data:`GET_MODULE
+        <mitogen.core.GET_MODULE>` is handled, and this returns once they are
+        queued.
+        """
+        latch = mitogen.core.Latch()
+        def _preload():
+            try:
+                self._preload(context, fullnames)
+            finally:
+                latch.put(None)
+        self._router.broker.defer(_preload)
+        latch.get()
+
+    def _preload(self, context, fullnames):
+        stream = self._router.stream_by_id(context.context_id)
+        if stream is None:
+            LOG.warning('%r.preload(): no route to %r, skipping',
+                        self, context)
+            return
+
+        if stream.remote_id == context.context_id:
+            sent = stream.sent_modules
+        else:
+            # The stream's record describes the intermediary, not `context`.
+            sent = set(['mitogen', 'mitogen.core'])
+
+        for fullname in fullnames:
+            try:
+                related = self._build_tuple(fullname)[4]
+            except ImportError:
+                LOG.debug('%r.preload(): %r is blacklisted', self, fullname)
+                continue
+
+            for name in list(related) + [fullname]:
+                if name in sent:
+                    continue
+                try:
+                    tup = self._build_tuple(name)
+                except ImportError:
+                    continue
+                if tup[2] is None:
+                    continue
+                LOG.debug('%r.preload(): sending %r to %r', self, name, context)
+                context.send(mitogen.core.Message.pickled(
+                    tup, handle=mitogen.core.LOAD_MODULE
+                ))
+                sent.add(name)
+
 
 class Broker(mitogen.core.Broker):
+    poller_class = mitogen.parent.PREFERRED_POLLER
     shutdown_timeout = 5.0
     _watcher = None
 
@@ -677,6 +737,10 @@ class Router(mitogen.parent.Router):
     debug = False
     profiling = False
 
+    #: Names of modules sent by :meth:`connect` to every new context, unless
+    #: overridden by its `preload_modules` parameter.
+    preload_modules = ()
+
     def __init__(self, broker=None, max_message_size=None):
         if broker is None:
             broker = self.broker_class()
@@ -702,14 +766,107 @@ class Router(mitogen.parent.Router):
         self.broker.shutdown()
         self.broker.join()
 
+    def connect(self, method_name, name=None, preload_modules=None,
+                **kwargs):
+        context = super(Router, self).connect(method_name, name=name,
+                                              **kwargs)
+        if preload_modules is None:
+            preload_modules = self.preload_modules
+        if preload_modules:
+            self.responder.preload(context, preload_modules)
+        return context
+
     def disconnect_stream(self, stream):
-        self.broker.defer(stream.on_disconnect, self.broker)
+        stream._broker.defer(stream.on_disconnect, stream._broker)
 
     def disconnect_all(self):
-        for stream in self._stream_by_id.values():
+        for stream in list(self._ids_by_stream):
             self.disconnect_stream(stream)
 
 
+class ShardedRouter(Router):
+    """
+    :class:`Router` that spreads its directly connected streams across several
+    :class:`Broker` threads, so framing, routing and source verification for
+    thousands of children is not limited to a single core. Streams are
+    assigned to a broker by context ID. The first broker is the one passed to
+    the constructor, and owns everything that is not a stream, such as
+    listeners. Messages are always forwarded by the broker owning the
+    destination stream, so ordering between any pair of contexts is kept.
+    Handlers and disconnection always run on the first broker.
+    """
+    #: Total number of brokers, including :attr:`broker`.
+    shards = 4
+
+    def __init__(self, broker=None, max_message_size=None, shards=None):
+        if shards:
+            self.shards = shards
+        super(ShardedRouter, self).__init__(broker, max_message_size)
+        self._brokers = [self.broker] + [
+            self.broker_class(install_watcher=False)
+            for _ in range(self.shards - 1)
+        ]
+        for broker in self._brokers[1:]:
+            mitogen.core.listen(broker, 'exit', self._on_shard_exit)
+        mitogen.core.listen(self.broker, 'shutdown', self._on_broker_shutdown)
+        mitogen.core.listen(self.broker, 'join', self._on_broker_join)
+
+    def __repr__(self):
+        return 'ShardedRouter(%r, shards=%d)' % (self.broker,
+                                                 len(self._brokers))
+
+    def _on_broker_shutdown(self):
+        # Stop the extra brokers, and keep the first running until they exit,
+        # so the disconnections they defer to it are delivered. They must not
+        # be joined here, since they may be waiting on the first broker.
+        self.broker._holds += len(self._brokers) - 1
+        for broker in self._brokers[1:]:
+            broker.shutdown()
+
+    def _on_shard_exit(self):
+        self.broker.defer(self._release_hold)
+
+    def _release_hold(self):
+        self.broker._holds -= 1
+
+    def _on_broker_join(self):
+        # Runs on the thread calling Broker.join(), after the first broker
+        # exits.
+        for broker in self._brokers[1:]:
+            broker.join()
+
+    def broker_for(self, context_id):
+        return self._brokers[context_id % len(self._brokers)]
+
+    def _is_broker_thread(self):
+        thread = threading.currentThread()
+        for broker in self._brokers:
+            if broker._thread == thread:
+                return True
+        return False
+
+    def _broker_for_msg(self, msg):
+        stream = self._stream_by_id.get(msg.dst_id)
+        if stream is None:
+            return self.broker
+        return stream._broker
+
+    def route(self, msg):
+        if not (self.direct_write and self._route_direct(msg)):
+            self._broker_for_msg(msg).defer(self._async_route, msg)
+
+    def route_many(self, msgs):
+        if self.direct_write:
+            return super(ShardedRouter, self).route_many(msgs)
+
+        msgs_by_broker = {}
+        for msg in msgs:
+            broker = self._broker_for_msg(msg)
+            msgs_by_broker.setdefault(broker, []).append(msg)
+        for broker, msgs in msgs_by_broker.iteritems():
+            broker.defer(self._async_route_many, msgs)
+
+
 class IdAllocator(object):
     def __init__(self, router):
         self.router = router
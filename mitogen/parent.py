@@ -29,6 +29,7 @@
 import errno
 import fcntl
 import getpass
+import hashlib
 import inspect
 import logging
 import os
@@ -110,6 +111,44 @@ def minimize_source(source):
     return tokenize.untokenize(tokens)
 
 
+@lru_cache()
+def get_core_source():
+    """
+    Return the minimized :mod:`mitogen.core` source sent to every new context,
+    ending with a newline.
+    """
+    source = minimize_source(inspect.getsource(mitogen.core))
+    if not source.endswith('\n'):
+        source += '\n'
+    return source
+
+
+@lru_cache()
+def get_core_hash():
+    """
+    Return the SHA-1 hex digest of :func:`get_core_source`, naming the file
+    it is stored in by targets using the preamble cache.
+    """
+    return hashlib.sha1(get_core_source()).hexdigest()
+
+
+@lru_cache()
+def get_core_preamble():
+    """
+    Return ``(compressed, compressor, size)`` for the minimized
+    :mod:`mitogen.core` source, which is identical for every connection and so
+    is minimized and compressed only once per process. `compressed` is a zlib
+    stream flushed to a byte boundary but not terminated, `compressor` is the
+    :func:`zlib.compressobj` that produced it, and `size` is the length of the
+    minimized source.
+    """
+    source = get_core_source()
+    compressor = zlib.compressobj(9)
+    compressed = compressor.compress(source)
+    compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressed, compressor, len(source)
+
+
 def strip_comments(tokens):
     """Drop comment tokens from a `tokenize` stream.
 
@@ -435,8 +474,29 @@ def discard_until(fd, s, deadline):
             return
 
 
+def _upgrade_broker(broker):
+    """
+    Extract the poller state from Broker and replace it with the industrial
+    strength poller for this OS. Must run on the Broker thread.
+    """
+    old = broker.poller
+    new = PREFERRED_POLLER()
+    for fd, data in old.readers:
+        new.start_receive(fd, data)
+    for fd, data in old.writers:
+        new.start_transmit(fd, data)
+
+    old.close()
+    broker.poller = new
+    LOG.debug('replaced %r with %r (new: %d readers, %d writers; '
+              'old: %d readers, %d writers)', old, new,
+              len(new.readers), len(new.writers),
+              len(old.readers), len(old.writers))
+
+
 def upgrade_router(econtext):
     if not isinstance(econtext.router, Router):  # TODO
+        econtext.broker.defer(_upgrade_broker, econtext.broker)
         econtext.router.__class__ = Router  # TODO
         econtext.router.upgrade(
             importer=econtext.importer,
@@ -444,7 +504,7 @@ def upgrade_router(econtext):
         )
 
 
-def make_call_msg(fn, *args, **kwargs):
+def _make_call_msg(codec, fn, args, kwargs):
     if isinstance(fn, types.MethodType) and \
        isinstance(fn.im_self, (type, types.ClassType)):
         klass = fn.im_self.__name__
@@ -454,9 +514,14 @@ def make_call_msg(fn, *args, **kwargs):
     return mitogen.core.Message.pickled(
         (fn.__module__, klass, fn.__name__, args, kwargs),
         handle=mitogen.core.CALL_FUNCTION,
+        codec=codec,
     )
 
 
+def make_call_msg(fn, *args, **kwargs):
+    return _make_call_msg(None, fn, args, kwargs)
+
+
 def stream_by_method_name(name):
     """
     Given the name of a Mitogen connection method, import its implementation
@@ -493,6 +558,100 @@ def _proxy_connect(name, method_name, kwargs, econtext):
     }
 
 
+class EpollPoller(mitogen.core.Poller):
+    """
+    :class:`mitogen.core.Poller` implementation using :func:`select.epoll`,
+    avoiding the ``FD_SETSIZE`` limit and the linear cost of
+    :func:`select.select` as the number of registered descriptors grows.
+    """
+    def __init__(self):
+        super(EpollPoller, self).__init__()
+        self._epoll = select.epoll(32)
+        self._registered_fds = set()
+        self._inmask = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR
+        self._outmask = select.EPOLLOUT | select.EPOLLHUP | select.EPOLLERR
+
+    def close(self):
+        self._epoll.close()
+
+    def _control(self, fd):
+        mitogen.core._vv and IOLOG.debug('%r._control(%r)', self, fd)
+        mask = (((fd in self._rfds) and select.EPOLLIN) |
+                ((fd in self._wfds) and select.EPOLLOUT))
+        if mask:
+            if fd in self._registered_fds:
+                try:
+                    self._epoll.modify(fd, mask)
+                except (IOError, OSError):
+                    # The previous owner of this descriptor number was closed
+                    # without first dropping interest.
+                    e = sys.exc_info()[1]
+                    if e.args[0] != errno.ENOENT:
+                        raise
+                    self._epoll.register(fd, mask)
+            else:
+                self._epoll.register(fd, mask)
+                self._registered_fds.add(fd)
+        elif fd in self._registered_fds:
+            self._registered_fds.remove(fd)
+            try:
+                self._epoll.unregister(fd)
+            except (IOError, OSError):
+                # The kernel already forgot the descriptor if it was closed
+                # before interest was dropped.
+                e = sys.exc_info()[1]
+                if e.args[0] not in (errno.EBADF, errno.ENOENT):
+                    raise
+
+    def start_receive(self, fd, data=None):
+        mitogen.core._vv and IOLOG.debug('%r.start_receive(%r, %r)',
+            self, fd, data)
+        self._rfds[fd] = (data or fd, self._generation)
+        self._control(fd)
+
+    def stop_receive(self, fd):
+        mitogen.core._vv and IOLOG.debug('%r.stop_receive(%r)', self, fd)
+        self._rfds.pop(fd, None)
+        self._control(fd)
+
+    def start_transmit(self, fd, data=None):
+        mitogen.core._vv and IOLOG.debug('%r.start_transmit(%r, %r)',
+            self, fd, data)
+        self._wfds[fd] = (data or fd, self._generation)
+        self._control(fd)
+
+    def stop_transmit(self, fd):
+        mitogen.core._vv and IOLOG.debug('%r.stop_transmit(%r)', self, fd)
+        self._wfds.pop(fd, None)
+        self._control(fd)
+
+    def _poll(self, timeout):
+        the_timeout = -1
+        if timeout is not None:
+            the_timeout = timeout
+
+        events, _ = mitogen.core.io_op(self._epoll.poll, the_timeout, 32)
+        for fd, event in events:
+            if event & self._inmask:
+                data, gen = self._rfds.get(fd, (None, None))
+                if gen and gen < self._generation:
+                    mitogen.core._vv and IOLOG.debug('%r: POLLIN: %r',
+                                                     self, fd)
+                    yield data
+            if event & self._outmask:
+                data, gen = self._wfds.get(fd, (None, None))
+                if gen and gen < self._generation:
+                    mitogen.core._vv and IOLOG.debug('%r: POLLOUT: %r',
+                                                     self, fd)
+                    yield data
+
+
+if sys.platform.startswith('linux') and hasattr(select, 'epoll'):
+    PREFERRED_POLLER = EpollPoller
+else:
+    PREFERRED_POLLER = mitogen.core.Poller
+
+
 class TtyLogStream(mitogen.core.BasicStream):
     """
     For "hybrid TTY/socketpair" mode, after a connection has been setup, a
@@ -523,6 +682,199 @@ class TtyLogStream(mitogen.core.BasicStream):
         LOG.debug('%r.on_receive(): %r', self, buf)
 
 
+class Bootstrap(object):
+    """
+    Non-blocking state machine driven by the broker, which completes the first
+    stage handshake of a newly started :class:`Stream`. Output is read from
+    each of `sides` until ``EC0`` arrives on the stream's receive side, with
+    every chunk passed to :meth:`Stream._on_bootstrap_output` so subclasses
+    may answer password prompts. The preamble is then written, or only its
+    trailer if the first stage instead reported ``EC0C`` because its preamble
+    cache already holds the core source, and ``EC1`` awaited. If `pipelined`
+    is :data:`True`, the preamble is written as soon as the handshake starts,
+    saving a round trip, with ``EC0`` and ``EC1`` only validating the
+    result. The thread calling :meth:`Stream.connect` only waits on
+    :attr:`latch`, which receives :data:`None`, or the exception describing
+    why the handshake failed.
+    """
+    #: Seconds to wait for ``EC1`` once the preamble has been written.
+    ec1_timeout = 10.0
+
+    def __init__(self, stream, sides, pipelined=False):
+        self.stream = stream
+        self.broker = stream._broker
+        self.sides = list(sides)
+        self.pipelined = pipelined
+        self.latch = mitogen.core.Latch()
+        #: Most recent output of every side, used in error messages.
+        self.buf = ''
+        #: Most recent output by side. Markers are only matched against the
+        #: stream's receive side, so output from others, such as a TTY, can
+        #: never split them.
+        self.tail_by_side = {}
+        #: Preamble remaining to be written.
+        self.preamble = None
+        #: True once ``EC0`` has been received.
+        self.ec0 = False
+        self.timer = None
+
+    def __repr__(self):
+        return 'Bootstrap(%r)' % (self.stream,)
+
+    def start(self):
+        """Begin the handshake. Must be called on the broker thread."""
+        for side in self.sides:
+            self._start_receive(side, self._on_ec0_receive)
+        self._set_deadline(self.stream.connect_deadline)
+        if self.pipelined:
+            self._start_transmit(self.stream.get_preamble())
+
+    def wait(self):
+        """Block the calling thread until the handshake completes, raising
+        any exception that caused it to fail."""
+        # Deadlines are enforced on the broker thread; this timeout is only a
+        # backstop should the broker exit before the handshake starts.
+        timeout = None
+        if self.stream.connect_deadline is not None:
+            timeout = (max(0, self.stream.connect_deadline - time.time()) +
+                       self.ec1_timeout + 5.0)
+        e = self.latch.get(timeout=timeout)
+        if e is not None:
+            raise e
+
+    def finish(self, e=None):
+        """End the handshake, causing :meth:`wait` to return, or to raise `e`
+        if it is not :data:`None`. Must be called on the broker thread."""
+        if self.stream._bootstrap is not self:
+            return
+
+        self.stream._bootstrap = None
+        if self.timer:
+            self.broker.cancel(self.timer)
+        for side in self.sides:
+            if side.fd is not None:
+                self.broker.poller.stop_receive(side.fd)
+        if self.preamble is not None:
+            self.broker.poller.stop_transmit(self.stream.transmit_side.fd)
+        self.latch.put(e)
+
+    def _set_deadline(self, when):
+        if self.timer:
+            self.broker.cancel(self.timer)
+        if when is not None:
+            self.timer = self.broker.call_at(when, self._on_timeout)
+
+    def _on_timeout(self):
+        self.finish(mitogen.core.TimeoutError('read timed out'))
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            self.finish(sys.exc_info()[1])
+
+    def _start_receive(self, side, func):
+        self.broker.poller.start_receive(side.fd, (
+            side, lambda broker: self._call(func, side)
+        ))
+
+    def _read(self, side, n=4096):
+        s = side.read(n)
+        if not s:
+            LOG.debug('%r: %r disconnected', self, side)
+            self.broker.poller.stop_receive(side.fd)
+            self.sides.remove(side)
+            if side is self.stream.receive_side or not self.sides:
+                raise mitogen.core.StreamError(
+                    'EOF on stream; last 300 bytes received: %r' %
+                    (self.buf[-300:],)
+                )
+            return s
+
+        LOG.debug('%r: received %r', self, s)
+        self.buf = (self.buf + s)[-300:]
+        self.tail_by_side[side] = (self.tail_by_side.get(side, '') + s)[-300:]
+        return s
+
+    def _receive_tail(self):
+        return self.tail_by_side.get(self.stream.receive_side, '')
+
+    def _read_marker(self, side, marker):
+        # Never read past the marker, since the stream protocol may follow it.
+        tail = self.tail_by_side.get(side, '')
+        matched = len(marker) - 1
+        while matched and not tail.endswith(marker[:matched]):
+            matched -= 1
+        return self._read(side, len(marker) - matched)
+
+    def _on_ec0_receive(self, side):
+        is_receive_side = side is self.stream.receive_side
+        if self.pipelined and is_receive_side:
+            # The first stage may already have consumed the preamble, so EC1
+            # and the stream protocol can immediately follow EC0.
+            s = self._read_marker(side, 'EC0\n')
+        else:
+            s = self._read(side)
+        if s and is_receive_side and self._receive_tail().endswith('EC0\n'):
+            self._on_ec0(self.stream.get_preamble())
+        elif s and is_receive_side and self._receive_tail().endswith('EC0C\n'):
+            self._on_ec0(self.stream.get_trailer())
+        elif s:
+            self.stream._on_bootstrap_output(s)
+
+    def _on_ec0(self, preamble):
+        LOG.debug('%r: EC0 received', self)
+        for side in self.sides[:]:
+            if side is not self.stream.receive_side:
+                self.broker.poller.stop_receive(side.fd)
+                self.sides.remove(side)
+
+        self.buf = ''
+        self.tail_by_side.clear()
+        self.ec0 = True
+        self.broker.poller.stop_receive(self.stream.receive_side.fd)
+        if not self.pipelined:
+            self._start_transmit(preamble)
+        elif self.preamble is None:
+            self._await_ec1()
+
+    def _start_transmit(self, preamble):
+        LOG.debug('%r: writing %d byte preamble', self, len(preamble))
+        self.preamble = preamble
+        side = self.stream.transmit_side
+        self.broker.poller.start_transmit(side.fd, (
+            side, lambda broker: self._call(self._on_transmit)
+        ))
+
+    def _on_transmit(self):
+        side = self.stream.transmit_side
+        n = side.write(self.preamble)
+        if n is None and not self.ec0:
+            # The child exited before reading the preamble. Leave reporting
+            # to the receive side, which includes its output in the error.
+            LOG.debug('%r: EOF on stream during write', self)
+            n = len(self.preamble)
+        elif n is None:
+            raise mitogen.core.StreamError('EOF on stream during write')
+
+        self.preamble = self.preamble[n:]
+        if not self.preamble:
+            self.broker.poller.stop_transmit(side.fd)
+            self.preamble = None
+            if self.ec0:
+                self._await_ec1()
+
+    def _await_ec1(self):
+        self._set_deadline(time.time() + self.ec1_timeout)
+        self._start_receive(self.stream.receive_side, self._on_ec1_receive)
+
+    def _on_ec1_receive(self, side):
+        if self._read_marker(side, 'EC1\n') and \
+                self._receive_tail().endswith('EC1\n'):
+            LOG.debug('%r: EC1 received, handshake complete', self)
+            self.finish()
+
+
 class Stream(mitogen.core.Stream):
     """
     Base for streams capable of starting new slaves.
@@ -550,6 +902,26 @@ class Stream(mitogen.core.Stream):
     #: ExternalContext.main().
     max_message_size = None
 
+    #: Directory relative to the target user's home directory, or absolute
+    #: path, where the first stage caches the :mod:`mitogen.core` source when
+    #: the `preamble_cache` connection option is ``True``.
+    preamble_cache_dir = '.cache/mitogen'
+
+    #: :data:`None`, or the directory used by the first stage to cache the
+    #: :mod:`mitogen.core` source, as set by the `preamble_cache` option.
+    preamble_cache = None
+
+    #: If :data:`True`, the preamble is written as soon as the child starts,
+    #: rather than after the first stage reports ``EC0``.
+    pipelined = True
+
+    #: Names accepted by the `codec` connection option, and their
+    #: :py:attr:`mitogen.core.Message.flags` bits.
+    codecs = {
+        'pickle': 0,
+        'compact': mitogen.core.FLAG_COMPACT,
+    }
+
     def __init__(self, *args, **kwargs):
         super(Stream, self).__init__(*args, **kwargs)
         self.sent_modules = set(['mitogen', 'mitogen.core'])
@@ -559,7 +931,9 @@ class Stream(mitogen.core.Stream):
 
     def construct(self, max_message_size, remote_name=None, python_path=None,
                   debug=False, connect_timeout=None, profiling=False,
-                  old_router=None, **kwargs):
+                  codec=None, oob=True, zlib_level=None,
+                  fragment_size=4 * mitogen.core.CHUNK_SIZE, old_router=None,
+                  preamble_cache=False, pipelined=True, **kwargs):
         """Get the named context running on the local machine, creating it if
         it does not exist."""
         super(Stream, self).construct(**kwargs)
@@ -582,10 +956,30 @@ class Stream(mitogen.core.Stream):
         self.debug = debug
         self.profiling = profiling
         self.max_message_size = max_message_size
+        if codec is not None:
+            self.codec = self.codecs[codec]
+        self.oob = oob
+        self.zlib_level = zlib_level
+        self.fragment_size = fragment_size
+        if preamble_cache is True:
+            self.preamble_cache = self.preamble_cache_dir
+        elif preamble_cache:
+            self.preamble_cache = preamble_cache
+        # The preamble sent depends on whether the cache holds the core.
+        self.pipelined = pipelined and not self.preamble_cache
         self.connect_deadline = time.time() + self.connect_timeout
 
+    #: :class:`Bootstrap` while the first stage handshake is in progress.
+    _bootstrap = None
+
     def on_shutdown(self, broker):
         """Request the slave gracefully shut itself down."""
+        if self._bootstrap:
+            self._bootstrap.finish(mitogen.core.StreamError(
+                'broker shut down during connection'
+            ))
+            return
+
         LOG.debug('%r closing CALL_FUNCTION channel', self)
         self.send(
             mitogen.core.Message(
@@ -632,6 +1026,10 @@ class Stream(mitogen.core.Stream):
                 raise
 
     def on_disconnect(self, broker):
+        if self._bootstrap:
+            self._bootstrap.finish(mitogen.core.StreamError(
+                'stream disconnected during connection'
+            ))
         self._reap_child()
         super(Stream, self).on_disconnect(broker)
 
@@ -663,16 +1061,74 @@ class Stream(mitogen.core.Stream):
         os.fdopen(w,'w',0).write('PREAMBLE_LEN\n'+C)
         os.write(1,'EC1\n')
 
+    # Variant of _first_stage used when the preamble cache is enabled. The
+    # mitogen.core source is read from CACHE_DIR/core-CORE_HASH, relative to
+    # the home directory of the user the first stage runs as, and verified
+    # against CORE_HASH. On success 'EC0C' is written, and only the compressed
+    # ExternalContext.main() trailer is read from stdin. Otherwise 'EC0' is
+    # written, the full preamble is read, and its first CORE_LEN bytes are
+    # stored to a temporary file renamed over the cache file, so concurrent
+    # first stages never observe a partial copy. Each mitogen version produces
+    # a distinct hash, so stale copies are never used.
+    @staticmethod
+    def _first_stage_cached():
+        R,W=os.pipe()
+        r,w=os.pipe()
+        if os.fork():
+            os.dup2(0,100)
+            os.dup2(R,0)
+            os.dup2(r,101)
+            os.close(R)
+            os.close(r)
+            os.close(W)
+            os.close(w)
+            os.environ['ARGV0']=sys.executable
+            os.execl(sys.executable,sys.executable+'(mitogen:CONTEXT_NAME)')
+        import hashlib,pwd
+        P=os.path.join(pwd.getpwuid(os.getuid())[5],'CACHE_DIR','core-CORE_HASH')
+        try:
+            C=open(P,'rb').read()
+            if hashlib.sha1(C).hexdigest()!='CORE_HASH':C=''
+        except IOError:
+            C=''
+        if C:
+            os.write(1,'EC0C\n')
+            C+=_(os.fdopen(0,'rb').read(TRAILER_COMPRESSED_LEN),'zip')
+        else:
+            os.write(1,'EC0\n')
+            C=_(os.fdopen(0,'rb').read(PREAMBLE_COMPRESSED_LEN),'zip')
+            T='%s.%d'%(P,os.getpid())
+            try:
+                if not os.path.isdir(os.path.dirname(P)):os.makedirs(os.path.dirname(P),448)
+                F=os.fdopen(os.open(T,os.O_WRONLY|os.O_CREAT|os.O_EXCL,384),'wb')
+                F.write(C[:CORE_LEN])
+                F.close()
+                os.rename(T,P)
+            except (IOError,OSError):
+                try:os.unlink(T)
+                except OSError:pass
+        os.fdopen(W,'w',0).write(C)
+        os.fdopen(w,'w',0).write('PREAMBLE_LEN\n'+C)
+        os.write(1,'EC1\n')
+
     def get_boot_command(self):
-        source = inspect.getsource(self._first_stage)
+        if self.preamble_cache:
+            source = inspect.getsource(self._first_stage_cached)
+        else:
+            source = inspect.getsource(self._first_stage)
         source = textwrap.dedent('\n'.join(source.strip().split('\n')[2:]))
         source = source.replace('    ', '\t')
         source = source.replace('CONTEXT_NAME', self.remote_name)
-        preamble_compressed = self.get_preamble()
+        preamble_compressed, preamble_len = self._get_preamble()[:2]
         source = source.replace('PREAMBLE_COMPRESSED_LEN',
                                 str(len(preamble_compressed)))
-        source = source.replace('PREAMBLE_LEN',
-                                str(len(zlib.decompress(preamble_compressed))))
+        source = source.replace('PREAMBLE_LEN', str(preamble_len))
+        if self.preamble_cache:
+            source = source.replace('TRAILER_COMPRESSED_LEN',
+                                    str(len(self.get_trailer())))
+            source = source.replace('CORE_LEN', str(len(get_core_source())))
+            source = source.replace('CORE_HASH', get_core_hash())
+            source = source.replace("'CACHE_DIR'", repr(self.preamble_cache))
         encoded = zlib.compress(source, 9).encode('base64').replace('\n', '')
         # We can't use bytes.decode() in 3.x since it was restricted to always
         # return unicode, so codecs.decode() is used instead. In 3.x
@@ -699,14 +1155,41 @@ class Stream(mitogen.core.Stream):
             'blacklist': self._router.get_module_blacklist(),
             'max_message_size': self.max_message_size,
             'version': mitogen.__version__,
+            'codec': self.codec,
+            'oob': self.oob,
+            'zlib_level': self.zlib_level,
+            'fragment_size': self.fragment_size,
         }
 
+    _preamble = None
+
+    def _get_preamble(self):
+        """
+        Return ``(compressed, size, trailer)`` for the bootstrap sent to the
+        first stage: the cached output of :func:`get_core_preamble`, followed
+        by a one line trailer invoking :meth:`ExternalContext.main` with this
+        stream's arguments. Only the trailer is compressed per connection,
+        using a copy of the core compressor, so the result remains a single
+        zlib stream. `trailer` is the trailer alone as a separate zlib stream,
+        sent instead when the first stage found the core source in its
+        preamble cache.
+        """
+        if self._preamble is None:
+            compressed, compressor, size = get_core_preamble()
+            trailer = 'ExternalContext().main(**%r)\n' % (
+                self.get_main_kwargs(),
+            )
+            compressor = compressor.copy()
+            compressed += compressor.compress(trailer) + compressor.flush()
+            self._preamble = (compressed, size + len(trailer),
+                              zlib.compress(trailer, 9))
+        return self._preamble
+
     def get_preamble(self):
-        source = inspect.getsource(mitogen.core)
-        source += '\nExternalContext().main(**%r)\n' % (
-            self.get_main_kwargs(),
-        )
-        return zlib.compress(minimize_source(source), 9)
+        return self._get_preamble()[0]
+
+    def get_trailer(self):
+        return self._get_preamble()[2]
 
     create_child = staticmethod(create_child)
     create_child_args = {}
@@ -736,15 +1219,21 @@ class Stream(mitogen.core.Stream):
             self._reap_child()
             raise
 
-    def _ec0_received(self):
-        LOG.debug('%r._ec0_received()', self)
-        write_all(self.transmit_side.fd, self.get_preamble())
-        discard_until(self.receive_side.fd, 'EC1\n', time.time() + 10.0)
+    def _get_bootstrap_sides(self, extra_fd):
+        """Return the sides whose output is read until ``EC0`` arrives."""
+        return [self.receive_side]
+
+    def _on_bootstrap_output(self, buf):
+        """Called on the broker thread for each chunk of output read during
+        the handshake, prior to ``EC0``. Raise an exception to abandon the
+        connection attempt."""
 
     def _connect_bootstrap(self, extra_fd):
-        deadline = time.time() + self.connect_timeout
-        discard_until(self.receive_side.fd, 'EC0\n', deadline)
-        self._ec0_received()
+        bootstrap = Bootstrap(self, self._get_bootstrap_sides(extra_fd),
+                              pipelined=self.pipelined)
+        self._bootstrap = bootstrap
+        self._broker.defer(bootstrap.start)
+        bootstrap.wait()
 
 
 class ChildIdAllocator(object):
@@ -784,7 +1273,9 @@ class Context(mitogen.core.Context):
     def call_async(self, fn, *args, **kwargs):
         LOG.debug('%r.call_async(%r, *%r, **%r)',
                   self, fn, args, kwargs)
-        return self.send_async(make_call_msg(fn, *args, **kwargs))
+        stream = self.router.stream_by_id(self.context_id)
+        codec = stream and stream.get_codec()
+        return self.send_async(_make_call_msg(codec, fn, args, kwargs))
 
     def call(self, fn, *args, **kwargs):
         receiver = self.call_async(fn, *args, **kwargs)
@@ -847,7 +1338,8 @@ class RouteMonitor(object):
         mitogen.core.listen(
             obj=stream,
             name='disconnect',
-            func=lambda: self._on_stream_disconnect(stream),
+            func=lambda: self.router.broker.defer(self._on_stream_disconnect,
+                                                  stream),
         )
 
     def _on_stream_disconnect(self, stream):
@@ -898,6 +1390,7 @@ class RouteMonitor(object):
 
         LOG.debug('Deleting route to %d via %r', target_id, stream)
         stream.routes.discard(target_id)
+        stream._broker.defer(stream._discard_reassembly, target_id)
         self.router.del_route(target_id)
         self.propagate(mitogen.core.DEL_ROUTE, target_id)
         context = self.router.context_by_id(target_id, create=False)
@@ -933,17 +1426,11 @@ class Router(mitogen.core.Router):
         LOG.debug('%r.add_route(%r, %r)', self, target_id, stream)
         assert isinstance(target_id, int)
         assert isinstance(stream, Stream)
-        try:
-            self._stream_by_id[target_id] = stream
-        except KeyError:
-            LOG.error('%r: cant add route to %r via %r: no such stream',
-                      self, target_id, stream)
+        self._add_route(target_id, stream)
 
     def del_route(self, target_id):
         LOG.debug('%r.del_route(%r)', self, target_id)
-        try:
-            del self._stream_by_id[target_id]
-        except KeyError:
+        if self._del_route(target_id) is None:
             LOG.error('%r: cant delete route to %r: no such stream',
                       self, target_id)
 
@@ -993,6 +1480,68 @@ class Router(mitogen.core.Router):
             return self.proxy_connect(via, method_name, name=name, **kwargs)
         return self._connect(klass, name=name, **kwargs)
 
+    #: Default maximum number of connections :meth:`connect_many` runs at
+    #: once.
+    connect_concurrency = 16
+
+    def connect_many(self, specs, concurrency=None):
+        """
+        Start a connection for each ``(method_name, kwargs)`` pair in `specs`,
+        as if by :meth:`connect`, running at most `concurrency` at once. Each
+        connection enforces its own `connect_timeout`, and failures are
+        reported per connection rather than aborting the remainder.
+
+        :returns:
+            List of :class:`mitogen.core.Receiver`, one per spec in the same
+            order, each eventually receiving a single message whose
+            :meth:`unpickle() <mitogen.core.Message.unpickle>` returns the
+            connected :class:`Context`, or raises
+            :class:`mitogen.core.CallError` describing why connection failed.
+            They may be waited on together using :class:`mitogen.master.Select`.
+        """
+        pending = [
+            (spec, mitogen.core.Receiver(self, persist=False))
+            for spec in specs
+        ]
+        recvs = [recv for spec, recv in pending]
+        pending.reverse()
+        for x in xrange(min(len(pending),
+                            concurrency or self.connect_concurrency)):
+            thread = threading.Thread(
+                name='mitogen.parent.connect_many.%x.worker-%d' % (
+                    id(pending), x,
+                ),
+                target=self._connect_many_main,
+                args=(pending,),
+            )
+            thread.setDaemon(True)
+            thread.start()
+        return recvs
+
+    def _connect_many_main(self, pending):
+        while True:
+            try:
+                (method_name, kwargs), recv = pending.pop()
+            except IndexError:
+                return
+
+            try:
+                result = self.connect(method_name, **kwargs)
+            except Exception:
+                e = sys.exc_info()[1]
+                LOG.debug('%r.connect_many(): %r failed: %s',
+                          self, method_name, e)
+                result = mitogen.core.CallError(e)
+
+            self.route(
+                mitogen.core.Message.pickled(
+                    result,
+                    dst_id=mitogen.context_id,
+                    handle=recv.handle,
+                    router=self,
+                )
+            )
+
     def proxy_connect(self, via_context, method_name, name=None, **kwargs):
         resp = via_context.call(_proxy_connect,
             name=name,
@@ -152,7 +152,8 @@ class Service(object):
         raise NotImplementedError()
 
     def _validate_message(self, msg):
-        if len(msg.data) > self.max_message_size:
+        size = len(msg.data) + sum(len(buf) for buf in msg.buffers)
+        if size > self.max_message_size:
             raise mitogen.core.CallError('Message size exceeded.')
 
         pair = msg.unpickle(throw=False)
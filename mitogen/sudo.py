@@ -156,26 +156,18 @@ class Stream(mitogen.parent.Stream):
     password_incorrect_msg = 'sudo password is incorrect'
     password_required_msg = 'sudo password is required'
 
-    def _connect_bootstrap(self, extra_fd):
+    def _get_bootstrap_sides(self, extra_fd):
         self.tty_stream = mitogen.parent.TtyLogStream(extra_fd, self)
-
-        password_sent = False
-        it = mitogen.parent.iter_read(
-            fds=[self.receive_side.fd, extra_fd],
-            deadline=self.connect_deadline,
-        )
-
-        for buf in it:
-            LOG.debug('%r: received %r', self, buf)
-            if buf.endswith('EC0\n'):
-                self._ec0_received()
-                return
-            elif PASSWORD_PROMPT in buf.lower():
-                if self.password is None:
-                    raise PasswordError(self.password_required_msg)
-                if password_sent:
-                    raise PasswordError(self.password_incorrect_msg)
-                LOG.debug('sending password')
-                self.tty_stream.transmit_side.write(self.password + '\n')
-                password_sent = True
-        raise mitogen.core.StreamError('bootstrap failed')
+        return [self.receive_side, self.tty_stream.receive_side]
+
+    password_sent = False
+
+    def _on_bootstrap_output(self, buf):
+        if PASSWORD_PROMPT in buf.lower():
+            if self.password is None:
+                raise PasswordError(self.password_required_msg)
+            if self.password_sent:
+                raise PasswordError(self.password_incorrect_msg)
+            LOG.debug('sending password')
+            self.tty_stream.transmit_side.write(self.password + '\n')
+            self.password_sent = True
@@ -42,6 +42,7 @@ import tempfile
 
 import mitogen.core
 import mitogen.master
+import mitogen.parent
 
 from mitogen.core import LOG
 
@@ -65,6 +66,9 @@ class Listener(mitogen.core.BasicStream):
 
     def __init__(self, router, path=None, backlog=30):
         self._router = router
+        #: Set of :class:`mitogen.core.Stream` for currently connected
+        #: clients, updated on the broker thread.
+        self.clients = set()
         self.path = path or make_socket_path()
         self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
@@ -78,10 +82,23 @@ class Listener(mitogen.core.BasicStream):
         self.receive_side = mitogen.core.Side(self, self._sock.fileno())
         router.broker.start_receive(self)
 
+    def on_shutdown(self, broker):
+        broker.stop_receive(self)
+        # The Side shares the socket's FD, so let the socket own closing it.
+        self._sock.close()
+        self.receive_side.fd = None
+
     def on_receive(self, broker):
         sock, _ = self._sock.accept()
         sock.setblocking(True)
-        pid, = struct.unpack('>L', sock.recv(4))
+        s = sock.recv(4)
+        if len(s) != 4:
+            # Peer gave up before identifying itself, e.g. is_path_dead().
+            LOG.debug('%r: ignoring client that disconnected early', self)
+            sock.close()
+            return
+
+        pid, = struct.unpack('>L', s)
 
         context_id = self._router.id_allocator.allocate()
         context = mitogen.parent.Context(self._router, context_id)
@@ -90,6 +107,10 @@ class Listener(mitogen.core.BasicStream):
         stream.name = 'unix_client.%d' % (pid,)
         stream.auth_id = mitogen.context_id
         self._router.register(context, stream)
+        self.clients.add(stream)
+        mitogen.core.listen(stream, 'disconnect',
+                            lambda: self.clients.discard(stream))
+        mitogen.core.fire(self, 'connect', stream)
         sock.send(struct.pack('>LLL', context_id, mitogen.context_id,
                               os.getpid()))
         sock.close()
@@ -108,6 +129,11 @@ def connect(path, broker=None):
               mitogen.context_id, remote_id)
 
     router = mitogen.master.Router(broker=broker)
+    # Context IDs belong to the listening process, so allocate them from
+    # there rather than colliding with IDs it assigns to other clients, and
+    # refuse to allocate on its behalf.
+    router.del_handler(mitogen.core.ALLOCATE_ID)
+    router.id_allocator = mitogen.parent.ChildIdAllocator(router)
     stream = mitogen.core.Stream(router, remote_id)
     stream.accept(sock.fileno(), sock.fileno())
     stream.name = 'unix_listener.%d' % (pid,)
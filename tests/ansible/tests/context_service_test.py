@@ -0,0 +1,41 @@
+import unittest2
+
+import mitogen.core
+
+import ansible_mitogen.services
+import testlib
+
+
+class ClientRefTest(testlib.RouterMixin, unittest2.TestCase):
+    def setUp(self):
+        super(ClientRefTest, self).setUp()
+        self.service = ansible_mitogen.services.ContextService(self.router)
+        self.client = self.router.local()
+        self.context = self.router.local()
+        self.service._refs_by_context[self.context] = 2
+
+    def put(self):
+        msg = mitogen.core.Message(src_id=self.client.context_id)
+        self.service.put(msg, self.context)
+
+    def test_put_releases_client_ref(self):
+        self.service._add_client_ref(self.client.context_id, self.context)
+        self.service._add_client_ref(self.client.context_id, self.context)
+        self.put()
+        self.assertEquals({self.context: 1},
+                          self.service._refs_by_client[self.client.context_id])
+        self.put()
+        self.assertEquals({},
+                          self.service._refs_by_client[self.client.context_id])
+        self.assertEquals(0, self.service._refs_by_context[self.context])
+
+    def test_disconnect_after_put(self):
+        self.service._add_client_ref(self.client.context_id, self.context)
+        self.put()
+        self.service._on_client_disconnect(self.client.context_id)
+        # The reference released by put() was not released again.
+        self.assertEquals(1, self.service._refs_by_context[self.context])
+
+
+if __name__ == '__main__':
+    unittest2.main()
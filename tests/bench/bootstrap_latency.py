@@ -0,0 +1,92 @@
+"""
+Measure local() connection latency over an artificially delayed link, with
+the bootstrap preamble written after EC0 arrives, and pipelined immediately
+after the child starts. Every byte exchanged with the child is relayed by
+threads that deliver it a fixed delay after it was sent. Usage:
+
+    python bootstrap_latency.py [rtt_ms [connects]]
+"""
+
+import os
+import Queue
+import socket
+import sys
+import threading
+import time
+
+import mitogen.core
+import mitogen.master
+import mitogen.parent
+import mitogen.utils
+
+
+def relay(src, dst, delay):
+    queue = Queue.Queue()
+
+    def read():
+        while True:
+            s = mitogen.core.io_op(os.read, src, 65536)[0]
+            queue.put((time.time() + delay, s))
+            if not s:
+                return
+
+    def write():
+        while True:
+            when, s = queue.get()
+            time.sleep(max(0, when - time.time()))
+            if not s:
+                os.close(dst)
+                return
+            mitogen.parent.write_all(dst, s)
+
+    for func in read, write:
+        thread = threading.Thread(target=func)
+        thread.setDaemon(True)
+        thread.start()
+
+
+class DelayedStream(mitogen.parent.Stream):
+    #: One-way delay applied to data in each direction.
+    delay = 0.075
+
+    def create_child(self, args):
+        pid, fd, extra_fd = mitogen.parent.create_child(args)
+        ours, theirs = socket.socketpair()
+        ours_fd = os.dup(ours.fileno())
+        theirs_fd = os.dup(theirs.fileno())
+        ours.close()
+        theirs.close()
+        relay(theirs_fd, fd, self.delay)
+        relay(os.dup(fd), os.dup(theirs_fd), self.delay)
+        return pid, ours_fd, extra_fd
+
+
+def time_connect(router, pipelined, connects):
+    contexts = []
+    t0 = time.time()
+    for x in xrange(connects):
+        contexts.append(router._connect(DelayedStream, pipelined=pipelined))
+    t1 = time.time()
+    for context in contexts:
+        context.shutdown()
+    return 1e3 * (t1 - t0) / connects
+
+
+def main():
+    DelayedStream.delay = int((sys.argv[1:2] or [150])[0]) / 2e3
+    connects = int((sys.argv[2:3] or [10])[0])
+    router = mitogen.master.Router()
+    try:
+        for pipelined in False, True:
+            print 'rtt=%dms pipelined=%-5s %8.2f ms/connection' % (
+                2e3 * DelayedStream.delay, pipelined,
+                time_connect(router, pipelined, connects),
+            )
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,100 @@
+"""
+Measure serialization CPU time for typical CALL_FUNCTION and reply payloads
+using Message.pickled()/unpickle() with each codec, and with the pure Python
+pickle module used where cPickle is unavailable. Then measure call() round
+trip latency to local() children connected with each codec. Usage:
+
+    python codec.py [loops [calls]]
+"""
+
+import pickle
+import sys
+import time
+
+import mitogen.core
+import mitogen.master
+import mitogen.utils
+
+
+CALL = ('ansible_mitogen.target', None, 'run_module', ({
+    'module': 'command',
+    'args': {'_raw_params': 'ls -l /tmp', '_ansible_check_mode': False},
+    'env': {'LANG': 'C'},
+},), {})
+
+REPLY = {
+    'changed': True,
+    'rc': 0,
+    'stdout': 'total 0\n' * 20,
+    'stderr': '',
+    'cmd': ['ls', '-l', '/tmp'],
+    'start': '2018-03-01 12:00:00.000000',
+    'delta': '0:00:00.003000',
+    'invocation': {'module_args': {'_raw_params': 'ls -l /tmp'}},
+}
+
+
+def ping():
+    return True
+
+
+def time_codec(obj, codec, loops):
+    msg = mitogen.core.Message.pickled(obj, codec=codec)
+    t0 = time.time()
+    for x in xrange(loops):
+        mitogen.core.Message.pickled(obj, codec=codec)
+    t1 = time.time()
+    for x in xrange(loops):
+        mitogen.core.Message(data=msg.data, flags=msg.flags).unpickle()
+    t2 = time.time()
+    return len(msg.data), 1e6 * (t1 - t0) / loops, 1e6 * (t2 - t1) / loops
+
+
+def time_pure_pickle(obj, loops):
+    s = pickle.dumps(obj, 2)
+    t0 = time.time()
+    for x in xrange(loops):
+        pickle.dumps(obj, 2)
+    t1 = time.time()
+    for x in xrange(loops):
+        pickle.loads(s)
+    t2 = time.time()
+    return len(s), 1e6 * (t1 - t0) / loops, 1e6 * (t2 - t1) / loops
+
+
+def time_calls(codec, calls):
+    router = mitogen.master.Router()
+    try:
+        context = router.local(codec=codec)
+        context.call(ping)
+        t0 = time.time()
+        for x in xrange(calls):
+            context.call(ping)
+        return 1e6 * (time.time() - t0) / calls
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+def main():
+    loops = int((sys.argv[1:2] or [20000])[0])
+    calls = int((sys.argv[2:3] or [3000])[0])
+
+    fmt = '%-6s %-14s %5d bytes %8.2f us encode %8.2f us decode'
+    for name, obj in ('call', CALL), ('reply', REPLY):
+        print fmt % ((name, 'cPickle') +
+                     time_codec(obj, 0, loops))
+        print fmt % ((name, 'pickle (pure)') +
+                     time_pure_pickle(obj, loops))
+        print fmt % ((name, 'compact') +
+                     time_codec(obj, mitogen.core.FLAG_COMPACT, loops))
+
+    for codec in 'pickle', 'compact':
+        print 'codec=%-8s %6d calls: %8.1f us/call' % (
+            codec, calls, time_calls(codec, calls),
+        )
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,85 @@
+"""
+Measure the size on the wire and the per-message CPU cost of stream
+compression for a typical JSON module result, then measure call() round trip
+time to local() children returning that result with each zlib level. Usage:
+
+    python compression.py [loops [calls]]
+"""
+
+import json
+import sys
+import time
+
+import mitogen.core
+import mitogen.master
+import mitogen.utils
+
+
+RESULT = json.dumps({
+    'changed': False,
+    'invocation': {'module_args': {'path': '/etc', 'recurse': True}},
+    'files': [
+        {
+            'path': '/etc/file%d.conf' % (i,),
+            'mode': '0644',
+            'uid': 0,
+            'gid': 0,
+            'size': 1024 + i,
+            'isreg': True,
+            'mtime': 1520000000.0 + i,
+        }
+        for i in range(100)
+    ],
+})
+
+
+def get_result():
+    return RESULT
+
+
+class FakeRouter(object):
+    max_message_size = 128 * 1048576
+
+    def broker_for(self, context_id):
+        return None
+
+
+def time_stream(level, loops):
+    stream = mitogen.core.Stream(FakeRouter(), 1)
+    stream.zlib_level = level
+    msg = mitogen.core.Message.pickled(RESULT, dst_id=1, handle=123)
+    t0 = time.time()
+    size = 0
+    for x in xrange(loops):
+        size += len(stream._pack(msg)[0])
+    return size / loops, 1e6 * (time.time() - t0) / loops
+
+
+def time_calls(level, calls):
+    router = mitogen.master.Router()
+    try:
+        context = router.local(zlib_level=level)
+        context.call(get_result)
+        t0 = time.time()
+        for x in xrange(calls):
+            context.call(get_result)
+        return 1e6 * (time.time() - t0) / calls
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+def main():
+    loops = int((sys.argv[1:2] or [5000])[0])
+    calls = int((sys.argv[2:3] or [2000])[0])
+
+    print 'uncompressed result: %d bytes' % (len(RESULT),)
+    for level in None, 1, 6:
+        print 'zlib_level=%-4s %6d bytes/msg %8.2f us/msg %8.1f us/call' % (
+            (level,) + time_stream(level, loops) + (time_calls(level, calls),)
+        )
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure the master CPU time spent preparing the bootstrap for each new
+connection, and the wall clock latency of local() connections made one at a
+time and using connect_many(). Usage:
+
+    python connect.py [loops [connects]]
+"""
+
+import sys
+import time
+
+import mitogen.core
+import mitogen.master
+import mitogen.parent
+import mitogen.utils
+
+
+def time_boot_command(router, loops):
+    mitogen.parent.get_core_preamble()
+    t0 = time.time()
+    for x in xrange(loops):
+        stream = mitogen.parent.Stream(router, 1000 + x,
+                                       max_message_size=router.max_message_size)
+        stream.get_boot_command()
+        stream.get_preamble()
+    return 1e3 * (time.time() - t0) / loops
+
+
+def time_connect(router, connects):
+    contexts = []
+    t0 = time.time()
+    for x in xrange(connects):
+        contexts.append(router.local())
+    t1 = time.time()
+    for context in contexts:
+        context.shutdown()
+    return 1e3 * (t1 - t0) / connects
+
+
+def time_connect_many(router, connects):
+    t0 = time.time()
+    recvs = router.connect_many([('local', {})] * connects)
+    contexts = [recv.get().unpickle() for recv in recvs]
+    t1 = time.time()
+    for context in contexts:
+        context.shutdown()
+    return 1e3 * (t1 - t0) / connects
+
+
+def main():
+    loops = int((sys.argv[1:2] or [200])[0])
+    connects = int((sys.argv[2:3] or [50])[0])
+    router = mitogen.master.Router()
+    try:
+        print 'boot command + preamble: %8.3f ms/connection' % (
+            time_boot_command(router, loops),
+        )
+        print 'local() connect:         %8.3f ms/connection' % (
+            time_connect(router, connects),
+        )
+        print 'connect_many():          %8.3f ms/connection' % (
+            time_connect_many(router, connects),
+        )
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,54 @@
+"""
+Measure the router's cost of handling stream disconnection with many
+registered contexts: once for a single bastion stream carrying every context,
+and once per stream when each context has its own stream, as when many
+children churn. Usage:
+
+    python disconnect.py [contexts]
+"""
+
+import sys
+import time
+
+import mitogen.core
+import mitogen.master
+import mitogen.utils
+
+
+class FakeStream(object):
+    pass
+
+
+def populate(router, count, streams):
+    for context_id in xrange(1000, 1000 + count):
+        stream = streams[context_id % len(streams)]
+        router._add_route(context_id, stream)
+        router._context_by_id[context_id] = router.context_class(
+            router, context_id)
+
+
+def time_disconnect(count, nstreams):
+    router = mitogen.master.Router()
+    try:
+        streams = [FakeStream() for x in xrange(nstreams)]
+        populate(router, count, streams)
+        t0 = time.time()
+        for stream in streams:
+            router.on_stream_disconnect(stream)
+        return 1e3 * (time.time() - t0)
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+def main():
+    count = int((sys.argv[1:2] or [10000])[0])
+    for nstreams in 1, count:
+        print '%d contexts, %5d streams: %8.2f ms to disconnect all' % (
+            count, nstreams, time_disconnect(count, nstreams),
+        )
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
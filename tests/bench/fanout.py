@@ -0,0 +1,53 @@
+"""
+Measure the cost of handing many messages from a user thread to the broker,
+one route() call per message versus a single route_many() call.
+"""
+
+import time
+
+import mitogen.core
+import mitogen.master
+
+
+COUNT = 2000
+LOOPS = 20
+
+
+def measure(router, recv, func):
+    t0 = time.time()
+    for x in xrange(LOOPS):
+        msgs = [
+            mitogen.core.Message(dst_id=mitogen.context_id,
+                                 handle=recv.handle)
+            for x in xrange(COUNT)
+        ]
+        func(router, msgs)
+        for x in xrange(COUNT):
+            recv.get()
+    return 1e6 * (time.time() - t0) / (LOOPS * COUNT)
+
+
+def route_each(router, msgs):
+    for msg in msgs:
+        router.route(msg)
+
+
+def route_many(router, msgs):
+    router.route_many(msgs)
+
+
+def main():
+    router = mitogen.master.Router()
+    try:
+        recv = mitogen.core.Receiver(router)
+        for func in route_each, route_many:
+            print '%-12s %d messages: %6.2f usec/message' % (
+                func.__name__, COUNT, measure(router, recv, func),
+            )
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measure the latency of acquiring a new context and completing its first call,
+using local() as in local.py, fork(), and a mitogen.fork.Pool with idle
+children available. Time spent by the pool replacing children, which begins
+Pool.replenish_delay seconds after each get(), is excluded.
+Usage:
+
+    python fork_pool.py [loops]
+"""
+
+import os
+import sys
+import time
+
+import mitogen.fork
+import mitogen.master
+import mitogen.utils
+
+
+def time_acquire(get, loops, settle=0):
+    total = 0.0
+    for x in xrange(loops):
+        t0 = time.time()
+        context = get()
+        context.call(os.getpid)
+        total += time.time() - t0
+        context.shutdown()
+        time.sleep(settle)
+    return 1e3 * total / loops
+
+
+def main():
+    loops = int((sys.argv[1:2] or [50])[0])
+    router = mitogen.master.Router()
+    try:
+        print 'local():    %8.3f ms/context' % (
+            time_acquire(router.local, loops),
+        )
+        print 'fork():     %8.3f ms/context' % (
+            time_acquire(router.fork, loops),
+        )
+        pool = mitogen.fork.Pool(router, size=4)
+        try:
+            pool.get().shutdown()
+            print 'Pool.get(): %8.3f ms/context' % (
+                time_acquire(pool.get, loops, settle=0.2),
+            )
+        finally:
+            pool.close()
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
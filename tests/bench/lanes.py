@@ -0,0 +1,63 @@
+"""
+Measure call() latency to a local() child while a large transfer to the same
+child is queued on its stream, with the transfer sent in the control lane
+(as before lanes existed) and in the bulk lane. Usage:
+
+    python lanes.py [megabytes]
+"""
+
+import sys
+import threading
+import time
+
+import mitogen.core
+import mitogen.master
+import mitogen.utils
+
+
+def ping():
+    return True
+
+
+@mitogen.core.takes_router
+def start_sink(router):
+    recv = mitogen.core.Receiver(router)
+    thread = threading.Thread(target=lambda: list(recv.iter_bytes()))
+    thread.setDaemon(True)
+    thread.start()
+    return recv.to_sender()
+
+
+def time_call_during_transfer(bulk, megabytes):
+    router = mitogen.master.Router()
+    try:
+        context = router.local()
+        sender = context.call(start_sink)
+        sender.bulk = bulk
+        context.call(ping)
+
+        chunk = ' ' * mitogen.core.CHUNK_SIZE
+        for x in xrange(megabytes * 1048576 / len(chunk)):
+            sender.send_bytes(chunk)
+
+        t0 = time.time()
+        context.call(ping)
+        t1 = time.time()
+        sender.close()
+        return 1e3 * (t1 - t0)
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+def main():
+    megabytes = int((sys.argv[1:2] or [256])[0])
+    for bulk in False, True:
+        print 'bulk=%-5s %d MiB queued: call() took %8.2f ms' % (
+            bulk, megabytes, time_call_during_transfer(bulk, megabytes),
+        )
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,49 @@
+"""
+Measure Latch wakeup latency by bouncing an object between two threads
+through a pair of latches, for each waiter class, with and without a timeout
+set on get(). Usage:
+
+    python latch.py [round trips]
+"""
+
+import sys
+import threading
+import time
+
+import mitogen.core
+
+
+def bounce(klass, rounds, timeout):
+    class latch_class(mitogen.core.Latch):
+        waiter_class = klass
+
+    ping = latch_class()
+    pong = latch_class()
+
+    def echo():
+        for x in xrange(rounds):
+            pong.put(ping.get(timeout=timeout))
+
+    thread = threading.Thread(target=echo)
+    thread.start()
+    t0 = time.time()
+    for x in xrange(rounds):
+        ping.put(x)
+        pong.get(timeout=timeout)
+    elapsed = time.time() - t0
+    thread.join()
+    return 1e6 * elapsed / rounds
+
+
+def main():
+    rounds = int((sys.argv[1:2] or [20000])[0])
+    for klass in mitogen.core.FdWaiter, mitogen.core.LockWaiter:
+        for timeout in None, 10.0:
+            usec = bounce(klass, rounds, timeout)
+            print '%-10s timeout=%-5s %8.1f us/round trip' % (
+                klass.__name__, timeout, usec,
+            )
+
+
+if __name__ == '__main__':
+    main()
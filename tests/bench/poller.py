@@ -0,0 +1,69 @@
+"""
+Measure the cost of a single poll() call as the number of idle registered
+streams grows, for each Poller implementation available. A single stream is
+kept readable, as when a busy connection shares the broker with many idle
+ones.
+"""
+
+import resource
+import select
+import socket
+import time
+
+import mitogen.core
+import mitogen.parent
+
+
+COUNTS = [10, 100, 500, 1000, 2000, 4000]
+LOOPS = 2000
+
+
+def raise_fd_limit(want):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < want:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(want, hard), hard))
+
+
+def measure(klass, count):
+    pairs = [socket.socketpair() for x in xrange(count)]
+    poller = klass()
+    try:
+        for rsock, wsock in pairs:
+            poller.start_receive(rsock.fileno())
+
+        # Keep one stream permanently readable.
+        pairs[-1][1].send('x')
+
+        t0 = time.time()
+        for x in xrange(LOOPS):
+            for fd in poller.poll(0):
+                pass
+        return 1e6 * (time.time() - t0) / LOOPS
+    finally:
+        poller.close()
+        for rsock, wsock in pairs:
+            rsock.close()
+            wsock.close()
+
+
+def main():
+    raise_fd_limit(2 * max(COUNTS) + 64)
+    klasses = [mitogen.core.Poller]
+    if mitogen.parent.PREFERRED_POLLER is not mitogen.core.Poller:
+        klasses.append(mitogen.parent.PREFERRED_POLLER)
+
+    print '%-8s %s' % ('streams', ' '.join('%14s' % (k.__name__,)
+                                            for k in klasses))
+    for count in COUNTS:
+        results = []
+        for klass in klasses:
+            try:
+                results.append('%11.2f us' % (measure(klass, count),))
+            except (ValueError, select.error):
+                # select() refuses descriptors >= FD_SETSIZE.
+                results.append('%14s' % ('FD_SETSIZE',))
+        print '%-8d %s' % (count, ' '.join(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measure the latency of the first call into a package over an artificially
+delayed link, with the package imported on demand, and preloaded using
+ModuleResponder.preload() as connect() does. The package is found only by the master, so the child must fetch
+it. Usage:
+
+    python preload.py [rtt_ms [connects]]
+"""
+
+import os
+import sys
+import time
+
+import mitogen.master
+import mitogen.utils
+
+import bootstrap_latency
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../data'))
+import simple_pkg.a
+
+
+MODULES = ['simple_pkg', 'simple_pkg.a', 'simple_pkg.b']
+
+
+def time_first_call(router, preload_modules, connects):
+    total = 0.0
+    for x in xrange(connects):
+        context = router._connect(bootstrap_latency.DelayedStream)
+        if preload_modules:
+            router.responder.preload(context, preload_modules)
+        t0 = time.time()
+        context.call(simple_pkg.a.subtract_one_add_two, 2)
+        total += time.time() - t0
+        context.shutdown()
+    return 1e3 * total / connects
+
+
+def main():
+    delay = int((sys.argv[1:2] or [150])[0]) / 2e3
+    bootstrap_latency.DelayedStream.delay = delay
+    connects = int((sys.argv[2:3] or [5])[0])
+    router = mitogen.master.Router()
+    try:
+        for preload_modules in (), MODULES:
+            print 'rtt=%dms preload=%-5s first call: %8.2f ms' % (
+                2e3 * delay, bool(preload_modules),
+                time_first_call(router, preload_modules, connects),
+            )
+    finally:
+        router.broker.shutdown()
+        router.broker.join()
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure call() round trip latency to a local() child, with messages handed to
+the broker thread as usual and with Router.direct_write enabled. Usage:
+
+    python roundtrip.py [calls]
+"""
+
+import sys
+import time
+
+import mitogen.master
+import mitogen.utils
+
+
+def ping():
+    return True
+
+
+def measure(router, calls):
+    context = router.local()
+    context.call(ping)
+    t0 = time.time()
+    for x in xrange(calls):
+        context.call(ping)
+    return 1e6 * (time.time() - t0) / calls
+
+
+def main():
+    calls = int((sys.argv[1:2] or [5000])[0])
+    for direct_write in False, True:
+        router = mitogen.master.Router()
+        router.direct_write = direct_write
+        try:
+            usec = measure(router, calls)
+        finally:
+            router.broker.shutdown()
+            router.broker.join()
+        print 'direct_write=%-5s %6d calls: %8.1f us/call' % (
+            direct_write, calls, usec,
+        )
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
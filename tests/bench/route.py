@@ -0,0 +1,68 @@
+"""
+Measure the per-message CPU cost on the path a message takes through an
+intermediary context: parse the header from a stream's input buffer, construct
+a Message, hand it to the router, and pack it again for the next stream.
+Usage:
+
+    python route.py [messages]
+"""
+
+import sys
+import time
+
+import mitogen.core
+import mitogen.utils
+
+
+class FakeRouter(object):
+    max_message_size = 128 * 1048576
+
+    def __init__(self):
+        self.count = 0
+
+    def broker_for(self, context_id):
+        return None
+
+    def _async_route(self, msg, stream=None):
+        self.out._pack(msg)
+        self.count += 1
+
+
+def time_alloc(count):
+    Message = mitogen.core.Message
+    t0 = time.time()
+    for x in xrange(count):
+        Message(dst_id=1, handle=100, data='x')
+    return 1e6 * (time.time() - t0) / count
+
+
+def time_route(count, size):
+    router = FakeRouter()
+    router.out = mitogen.core.Stream(router, 2)
+    stream = mitogen.core.Stream(router, 1)
+    msg = mitogen.core.Message(dst_id=2, handle=100, data='x' * size)
+    pkt = ''.join(stream._pack(msg))
+
+    # Feed input in CHUNK_SIZE reads, as on_receive() would.
+    per_chunk = max(1, mitogen.core.CHUNK_SIZE // len(pkt))
+    chunk = pkt * per_chunk
+    t0 = time.time()
+    while router.count < count:
+        stream._input_buf.append(chunk)
+        stream._input_buf_len += len(chunk)
+        while stream._receive_one(None):
+            pass
+    return 1e6 * (time.time() - t0) / router.count
+
+
+def main():
+    count = int((sys.argv[1:2] or [500000])[0])
+    print 'Message():    %6.3f us/msg' % (time_alloc(count),)
+    for size in 0, 100, 4096:
+        us = time_route(count, size)
+        print 'route %4d b: %6.3f us/msg %9d msg/sec' % (size, us, 1e6 / us)
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
@@ -0,0 +1,52 @@
+"""
+Measure aggregate call() throughput to many local() children, for a Router
+with a single broker thread and for ShardedRouter. Usage:
+
+    python scale.py [children [shards]]
+"""
+
+import sys
+import time
+
+import mitogen.master
+import mitogen.utils
+
+
+ROUNDS = 20
+
+
+def ping():
+    return True
+
+
+def measure(router, count):
+    contexts = [router.local() for x in xrange(count)]
+    t0 = time.time()
+    for x in xrange(ROUNDS):
+        recvs = [context.call_async(ping) for context in contexts]
+        for msg in mitogen.master.Select(recvs):
+            assert msg.unpickle()
+    return time.time() - t0
+
+
+def main():
+    count = int((sys.argv[1:2] or [200])[0])
+    shards = int((sys.argv[2:3] or [4])[0])
+
+    for klass, kwargs in ((mitogen.master.Router, {}),
+                          (mitogen.master.ShardedRouter, {'shards': shards})):
+        router = klass(**kwargs)
+        try:
+            elapsed = measure(router, count)
+        finally:
+            router.broker.shutdown()
+            router.broker.join()
+        calls = count * ROUNDS
+        print '%-14s %5d children: %8.3f sec, %8.1f calls/sec' % (
+            klass.__name__, count, elapsed, calls / elapsed,
+        )
+
+
+if __name__ == '__main__':
+    mitogen.utils.log_to_file()
+    main()
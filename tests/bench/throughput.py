@@ -0,0 +1,39 @@
+"""
+Measure throughput of large messages through a local() context, as seen by
+FileService chunks (128 KiB) and bulk put_data()/read_path() calls (64 MiB).
+"""
+
+import time
+
+import mitogen
+
+
+SIZES = [
+    (128 * 1024, 2000),
+    (64 * 1048576, 8),
+]
+
+
+def make_string(size):
+    return 'x' * size
+
+
+def measure(context, size, count):
+    # Prime the remote importer.
+    context.call(make_string, 1)
+    t0 = time.time()
+    for x in xrange(count):
+        s = context.call(make_string, size)
+        assert len(s) == size
+    return time.time() - t0
+
+
+@mitogen.main()
+def main(router):
+    context = router.local()
+    for size, count in SIZES:
+        elapsed = measure(context, size, count)
+        mib = size * count / 1048576.0
+        print '%9d bytes x %5d: %8.3f sec, %8.2f MiB/sec' % (
+            size, count, elapsed, mib / elapsed,
+        )
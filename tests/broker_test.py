@@ -0,0 +1,52 @@
+
+import threading
+
+import mock
+import unittest2
+
+import mitogen.core
+
+import testlib
+
+
+class DeferTest(testlib.BrokerMixin, testlib.TestCase):
+    def test_defer_order(self):
+        latch = mitogen.core.Latch()
+        for x in range(100):
+            self.broker.defer(latch.put, x)
+        self.assertEquals(range(100), [latch.get() for x in range(100)])
+
+    def test_immediate_on_broker_thread(self):
+        latch = mitogen.core.Latch()
+        def func():
+            self.broker.defer(latch.put, 1)
+            latch.put(2)
+        self.broker.defer(func)
+        self.assertEquals([1, 2], [latch.get(), latch.get()])
+
+    def test_single_wakeup_while_busy(self):
+        # While the broker is blocked, only the first of many deferred calls
+        # should write to the waker pipe.
+        started = threading.Event()
+        release = threading.Event()
+        def block():
+            started.set()
+            release.wait()
+        self.broker.defer(block)
+        started.wait()
+
+        side = self.broker._waker.transmit_side
+        side.write = mock.Mock(side_effect=side.write)
+        try:
+            latch = mitogen.core.Latch()
+            for x in range(100):
+                self.broker.defer(latch.put, x)
+            release.set()
+            self.assertEquals(range(100), [latch.get() for x in range(100)])
+            self.assertEquals(1, side.write.call_count)
+        finally:
+            del side.write
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,176 @@
+
+import cPickle
+
+import unittest2
+
+import mitogen.core
+
+import testlib
+
+
+def echo(x):
+    return x
+
+
+class CompactTest(testlib.RouterMixin, testlib.TestCase):
+    def roundtrip(self, obj):
+        msg = mitogen.core.Message.pickled(obj,
+                                           codec=mitogen.core.FLAG_COMPACT)
+        self.assertTrue(msg.flags & mitogen.core.FLAG_COMPACT)
+        msg.router = self.router
+        return msg.unpickle()
+
+    def test_scalars(self):
+        for obj in (None, True, False, 0, -1, 2**31 - 1, -2**31, 2**40,
+                    0L, -1L, 2**31 - 1L, 2**40L, -2**70, 1.5, '', 'x' * 300,
+                    u'\u20ac', u'x' * 300):
+            got = self.roundtrip(obj)
+            self.assertEquals(obj, got)
+            self.assertEquals(type(obj), type(got))
+
+    def test_huge_int(self):
+        for obj in (10**300, -10**300):
+            self.assertEquals(obj, self.roundtrip(obj))
+
+    def test_containers(self):
+        obj = ([1, (2, 'x' * 300)], {'a': {'b': range(300)}}, ())
+        self.assertEquals(obj, self.roundtrip(obj))
+
+    def test_context(self):
+        context = self.roundtrip(mitogen.core.Context(None, 123, 'name'))
+        self.assertTrue(isinstance(context, mitogen.core.Context))
+        self.assertEquals(123, context.context_id)
+        self.assertEquals('name', context.name)
+        self.assertEquals(self.router, context.router)
+
+    def test_sender(self):
+        sender = self.roundtrip(
+            mitogen.core.Sender(mitogen.core.Context(None, 123), 456)
+        )
+        self.assertTrue(isinstance(sender, mitogen.core.Sender))
+        self.assertEquals(123, sender.context.context_id)
+        self.assertEquals(456, sender.dst_handle)
+
+    def test_call_error(self):
+        msg = mitogen.core.Message.pickled(mitogen.core.CallError('oops'),
+                                           codec=mitogen.core.FLAG_COMPACT)
+        e = self.assertRaises(mitogen.core.CallError, msg.unpickle)
+        self.assertEquals('oops', str(e))
+
+    def test_unsupported_falls_back(self):
+        msg = mitogen.core.Message.pickled(set([1]),
+                                           codec=mitogen.core.FLAG_COMPACT)
+        self.assertFalse(msg.flags & mitogen.core.FLAG_COMPACT)
+        self.assertEquals(set([1]), cPickle.loads(msg.data))
+
+    def test_invalid(self):
+        data = mitogen.core.compact_dumps(('x' * 10, 1))
+        for bad in (data[:-1], data + 'x', 'q'):
+            msg = mitogen.core.Message(data=bad,
+                                       flags=mitogen.core.FLAG_COMPACT)
+            self.assertRaises(mitogen.core.StreamError, msg.unpickle)
+
+    def test_reply_uses_request_codec(self):
+        recv = mitogen.core.Receiver(self.router)
+        msg = mitogen.core.Message.pickled(None,
+                                           codec=mitogen.core.FLAG_COMPACT,
+                                           reply_to=recv.handle)
+        msg.reply(123, router=self.router)
+        reply = recv.get()
+        self.assertTrue(reply.flags & mitogen.core.FLAG_COMPACT)
+        self.assertEquals(123, reply.unpickle())
+
+
+class OobTest(testlib.RouterMixin, testlib.TestCase):
+    big = 'x' * mitogen.core.Message.oob_threshold
+
+    def roundtrip(self, obj, codec):
+        msg = mitogen.core.Message.pickled(
+            obj,
+            codec=codec | mitogen.core.FLAG_OOB,
+        )
+        self.assertTrue(msg.flags & mitogen.core.FLAG_OOB)
+        msg.router = self.router
+        return msg, msg.unpickle()
+
+    def test_pickle(self):
+        obj = {'a': [self.big, 'small'], 'b': self.big + 'y'}
+        msg, got = self.roundtrip(obj, 0)
+        self.assertEquals(obj, got)
+        self.assertEquals(2, len(msg.buffers))
+        self.assertTrue(len(msg.data) < 100)
+        self.assertTrue(got['a'][0] is msg.buffers[0] or
+                        got['a'][0] is msg.buffers[1])
+
+    def test_compact(self):
+        obj = ('small', self.big)
+        msg, got = self.roundtrip(obj, mitogen.core.FLAG_COMPACT)
+        self.assertEquals(obj, got)
+        self.assertTrue(got[1] is msg.buffers[0])
+
+    def test_compact_fallback_discards_buffers(self):
+        obj = (self.big, set([1]))
+        msg = mitogen.core.Message.pickled(
+            obj,
+            codec=mitogen.core.FLAG_COMPACT | mitogen.core.FLAG_OOB,
+        )
+        self.assertFalse(msg.flags & mitogen.core.FLAG_COMPACT)
+        self.assertEquals([self.big], msg.buffers)
+
+    def test_small_has_no_buffers(self):
+        msg, got = self.roundtrip('small', 0)
+        self.assertEquals((), msg.buffers)
+
+    def test_bad_reference(self):
+        msg = mitogen.core.Message.pickled(self.big,
+                                           codec=mitogen.core.FLAG_OOB)
+        msg.buffers = ()
+        self.assertRaises(mitogen.core.StreamError, msg.unpickle)
+
+    def test_reply_uses_request_oob(self):
+        recv = mitogen.core.Receiver(self.router)
+        msg = mitogen.core.Message.pickled(None, codec=mitogen.core.FLAG_OOB,
+                                           reply_to=recv.handle)
+        msg.reply(self.big, router=self.router)
+        reply = recv.get()
+        self.assertEquals(1, len(reply.buffers))
+        self.assertEquals(self.big, reply.unpickle())
+
+
+class NegotiationTest(testlib.RouterMixin, testlib.TestCase):
+    def test_compact_stream(self):
+        context = self.router.local(codec='compact')
+        stream = self.router.stream_by_id(context.context_id)
+        self.assertEquals(mitogen.core.FLAG_COMPACT, stream.codec)
+        msg = context.call_async(echo, {'a': [1, 2]}).get()
+        self.assertTrue(msg.flags & mitogen.core.FLAG_COMPACT)
+        self.assertEquals({'a': [1, 2]}, msg.unpickle())
+
+    def test_pickle_stream(self):
+        context = self.router.local(codec='pickle')
+        msg = context.call_async(echo, 123).get()
+        self.assertFalse(msg.flags & mitogen.core.FLAG_COMPACT)
+        self.assertEquals(123, msg.unpickle())
+
+    def test_oob_stream(self):
+        context = self.router.local()
+        stream = self.router.stream_by_id(context.context_id)
+        self.assertTrue(stream.get_codec() & mitogen.core.FLAG_OOB)
+        big = 'x' * (3 * mitogen.core.Message.oob_threshold)
+        msg = context.call_async(echo, [big, 1]).get()
+        self.assertEquals(1, len(msg.buffers))
+        self.assertEquals([big, 1], msg.unpickle())
+
+    def test_oob_disabled(self):
+        context = self.router.local(oob=False)
+        big = 'x' * mitogen.core.Message.oob_threshold
+        msg = context.call_async(echo, big).get()
+        self.assertFalse(msg.flags & mitogen.core.FLAG_OOB)
+        self.assertEquals(big, msg.unpickle())
+
+    def test_bad_codec(self):
+        self.assertRaises(KeyError, lambda: self.router.local(codec='bad'))
+
+
+if __name__ == '__main__':
+    unittest2.main()
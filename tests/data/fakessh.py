@@ -8,9 +8,17 @@ import sys
 parser = optparse.OptionParser()
 parser.add_option('--user', '-l', action='store')
 parser.add_option('-o', dest='options', action='append')
+parser.add_option('--password', action='store',
+                  help='Prompt for this password on the TTY before running')
 parser.disable_interspersed_args()
 
 opts, args = parser.parse_args(sys.argv[1:])
+if opts.password:
+    tty = os.fdopen(os.open('/dev/tty', os.O_RDWR), 'r+', 0)
+    tty.write('Password: ')
+    if tty.readline().rstrip('\n') != opts.password:
+        tty.write('Permission denied, please try again.\n')
+        sys.exit(1)
 args.pop(0)  # hostname
 args = [''.join(shlex.split(s)) for s in args]
 print args
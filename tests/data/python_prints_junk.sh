@@ -0,0 +1,4 @@
+#!/bin/bash
+# I am a Python interpreter started by a noisy login shell.
+echo "junk written before the first stage starts"
+exec python2.7 "$@"
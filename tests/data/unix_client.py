@@ -0,0 +1,18 @@
+"""
+Connect to the mitogen.unix.Listener whose path is given on the command line,
+and print our context ID, the first ID allocated for a child, and 1 if we
+still handle ID allocation requests, otherwise 0.
+"""
+
+import sys
+
+import mitogen.core
+import mitogen.unix
+
+router, context = mitogen.unix.connect(sys.argv[1])
+try:
+    print mitogen.context_id, router.id_allocator.allocate(), \
+          int(mitogen.core.ALLOCATE_ID in router._handle_map)
+finally:
+    router.broker.shutdown()
+    router.broker.join()
@@ -38,6 +38,22 @@ class CommandLineTest(testlib.RouterMixin, testlib.TestCase):
         self.assertEquals("EC0\n", stdout)
         self.assertIn("Error -5 while decompressing data: incomplete or truncated stream", stderr)
 
+    def test_valid_syntax_preamble_cache(self):
+        # The cache directory does not exist, so the first stage must request
+        # the full preamble.
+        stream = mitogen.parent.Stream(self.router, 0, max_message_size=123)
+        stream.preamble_cache = '/nonexistent/mitogen'
+        fp = open("/dev/null", "r")
+        proc = subprocess.Popen(stream.get_boot_command(),
+            stdin=fp,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        stdout, stderr = proc.communicate()
+        self.assertEquals(0, proc.returncode)
+        self.assertEquals("EC0\n", stdout)
+        self.assertIn("Error -5 while decompressing data: incomplete or truncated stream", stderr)
+
 
 if __name__ == '__main__':
     unittest2.main()
@@ -2,11 +2,15 @@
 import ctypes
 import os
 import random
+import signal
 import ssl
 import struct
 import sys
+import time
 
 import mitogen
+import mitogen.core
+import mitogen.fork
 import unittest2
 
 import testlib
@@ -93,5 +97,70 @@ class DoubleChildTest(testlib.RouterMixin, unittest2.TestCase):
         self.assertEqual(2, c2.call(exercise_importer, 1))
 
 
+class PoolTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(PoolTest, self).setUp()
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+        super(PoolTest, self).tearDown()
+
+    def pool(self, klass=mitogen.fork.Pool, **kwargs):
+        pool = klass(self.router, **kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def test_okay(self):
+        pool = self.pool(size=2)
+        pids = set()
+        for x in range(5):
+            context = pool.get(timeout=10)
+            self.assertEqual(context.call(os.getppid), os.getpid())
+            pids.add(context.call(os.getpid))
+            context.shutdown(wait=True)
+        self.assertEqual(5, len(pids))
+
+    def test_via(self):
+        c1 = self.router.fork()
+        pool = self.pool(size=1, via=c1)
+        context = pool.get(timeout=10)
+        self.assertEqual(context.call(os.getppid), c1.call(os.getpid))
+        self.assertEqual(2, context.call(exercise_importer, 1))
+
+    def test_close(self):
+        pool = self.pool(size=1)
+        context = pool.get(timeout=10)
+        pool.close()
+        self.assertEquals(123, context.call(ping))
+        self.assertRaises(mitogen.core.LatchError, pool.get)
+
+    def test_idle_disconnect_replaced(self):
+        pool = self.pool(size=1)
+        context = pool.get(timeout=10)
+        context.shutdown(wait=True)
+        while not pool._connected:
+            time.sleep(0.05)
+        idle, = pool._connected
+        latch = mitogen.core.Latch()
+        mitogen.core.listen(idle, 'disconnect', lambda: latch.put(None))
+        os.kill(idle.call(os.getpid), signal.SIGKILL)
+        latch.get(timeout=10)
+        context = pool.get(timeout=10)
+        self.assertTrue(context is not idle)
+        self.assertEquals(123, context.call(ping))
+
+    def test_fork_failure(self):
+        class FailingPool(mitogen.fork.Pool):
+            def _fork(self):
+                raise ValueError('boom')
+        pool = self.pool(klass=FailingPool, size=1)
+        for x in range(2):
+            e = self.assertRaises(ValueError,
+                lambda: pool.get(timeout=10))
+            self.assertEqual('boom', str(e))
+
+
 if __name__ == '__main__':
     unittest2.main()
@@ -1,5 +1,7 @@
 
+import os
 import threading
+import time
 
 import unittest2
 
@@ -8,6 +10,10 @@ import mitogen.core
 import testlib
 
 
+class LockLatch(mitogen.core.Latch):
+    waiter_class = mitogen.core.LockWaiter
+
+
 class EmptyTest(testlib.TestCase):
     klass = mitogen.core.Latch
 
@@ -97,6 +103,84 @@ class ThreadedGetTest(testlib.TestCase):
         self.assertEquals(sorted(self.results), range(5))
         self.assertEquals(self.excs, [])
 
+    def wait_sleeping(self, latch, n):
+        while len(latch._sleeping) < n:
+            time.sleep(0.001)
+
+    def test_waiters_served_in_order(self):
+        latch = self.klass()
+        for x in xrange(5):
+            self.start_one(lambda x=x: (x, latch.get(timeout=3.0)))
+            self.wait_sleeping(latch, x + 1)
+        for x in xrange(5):
+            latch.put(x)
+        self.join()
+        self.assertEquals(sorted(self.results), [(x, x) for x in range(5)])
+        self.assertEquals(self.excs, [])
+
+    def test_timeout_removes_waiter(self):
+        latch = self.klass()
+        self.assertRaises(mitogen.core.TimeoutError,
+            lambda: latch.get(timeout=0.01))
+        self.assertEquals(0, len(latch._sleeping))
+        latch.put(123)
+        self.assertEquals(123, latch.get(block=False))
+
+    def test_waiter_reused(self):
+        latch = self.klass()
+        pool = latch.waiter_class.pool
+        for x in xrange(3):
+            self.assertRaises(mitogen.core.TimeoutError,
+                lambda: latch.get(timeout=0))
+            self.assertTrue(len(pool) > 0)
+        size = len(pool)
+        self.start_one(lambda: latch.get(timeout=3.0))
+        self.wait_sleeping(latch, 1)
+        latch.put('x')
+        self.join()
+        self.assertEquals(['x'], self.results)
+        self.assertEquals(size, len(pool))
+
+
+class WaitError(Exception):
+    pass
+
+
+class RaisingWaiter(mitogen.core.FdWaiter):
+    pool = []
+    before_raise = None
+
+    def wait(self, timeout):
+        if self.before_raise:
+            self.before_raise()
+        raise WaitError()
+
+
+class WaitErrorTest(testlib.TestCase):
+    klass = mitogen.core.Latch
+
+    def new_latch(self, before_raise=None):
+        latch = self.klass()
+        latch.waiter_class = RaisingWaiter
+        RaisingWaiter.before_raise = staticmethod(before_raise)
+        return latch
+
+    def tearDown(self):
+        RaisingWaiter.before_raise = None
+        while RaisingWaiter.pool:
+            RaisingWaiter.pool.pop().close()
+        super(WaitErrorTest, self).tearDown()
+
+    def test_raise_unwoken(self):
+        latch = self.new_latch()
+        self.assertRaises(WaitError, lambda: latch.get(timeout=3.0))
+        self.assertEquals(0, len(latch._sleeping))
+
+    def test_raise_woken_requeues(self):
+        latch = self.new_latch(lambda: latch.put('x'))
+        self.assertRaises(WaitError, lambda: latch.get(timeout=3.0))
+        self.assertEquals(0, len(latch._sleeping))
+        self.assertEquals('x', latch.get(block=False))
 
 
 class PutTest(testlib.TestCase):
@@ -204,6 +288,36 @@ class ThreadedCloseTest(testlib.TestCase):
             self.assertTrue(isinstance(exc, mitogen.core.LatchError))
 
 
+class ForkTest(testlib.TestCase):
+    def test_on_fork_closes_pool(self):
+        latch = mitogen.core.Latch()
+        self.assertRaises(mitogen.core.TimeoutError,
+            lambda: latch.get(timeout=0))
+        waiter = mitogen.core.FdWaiter.pool[-1]
+        mitogen.core.Latch._on_fork()
+        self.assertEquals([], mitogen.core.FdWaiter.pool)
+        self.assertRaises(OSError, lambda: os.fstat(waiter.rfd))
+
+
+class LockEmptyTest(EmptyTest):
+    klass = LockLatch
+
+
+class LockGetTest(GetTest):
+    klass = LockLatch
+
+
+class LockThreadedGetTest(ThreadedGetTest):
+    klass = LockLatch
+
+
+class LockCloseTest(CloseTest):
+    klass = LockLatch
+
+
+class LockThreadedCloseTest(ThreadedCloseTest):
+    klass = LockLatch
+
 
 if __name__ == '__main__':
     unittest2.main()
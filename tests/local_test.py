@@ -1,9 +1,15 @@
 
 import os
+import shutil
+import stat
+import tempfile
 
+import mock
 import unittest2
 
 import mitogen
+import mitogen.core
+import mitogen.parent
 import mitogen.ssh
 import mitogen.utils
 
@@ -11,6 +17,15 @@ import testlib
 import plain_old_module
 
 
+def echo(x):
+    return x
+
+
+@mitogen.core.takes_econtext
+def get_stream_zlib_level(econtext):
+    return econtext.stream.zlib_level
+
+
 class LocalTest(testlib.RouterMixin, unittest2.TestCase):
     stream_class = mitogen.ssh.Stream
 
@@ -19,6 +34,79 @@ class LocalTest(testlib.RouterMixin, unittest2.TestCase):
         pid = context.call(os.getpid)
         self.assertEquals('local.%d' % (pid,), context.name)
 
+    def test_zlib_level(self):
+        context = self.router.local(zlib_level=6)
+        stream = self.router.stream_by_id(context.context_id)
+        self.assertEquals(6, stream.zlib_level)
+        self.assertEquals(6, context.call(get_stream_zlib_level))
+        data = 'x' * (10 * stream.zlib_threshold)
+        self.assertEquals(data, context.call(echo, data))
+
+    def test_fragment_size(self):
+        context = self.router.local(fragment_size=4096)
+        via = self.router.local(via=context, fragment_size=4096)
+        data = os.urandom(20000)
+        self.assertEquals(data, context.call(echo, data))
+        self.assertEquals(data, via.call(echo, data))
+
+    def test_fragment_size_mixed(self):
+        # Only one hop of each route fragments, so the intermediary must
+        # reassemble frames before passing them to the other.
+        data = os.urandom(20000)
+        for first, second in (4096, None), (None, 4096):
+            context = self.router.local(fragment_size=first)
+            via = self.router.local(via=context, fragment_size=second)
+            self.assertEquals(data, via.call(echo, data))
+
+
+class PreambleCacheTest(testlib.RouterMixin, unittest2.TestCase):
+    def setUp(self):
+        super(PreambleCacheTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.path = os.path.join(self.cache_dir,
+                                 'core-' + mitogen.parent.get_core_hash())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(PreambleCacheTest, self).tearDown()
+
+    def local(self):
+        context = self.router.local(preamble_cache=self.cache_dir)
+        self.assertEquals(123, context.call(echo, 123))
+        return context
+
+    def assertCached(self):
+        self.assertEquals(mitogen.parent.get_core_source(),
+                          open(self.path, 'rb').read())
+        self.assertEquals(0600, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEquals(['core-' + mitogen.parent.get_core_hash()],
+                          os.listdir(self.cache_dir))
+
+    def test_miss_then_hit(self):
+        self.local()
+        self.assertCached()
+        # A hit requests only the trailer, never the full preamble.
+        get_preamble = mock.Mock(side_effect=AssertionError)
+        with mock.patch.object(mitogen.parent.Stream, 'get_preamble',
+                               get_preamble):
+            self.local()
+        self.assertFalse(get_preamble.called)
+
+    def test_corrupt_replaced(self):
+        os.mkdir(self.cache_dir)
+        fp = open(self.path, 'wb')
+        fp.write(mitogen.parent.get_core_source()[:-100])
+        fp.close()
+        self.local()
+        self.assertCached()
+
+    def test_disabled_by_default(self):
+        stream = mitogen.parent.Stream(self.router, 0, max_message_size=123)
+        self.assertEquals(None, stream.preamble_cache)
+        stream.construct(max_message_size=123, preamble_cache=True)
+        self.assertEquals('.cache/mitogen', stream.preamble_cache)
+
 
 if __name__ == '__main__':
     unittest2.main()
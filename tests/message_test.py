@@ -0,0 +1,52 @@
+
+import cPickle
+
+import unittest2
+
+import mitogen.core
+
+import testlib
+
+
+class ConstructorTest(testlib.TestCase):
+    klass = mitogen.core.Message
+
+    def test_defaults(self):
+        msg = self.klass()
+        self.assertEquals(None, msg.dst_id)
+        self.assertEquals(mitogen.context_id, msg.src_id)
+        self.assertEquals(mitogen.context_id, msg.auth_id)
+        self.assertEquals(0, msg.flags)
+        self.assertEquals('', msg.data)
+        self.assertEquals((), msg.buffers)
+        self.assertEquals(None, msg.router)
+
+    def test_kwargs(self):
+        msg = self.klass(dst_id=1, src_id=2, auth_id=3, handle=4,
+                         reply_to=5, data='x')
+        self.assertEquals((1, 2, 3, 4, 5, 'x'),
+                          (msg.dst_id, msg.src_id, msg.auth_id, msg.handle,
+                           msg.reply_to, msg.data))
+
+    def test_no_dict(self):
+        msg = self.klass()
+        self.assertRaises(AttributeError, setattr, msg, 'foo', 1)
+
+
+class PickleTest(testlib.TestCase):
+    klass = mitogen.core.Message
+
+    def test_roundtrip(self):
+        msg = self.klass.pickled('x' * 100, dst_id=1, handle=123,
+                                 router=object())
+        for protocol in 0, 1, 2:
+            msg2 = cPickle.loads(cPickle.dumps(msg, protocol))
+            self.assertEquals((1, 123, msg.data, msg.flags),
+                              (msg2.dst_id, msg2.handle, msg2.data,
+                               msg2.flags))
+            self.assertEquals(None, msg2.router)
+            self.assertEquals('x' * 100, msg2.unpickle())
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -2,11 +2,14 @@ import errno
 import os
 import subprocess
 import tempfile
+import threading
 import time
+import zlib
 
 import unittest2
 import testlib
 
+import mitogen.master
 import mitogen.parent
 
 
@@ -48,6 +51,145 @@ class ReapChildTest(testlib.RouterMixin, testlib.TestCase):
         self.assertEquals(e.args[0], errno.ESRCH)
 
 
+class FakeSide(object):
+    def __init__(self, fd, data):
+        self.fd = fd
+        self.data = data
+
+    def read(self, n):
+        s, self.data = self.data[:n], self.data[n:]
+        return s
+
+
+class FakePoller(object):
+    def start_receive(self, *args):
+        pass
+
+    stop_receive = start_transmit = stop_transmit = start_receive
+
+
+class FakeTimer(object):
+    def cancel(self):
+        pass
+
+
+class FakeBroker(object):
+    poller = FakePoller()
+
+    def call_at(self, when, func):
+        return FakeTimer()
+
+
+class FakeBootstrapStream(object):
+    connect_deadline = None
+
+    def __init__(self, broker, receive_data, tty_data):
+        self._broker = broker
+        self.receive_side = FakeSide(100, receive_data)
+        self.transmit_side = FakeSide(101, '')
+        self.tty_side = FakeSide(102, tty_data)
+        self.output = []
+
+    def get_preamble(self):
+        return 'preamble'
+
+    def _on_bootstrap_output(self, s):
+        self.output.append(s)
+
+
+class BootstrapMarkerTest(testlib.TestCase):
+    def bootstrap(self, pipelined, receive_data, tty_data):
+        stream = FakeBootstrapStream(FakeBroker(), receive_data, tty_data)
+        bootstrap = mitogen.parent.Bootstrap(
+            stream,
+            [stream.receive_side, stream.tty_side],
+            pipelined=pipelined,
+        )
+        stream._bootstrap = bootstrap
+        return stream, bootstrap
+
+    def test_tty_output_within_ec0(self):
+        for pipelined in False, True:
+            stream, bootstrap = self.bootstrap(pipelined, 'EC0\n', 'junk')
+            bootstrap._read(stream.receive_side, 2)
+            bootstrap._on_ec0_receive(stream.tty_side)
+            bootstrap._on_ec0_receive(stream.receive_side)
+            self.assertTrue(bootstrap.ec0)
+            self.assertEquals(['junk'], stream.output)
+
+    def test_tty_marker_ignored(self):
+        stream, bootstrap = self.bootstrap(False, '', 'EC0\n')
+        bootstrap._on_ec0_receive(stream.tty_side)
+        self.assertFalse(bootstrap.ec0)
+
+    def test_pipelined_not_read_past_ec0(self):
+        stream, bootstrap = self.bootstrap(True, 'EC0\nEC1\nproto', 'EC')
+        bootstrap._on_ec0_receive(stream.tty_side)
+        while not bootstrap.ec0:
+            bootstrap._on_ec0_receive(stream.receive_side)
+        self.assertEquals('EC1\nproto', stream.receive_side.data)
+
+
+class BootstrapTest(testlib.RouterMixin, testlib.TestCase):
+    def test_broker_not_blocked(self):
+        # A stalled handshake must not prevent other connections completing.
+        latch = mitogen.core.Latch()
+        def connect():
+            try:
+                self.router.local(
+                    python_path=testlib.data_path('python_never_responds.sh'),
+                    connect_timeout=3,
+                )
+            except mitogen.core.TimeoutError:
+                latch.put(time.time())
+        thread = threading.Thread(target=connect)
+        thread.start()
+        try:
+            context = self.router.local()
+            self.assertEquals(os.getpid(), context.call(os.getppid))
+            self.assertTrue(latch.empty())
+        finally:
+            thread.join()
+        self.assertFalse(latch.empty())
+
+    def test_not_pipelined(self):
+        context = self.router.local(pipelined=False)
+        self.assertEquals(os.getpid(), context.call(os.getppid))
+
+    def test_pipelined_output_before_ec0(self):
+        for pipelined in False, True:
+            context = self.router.local(
+                python_path=testlib.data_path('python_prints_junk.sh'),
+                pipelined=pipelined,
+            )
+            self.assertEquals(123, context.call(int, 123))
+
+    def test_pipelined_disabled_by_preamble_cache(self):
+        stream = mitogen.parent.Stream(self.router, 0, max_message_size=123)
+        self.assertTrue(stream.pipelined)
+        stream.construct(max_message_size=123, preamble_cache='/tmp/x')
+        self.assertFalse(stream.pipelined)
+
+    def test_broker_shutdown(self):
+        router = mitogen.master.Router()
+        stream = mitogen.parent.Stream(
+            router=router,
+            remote_id=1234,
+            old_router=router,
+            max_message_size=router.max_message_size,
+            python_path=testlib.data_path('python_never_responds.sh'),
+            connect_timeout=30,
+        )
+        router.broker.call_later(0.2, router.broker.shutdown)
+        t0 = time.time()
+        e = self.assertRaises(mitogen.core.StreamError,
+            lambda: stream.connect()
+        )
+        self.assertLess(time.time() - t0, 10)
+        self.assertTrue(stream._bootstrap is None)
+        router.broker.join()
+
+
 class StreamErrorTest(testlib.RouterMixin, testlib.TestCase):
     def test_direct_eof(self):
         e = self.assertRaises(mitogen.core.StreamError,
@@ -102,6 +244,41 @@ class ContextTest(testlib.RouterMixin, unittest2.TestCase):
         self.assertRaises(OSError, lambda: os.kill(pid, 0))
 
 
+class PreambleTest(testlib.RouterMixin, testlib.TestCase):
+    def stream(self, context_id):
+        return mitogen.parent.Stream(self.router, context_id,
+                                     max_message_size=123)
+
+    def test_trailer(self):
+        stream = self.stream(5)
+        compressed, size = stream._get_preamble()[:2]
+        source = zlib.decompress(compressed)
+        self.assertEquals(size, len(source))
+        lines = source.splitlines()
+        self.assertTrue(lines[-1].startswith('ExternalContext().main(**'))
+        self.assertTrue("'context_id': 5" in lines[-1])
+        core = mitogen.parent.get_core_preamble()[2]
+        self.assertEquals(size, core + len(lines[-1]) + 1)
+
+    def test_trailer_alone(self):
+        stream = self.stream(5)
+        source = zlib.decompress(stream.get_preamble())
+        trailer = zlib.decompress(stream.get_trailer())
+        self.assertEquals(mitogen.parent.get_core_source() + trailer, source)
+
+    def test_core_shared(self):
+        core = mitogen.parent.get_core_preamble()[0]
+        s1 = self.stream(5).get_preamble()
+        s2 = self.stream(6).get_preamble()
+        self.assertTrue(s1.startswith(core))
+        self.assertTrue(s2.startswith(core))
+        self.assertNotEquals(s1, s2)
+
+    def test_memoized(self):
+        stream = self.stream(5)
+        self.assertTrue(stream.get_preamble() is stream.get_preamble())
+
+
 class TtyCreateChildTest(unittest2.TestCase):
     func = staticmethod(mitogen.parent.tty_create_child)
 
@@ -0,0 +1,231 @@
+
+import errno
+import os
+import select
+import socket
+import sys
+
+import unittest2
+
+import mitogen.core
+import mitogen.parent
+
+import testlib
+
+
+class SockMixin(object):
+    def setUp(self):
+        super(SockMixin, self).setUp()
+        self.l1_sock, self.r1_sock = socket.socketpair()
+        self.l1 = self.l1_sock.fileno()
+        self.r1 = self.r1_sock.fileno()
+        self.l2_sock, self.r2_sock = socket.socketpair()
+        self.l2 = self.l2_sock.fileno()
+        self.r2 = self.r2_sock.fileno()
+        for fd in self.l1, self.r1, self.l2, self.r2:
+            mitogen.core.set_nonblock(fd)
+        self.p = self.klass()
+
+    def tearDown(self):
+        self.p.close()
+        for sock in (self.l1_sock, self.r1_sock, self.l2_sock, self.r2_sock):
+            sock.close()
+        super(SockMixin, self).tearDown()
+
+    def fill(self, fd):
+        """Make `fd` unwriteable."""
+        while True:
+            try:
+                os.write(fd, 'x'*4096)
+            except OSError:
+                e = sys.exc_info()[1]
+                if e.args[0] == errno.EAGAIN:
+                    return
+                raise
+
+    def drain(self, fd):
+        """Make `fd` unreadable."""
+        while True:
+            try:
+                if not os.read(fd, 4096):
+                    return
+            except OSError:
+                e = sys.exc_info()[1]
+                if e.args[0] == errno.EAGAIN:
+                    return
+                raise
+
+
+class ReceiveStateTest(SockMixin, testlib.TestCase):
+    klass = mitogen.core.Poller
+
+    def test_start_receive_adds_reader(self):
+        self.p.start_receive(self.l1)
+        self.assertEquals([(self.l1, self.l1)], self.p.readers)
+        self.assertEquals([], self.p.writers)
+
+    def test_start_receive_adds_reader_data(self):
+        data = object()
+        self.p.start_receive(self.l1, data=data)
+        self.assertEquals([(self.l1, data)], self.p.readers)
+        self.assertEquals([], self.p.writers)
+
+    def test_stop_receive(self):
+        self.p.start_receive(self.l1)
+        self.p.stop_receive(self.l1)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([], self.p.writers)
+
+    def test_stop_receive_dup(self):
+        self.p.start_receive(self.l1)
+        self.p.stop_receive(self.l1)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([], self.p.writers)
+        self.p.stop_receive(self.l1)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([], self.p.writers)
+
+    def test_stop_receive_noexist(self):
+        p = self.klass()
+        p.stop_receive(123)  # should not fail
+        self.assertEquals([], p.readers)
+        self.assertEquals([], self.p.writers)
+
+
+class TransmitStateTest(SockMixin, testlib.TestCase):
+    klass = mitogen.core.Poller
+
+    def test_start_transmit_adds_writer(self):
+        self.p.start_transmit(self.r1)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([(self.r1, self.r1)], self.p.writers)
+
+    def test_start_transmit_adds_writer_data(self):
+        data = object()
+        self.p.start_transmit(self.r1, data=data)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([(self.r1, data)], self.p.writers)
+
+    def test_stop_transmit(self):
+        self.p.start_transmit(self.r1)
+        self.p.stop_transmit(self.r1)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([], self.p.writers)
+
+    def test_stop_transmit_dup(self):
+        self.p.start_transmit(self.r1)
+        self.p.stop_transmit(self.r1)
+        self.p.stop_transmit(self.r1)
+        self.assertEquals([], self.p.readers)
+        self.assertEquals([], self.p.writers)
+
+
+class PollTest(SockMixin, testlib.TestCase):
+    klass = mitogen.core.Poller
+
+    def test_empty_zero_timeout(self):
+        self.assertEquals([], list(self.p.poll(0)))
+
+    def test_unreadable(self):
+        self.p.start_receive(self.l1)
+        self.assertEquals([], list(self.p.poll(0)))
+
+    def test_readable(self):
+        self.p.start_receive(self.l1)
+        os.write(self.r1, 'x')
+        self.assertEquals([self.l1], list(self.p.poll(0)))
+
+    def test_readable_data(self):
+        data = object()
+        self.p.start_receive(self.l1, data=data)
+        os.write(self.r1, 'x')
+        self.assertEquals([data], list(self.p.poll(0)))
+
+    def test_readable_two(self):
+        self.p.start_receive(self.l1)
+        self.p.start_receive(self.l2)
+        os.write(self.r1, 'x')
+        os.write(self.r2, 'x')
+        self.assertEquals(set([self.l1, self.l2]), set(self.p.poll(0)))
+
+    def test_readable_after_stop(self):
+        self.p.start_receive(self.l1)
+        os.write(self.r1, 'x')
+        self.p.stop_receive(self.l1)
+        self.assertEquals([], list(self.p.poll(0)))
+
+    def test_writeable(self):
+        self.p.start_transmit(self.r1)
+        self.assertEquals([self.r1], list(self.p.poll(0)))
+
+    def test_unwriteable(self):
+        self.fill(self.r1)
+        self.p.start_transmit(self.r1)
+        self.assertEquals([], list(self.p.poll(0)))
+
+    def test_writeable_again(self):
+        self.fill(self.r1)
+        self.p.start_transmit(self.r1)
+        self.assertEquals([], list(self.p.poll(0)))
+        self.drain(self.l1)
+        self.assertEquals([self.r1], list(self.p.poll(0)))
+
+    def test_readable_and_writeable(self):
+        self.p.start_receive(self.l1, data='r')
+        self.p.start_transmit(self.l1, data='w')
+        os.write(self.r1, 'x')
+        self.assertEquals(set(['r', 'w']), set(self.p.poll(0)))
+
+    def test_stop_during_iteration(self):
+        # A callback may unregister another descriptor that is already known
+        # to be ready; it must not be yielded afterwards.
+        self.p.start_receive(self.l1)
+        self.p.start_receive(self.l2)
+        os.write(self.r1, 'x')
+        os.write(self.r2, 'x')
+        seen = []
+        for fd in self.p.poll(0):
+            seen.append(fd)
+            self.p.stop_receive(self.l1)
+            self.p.stop_receive(self.l2)
+        self.assertEquals(1, len(seen))
+
+    def test_start_during_iteration(self):
+        # Registrations made while iterating are not yielded until the next
+        # call to poll().
+        self.p.start_receive(self.l1)
+        os.write(self.r1, 'x')
+        os.write(self.r2, 'x')
+        seen = []
+        for fd in self.p.poll(0):
+            seen.append(fd)
+            self.p.start_receive(self.l2)
+        self.assertEquals([self.l1], seen)
+        self.assertEquals(set([self.l1, self.l2]), set(self.p.poll(0)))
+
+
+if hasattr(select, 'epoll'):
+    class EpollReceiveStateTest(ReceiveStateTest):
+        klass = mitogen.parent.EpollPoller
+
+    class EpollTransmitStateTest(TransmitStateTest):
+        klass = mitogen.parent.EpollPoller
+
+    class EpollPollTest(PollTest):
+        klass = mitogen.parent.EpollPoller
+
+        def test_closed_without_stop(self):
+            # A descriptor closed while still registered must not prevent a
+            # recycled descriptor number from being registered again.
+            self.p.start_receive(self.l1)
+            self.l1_sock.close()
+            self.l1_sock, self.r1_sock = socket.socketpair()
+            self.l1 = self.l1_sock.fileno()
+            self.r1 = self.r1_sock.fileno()
+            self.p.start_receive(self.l1)
+            os.write(self.r1, 'x')
+            self.assertEquals([self.l1], list(self.p.poll(0)))
+
+
+if __name__ == '__main__':
+    unittest2.main()
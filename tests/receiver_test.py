@@ -12,6 +12,21 @@ def yield_stuff_then_die(sender):
     return 10
 
 
+def yield_bytes_then_die(sender):
+    for x in xrange(5):
+        sender.send_bytes(str(x) * (x + 1))
+    sender.close()
+    return 10
+
+
+def yield_bulk_then_die(sender):
+    sender.bulk = True
+    for x in xrange(5):
+        sender.send(x)
+    sender.close()
+    return 10
+
+
 class ConstructorTest(testlib.RouterMixin, testlib.TestCase):
     def test_handle(self):
         recv = mitogen.core.Receiver(self.router)
@@ -36,5 +51,44 @@ class IterationTest(testlib.RouterMixin, testlib.TestCase):
         self.assertEquals(10, ret.get().unpickle())
 
 
+class RawTest(testlib.RouterMixin, testlib.TestCase):
+    def test_local(self):
+        recv = mitogen.core.Receiver(self.router)
+        recv.to_sender().send_bytes('\x80\x02hi')
+        msg = recv.get()
+        self.assertTrue(msg.is_raw)
+        self.assertEquals('\x80\x02hi', msg.data)
+        self.assertEquals('\x80\x02hi', msg.unpickle())
+
+    def test_iter_bytes(self):
+        recv = mitogen.core.Receiver(self.router)
+        context = self.router.local()
+        ret = context.call_async(yield_bytes_then_die, recv.to_sender())
+        self.assertEquals(['0', '11', '222', '3333', '44444'],
+                          list(recv.iter_bytes()))
+        self.assertEquals(10, ret.get().unpickle())
+
+
+class BulkTest(testlib.RouterMixin, testlib.TestCase):
+    def test_local(self):
+        recv = mitogen.core.Receiver(self.router)
+        sender = recv.to_sender()
+        sender.bulk = True
+        sender.send('x')
+        sender.send_bytes('y')
+        sender.close()
+        msgs = [recv.get(throw_dead=False) for x in range(3)]
+        self.assertEquals([True] * 3, [m.is_bulk for m in msgs])
+        self.assertEquals(['x', 'y'], [m.unpickle() for m in msgs[:2]])
+        self.assertTrue(msgs[2].is_dead)
+
+    def test_remote(self):
+        recv = mitogen.core.Receiver(self.router)
+        context = self.router.local()
+        ret = context.call_async(yield_bulk_then_die, recv.to_sender())
+        self.assertEquals(range(5), [m.unpickle() for m in recv])
+        self.assertEquals(10, ret.get().unpickle())
+
+
 if __name__ == '__main__':
     unittest2.main()
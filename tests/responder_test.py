@@ -2,9 +2,11 @@
 import mock
 import subprocess
 import sys
+import threading
 
 import unittest2
 
+import mitogen.core
 import mitogen.master
 import testlib
 
@@ -89,6 +91,69 @@ class BrokenModulesTest(unittest2.TestCase):
         self.assertIsInstance(msg.unpickle(), tuple)
 
 
+class PreloadTest(testlib.RouterMixin, unittest2.TestCase):
+    def setUp(self):
+        super(PreloadTest, self).setUp()
+        self.requested = []
+        self.router.add_handler(
+            fn=self._on_get_module,
+            handle=mitogen.core.GET_MODULE,
+        )
+
+    def _on_get_module(self, msg):
+        if not msg.is_dead:
+            self.requested.append(msg.data)
+        self.router.responder._on_get_module(msg)
+
+    def test_not_preloaded(self):
+        context = self.router.local()
+        self.assertEquals(256, context.call(plain_old_module.pow, 2, 8))
+        self.assertTrue('plain_old_module' in self.requested)
+
+    def test_preloaded(self):
+        context = self.router.local(preload_modules=['plain_old_module'])
+        self.assertEquals(256, context.call(plain_old_module.pow, 2, 8))
+        self.assertFalse('plain_old_module' in self.requested)
+        stream = self.router.stream_by_id(context.context_id)
+        self.assertTrue('plain_old_module' in stream.sent_modules)
+
+    def test_router_default(self):
+        self.router.preload_modules = ['simple_pkg', 'simple_pkg.a',
+                                       'simple_pkg.b']
+        context = self.router.local()
+        self.assertEquals(3,
+            context.call(simple_pkg.a.subtract_one_add_two, 2))
+        self.assertEquals([], [name for name in self.requested
+                               if name.startswith('simple_pkg')])
+
+    def test_runs_on_broker(self):
+        responder = self.router.responder
+        threads = []
+        def _preload(context, fullnames):
+            threads.append(threading.currentThread())
+            return mitogen.master.ModuleResponder._preload(responder, context,
+                                                           fullnames)
+        responder._preload = _preload
+        context = self.router.local(preload_modules=['plain_old_module'])
+        self.assertEquals([self.router.broker._thread], threads)
+        self.assertEquals(256, context.call(plain_old_module.pow, 2, 8))
+        self.assertFalse('plain_old_module' in self.requested)
+
+    def test_missing_skipped(self):
+        context = self.router.local(preload_modules=['non_existent_module'])
+        self.assertEquals(256, context.call(plain_old_module.pow, 2, 8))
+
+    def test_disconnected_skipped(self):
+        context = self.router.local()
+        stream = self.router.stream_by_id(context.context_id)
+        self.router.disconnect_stream(stream)
+        self.sync_with_broker()
+        log = testlib.LogCapturer()
+        log.start()
+        self.router.responder.preload(context, ['plain_old_module'])
+        self.assertTrue('no route to' in log.stop())
+
+
 class BlacklistTest(unittest2.TestCase):
     @unittest2.skip('implement me')
     def test_whitelist_no_blacklist(self):
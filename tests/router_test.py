@@ -2,6 +2,7 @@ import Queue
 import StringIO
 import logging
 import subprocess
+import threading
 import time
 
 import unittest2
@@ -25,6 +26,13 @@ def send_n_sized_reply(sender, n):
     return 123
 
 
+def send_invalid(context):
+    # Children have a core.Router, so no Context.call() exists.
+    recv = context.send_async(mitogen.core.Message(handle=999))
+    msg = recv.get(throw_dead=False)
+    return msg.is_dead, msg.src_id
+
+
 class SourceVerifyTest(testlib.RouterMixin, unittest2.TestCase):
     def setUp(self):
         super(SourceVerifyTest, self).setUp()
@@ -197,6 +205,30 @@ class MessageSizeTest(testlib.BrokerMixin, unittest2.TestCase):
         expect = 'message too large (max 4096 bytes)'
         self.assertTrue(expect in logs.stop())
 
+    def test_local_oob_exceeded(self):
+        router = self.klass(broker=self.broker, max_message_size=4096)
+        remote = router.fork()
+
+        logs = testlib.LogCapturer()
+        logs.start()
+
+        msg = mitogen.core.Message.pickled(
+            ' ' * mitogen.core.Message.oob_threshold,
+            codec=mitogen.core.FLAG_OOB,
+            dst_id=remote.context_id,
+            handle=999,
+        )
+        self.assertTrue(len(msg.data) < 4096 and msg.buffers)
+        router.route(msg)
+        sem = mitogen.core.Latch()
+        router.broker.defer(sem.put, ' ')  # will always run after _async_route
+        sem.get()
+
+        expect = 'message too large (max 4096 bytes)'
+        self.assertTrue(expect in logs.stop())
+        # The stream survived, since the message was never sent.
+        self.assertEquals(4096, remote.call(return_router_max_message_size))
+
     def test_remote_configured(self):
         router = self.klass(broker=self.broker, max_message_size=4096)
         remote = router.fork()
@@ -270,5 +302,221 @@ class NoRouteTest(testlib.RouterMixin, testlib.TestCase):
         self.assertEquals(e.args[0], mitogen.core.ChannelError.local_msg)
 
 
+class RouteManyTest(testlib.RouterMixin, testlib.TestCase):
+    def test_local(self):
+        recv = mitogen.core.Receiver(self.router)
+        self.router.route_many(
+            mitogen.core.Message.pickled(x, dst_id=mitogen.context_id,
+                                         handle=recv.handle)
+            for x in range(100)
+        )
+        self.assertEquals(range(100),
+                          [recv.get().unpickle() for x in range(100)])
+
+    def test_send_many(self):
+        context = self.router.local()
+        recvs = [mitogen.core.Receiver(self.router) for x in range(10)]
+        context.send_many(
+            mitogen.core.Message(handle=999, reply_to=recv.handle)
+            for recv in recvs
+        )
+        for recv in recvs:
+            msg = recv.get(throw_dead=False)
+            self.assertTrue(msg.is_dead)
+            self.assertEquals(context.context_id, msg.src_id)
+
+
+class DirectWriteTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(DirectWriteTest, self).setUp()
+        self.router.direct_write = True
+
+    def test_call(self):
+        context = self.router.local()
+        for x in range(10):
+            self.assertTrue(context.call(ping))
+
+    def test_order_from_many_threads(self):
+        context = self.router.local()
+        recv = mitogen.core.Receiver(self.router)
+        def sender(base):
+            for x in range(100):
+                context.call_async(send_n_sized_reply, recv.to_sender(),
+                                   base + x)
+        threads = [threading.Thread(target=sender, args=(x * 1000,))
+                   for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sizes = [len(recv.get().unpickle()) for x in range(400)]
+        for x in range(4):
+            mine = [n for n in sizes if x * 1000 <= n < (x + 1) * 1000]
+            self.assertEquals(range(x * 1000, x * 1000 + 100), mine)
+
+    def test_local_dst(self):
+        recv = mitogen.core.Receiver(self.router)
+        recv.to_sender().send(123)
+        self.assertEquals(123, recv.get().unpickle())
+
+
+class ConnectManyTest(testlib.RouterMixin, testlib.TestCase):
+    def test_results_in_order(self):
+        good = ('local', {})
+        bad = ('local', {'python_path': 'derp', 'connect_timeout': 3})
+        recvs = self.router.connect_many([good, bad, good, bad],
+                                         concurrency=2)
+        msgs = [recv.get() for recv in recvs]
+        self.assertEquals([False, True, False, True],
+                          [isinstance(msg.unpickle(throw=False),
+                                      mitogen.core.CallError)
+                           for msg in msgs])
+        for msg in msgs[::2]:
+            context = msg.unpickle()
+            self.assertTrue(isinstance(context, mitogen.core.Context))
+            self.assertTrue(self.router.context_by_id(context.context_id,
+                                                      create=False))
+            self.assertTrue(context.call(ping))
+
+    def test_error_per_connection(self):
+        recvs = self.router.connect_many([
+            ('local', {'python_path': 'derp', 'connect_timeout': 3}),
+            ('local', {}),
+        ])
+        e = self.assertRaises(mitogen.core.CallError,
+                              lambda: recvs[0].get().unpickle())
+        self.assertTrue('Child start failed' in str(e))
+        self.assertTrue(recvs[1].get().unpickle().call(ping))
+
+    def test_via(self):
+        via = self.router.local()
+        recvs = self.router.connect_many([('local', {'via': via})] * 2)
+        select = mitogen.master.Select(recvs)
+        for context in [msg.unpickle() for msg in select]:
+            registered = self.router.context_by_id(context.context_id,
+                                                   create=False)
+            self.assertEquals(via, registered.via)
+            self.assertTrue(context.call(ping))
+
+
+class RouteIndexTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(RouteIndexTest, self).setUp()
+        self.c1 = self.router.local()
+        self.c2 = self.router.local()
+        self.s1 = self.router.stream_by_id(self.c1.context_id)
+        self.s2 = self.router.stream_by_id(self.c2.context_id)
+
+    def test_register(self):
+        self.assertEquals(set([self.c1.context_id]),
+                          self.router._ids_by_stream[self.s1])
+
+    def test_add_del_route(self):
+        self.router.add_route(9999, self.s1)
+        self.assertTrue(9999 in self.router._ids_by_stream[self.s1])
+        self.router.del_route(9999)
+        self.assertFalse(9999 in self.router._ids_by_stream[self.s1])
+        self.assertEquals(None, self.router._stream_by_id.get(9999))
+
+    def test_replace_route(self):
+        self.router.add_route(9999, self.s1)
+        self.router.add_route(9999, self.s2)
+        self.assertFalse(9999 in self.router._ids_by_stream[self.s1])
+        self.assertTrue(9999 in self.router._ids_by_stream[self.s2])
+
+    def test_disconnect_forgets_routes(self):
+        self.router.add_route(9999, self.s1)
+        latch = mitogen.core.Latch()
+        mitogen.core.listen(self.c1, 'disconnect', lambda: latch.put(None))
+        self.router.disconnect_stream(self.s1)
+        latch.get(timeout=5)
+        self.sync_with_broker()
+        self.assertFalse(self.s1 in self.router._ids_by_stream)
+        self.assertEquals(None, self.router._stream_by_id.get(9999))
+        self.assertEquals(None,
+                          self.router._stream_by_id.get(self.c1.context_id))
+        self.assertTrue(self.s2 in self.router._ids_by_stream)
+
+
+class ShardedRouterTest(testlib.RouterMixin, testlib.TestCase):
+    router_class = mitogen.master.ShardedRouter
+
+    def test_streams_spread(self):
+        contexts = [self.router.local() for x in range(4)]
+        brokers = set(self.router.stream_by_id(c.context_id)._broker
+                      for c in contexts)
+        self.assertEquals(4, len(brokers))
+        for context in contexts:
+            self.assertTrue(context.call(ping))
+
+    def test_cross_shard_route(self):
+        c1 = self.router.local()
+        c2 = self.router.local()
+        self.assertTrue(self.router.broker_for(c1.context_id) is not
+                        self.router.broker_for(c2.context_id))
+        # Dead reply from c2 travels back across both shards.
+        self.assertEquals((True, c2.context_id), c1.call(send_invalid, c2))
+
+    def test_route_many(self):
+        contexts = [self.router.local() for x in range(4)]
+        recv = mitogen.core.Receiver(self.router)
+        self.router.route_many(
+            mitogen.core.Message(dst_id=context.context_id, handle=999,
+                                 reply_to=recv.handle)
+            for context in contexts
+        )
+        src_ids = set(recv.get(throw_dead=False).src_id for c in contexts)
+        self.assertEquals(set(c.context_id for c in contexts), src_ids)
+
+    def test_handler_runs_on_broker(self):
+        c1 = self.router.local()
+        self.assertTrue(self.router.broker_for(c1.context_id) is not
+                        self.router.broker)
+        latch = mitogen.core.Latch()
+        handle = self.router.add_handler(
+            lambda msg: latch.put(threading.currentThread()),
+        )
+        sender = mitogen.core.Sender(mitogen.core.Context(self.router, 0),
+                                     handle)
+        self.assertEquals(123, c1.call(send_n_sized_reply, sender, 1))
+        self.assertTrue(latch.get(timeout=5) is self.router.broker._thread)
+
+    def test_send_async_on_shard_thread(self):
+        c1 = self.router.local()
+        latch = mitogen.core.Latch()
+        def func():
+            try:
+                c1.send_async(mitogen.core.Message(handle=999))
+            except SystemError:
+                latch.put(True)
+        self.router.broker_for(c1.context_id).defer(func)
+        self.assertTrue(latch.get(timeout=5))
+
+    def test_disconnect(self):
+        c1 = self.router.local()
+        c1.call(ping)
+        self.assertTrue(self.router.broker_for(c1.context_id) is not
+                        self.router.broker)
+        latch = mitogen.core.Latch()
+        mitogen.core.listen(c1, 'disconnect',
+                            lambda: latch.put(threading.currentThread()))
+        self.router.disconnect_stream(self.router.stream_by_id(c1.context_id))
+        self.assertTrue(latch.get(timeout=5) is self.router.broker._thread)
+        self.assertEquals(None, self.router._stream_by_id.get(c1.context_id))
+
+    def test_shutdown_joins_shards(self):
+        router = self.router_class(shards=3)
+        c1 = router.local()
+        c1.call(ping)
+        latch = mitogen.core.Latch()
+        mitogen.core.listen(c1, 'disconnect', lambda: latch.put(None))
+        router.broker.shutdown()
+        router.broker.join()
+        for broker in router._brokers:
+            self.assertFalse(broker._thread.isAlive())
+        # The shard's disconnection reached the first broker before it exited.
+        latch.get(timeout=0)
+
+
 if __name__ == '__main__':
     unittest2.main()
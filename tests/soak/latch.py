@@ -1,11 +1,14 @@
 """
 Used for stressing Latch.get/put. Swap the number of producer/consumer threads
 below to try both -- there are many conditions in the Latch code that require
-testing of both.
+testing of both. Pass "lock" as the first argument to soak LockWaiter rather
+than FdWaiter. Consumers wait with random timeouts, to exercise the race
+between a timeout and a put().
 """
 
 import logging
 import random
+import sys
 import threading
 import time
 import mitogen.core
@@ -16,17 +19,26 @@ mitogen.core.IOLOG.setLevel(logging.DEBUG)
 mitogen.core._v = True
 mitogen.core._vv = True
 
+if sys.argv[1:2] == ['lock']:
+    mitogen.core.Latch.waiter_class = mitogen.core.LockWaiter
+
 l = mitogen.core.Latch()
 consumed = 0
 produced = 0
 crash = 0
+timeouts = 0
 
 def cons():
-    global consumed, crash
+    global consumed, crash, timeouts
     try:
         while 1:
-            g = l.get()
-            print 'got=%s consumed=%s produced=%s crash=%s' % (g, consumed, produced, crash)
+            try:
+                g = l.get(timeout=random.random()/10)
+            except mitogen.core.TimeoutError:
+                timeouts += 1
+                continue
+            print 'got=%s consumed=%s produced=%s crash=%s timeouts=%s' % (
+                g, consumed, produced, crash, timeouts)
             consumed += 1
             time.sleep(g)
             for x in xrange(int(g * 1000)):
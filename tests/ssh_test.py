@@ -8,7 +8,7 @@ import testlib
 import plain_old_module
 
 
-class FakeSshTest(testlib.RouterMixin, unittest2.TestCase):
+class FakeSshTest(testlib.RouterMixin, testlib.TestCase):
     def test_okay(self):
         context = self.router.ssh(
                 hostname='hostname',
@@ -19,6 +19,31 @@ class FakeSshTest(testlib.RouterMixin, unittest2.TestCase):
         #context.call(mitogen.utils.disable_site_packages)
         self.assertEquals(3, context.call(plain_old_module.add, 1, 2))
 
+    def fake_ssh_password(self, password):
+        return self.router.ssh(
+            hostname='hostname',
+            ssh_path=testlib.data_path('fakessh.py'),
+            ssh_args=['--password', 'pw'],
+            password=password,
+            connect_timeout=10,
+        )
+
+    def test_password_specified(self):
+        context = self.fake_ssh_password('pw')
+        self.assertEquals(3, context.call(plain_old_module.add, 1, 2))
+
+    def test_password_required(self):
+        e = self.assertRaises(mitogen.ssh.PasswordError,
+            lambda: self.fake_ssh_password(None)
+        )
+        self.assertEqual(e[0], mitogen.ssh.Stream.password_required_msg)
+
+    def test_password_incorrect(self):
+        e = self.assertRaises(mitogen.ssh.PasswordError,
+            lambda: self.fake_ssh_password('bad')
+        )
+        self.assertEqual(e[0], mitogen.ssh.Stream.password_incorrect_msg)
+
 
 class SshTest(testlib.DockerMixin, unittest2.TestCase):
     stream_class = mitogen.ssh.Stream
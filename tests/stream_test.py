@@ -0,0 +1,668 @@
+
+import os
+import socket
+import struct
+
+import mock
+import unittest2
+
+import mitogen.core
+
+import testlib
+
+
+class FakeBroker(object):
+    def __init__(self):
+        self.transmitting = False
+        self.deferred = []
+
+    def defer(self, func, *args):
+        self.deferred.append((func, args))
+
+    def run_deferred(self):
+        while self.deferred:
+            func, args = self.deferred.pop(0)
+            func(*args)
+
+    def _start_transmit(self, stream):
+        self.transmitting = True
+
+    def _stop_transmit(self, stream):
+        self.transmitting = False
+
+
+class FakeRouter(object):
+    max_message_size = 128 * 1048576
+    direct_write = False
+    bad_src_ids = ()
+
+    def __init__(self):
+        self.broker = FakeBroker()
+        self.routed = []
+
+    def broker_for(self, context_id):
+        return self.broker
+
+    def _verify_source(self, msg, stream):
+        return msg.src_id not in self.bad_src_ids
+
+    def _async_route(self, msg, stream=None):
+        self.routed.append(msg)
+
+
+class StreamMixin(object):
+    klass = mitogen.core.Stream
+
+    def setUp(self):
+        super(StreamMixin, self).setUp()
+        self.router = FakeRouter()
+        self.broker = self.router.broker
+        self.rsock, self.wsock = socket.socketpair()
+        self.stream = self.klass(self.router, 1)
+        self.stream.accept(self.rsock.fileno(), self.wsock.fileno())
+
+    def tearDown(self):
+        self.stream.receive_side.close()
+        self.stream.transmit_side.close()
+        self.rsock.close()
+        self.wsock.close()
+        super(StreamMixin, self).tearDown()
+
+    def send(self, data):
+        msg = mitogen.core.Message(dst_id=1, handle=123, data=data)
+        self.stream._send(msg)
+
+    def read_all(self, n):
+        s = ''
+        while len(s) < n:
+            s += os.read(self.rsock.fileno(), n - len(s))
+        return s
+
+
+class TransmitTest(StreamMixin, testlib.TestCase):
+    def test_unlocked_without_direct_write(self):
+        self.stream._output_lock = mock.Mock()
+        self.send('x')
+        self.stream.on_transmit(self.broker)
+        self.assertEquals([], self.stream._output_lock.mock_calls)
+        self.assertEquals('x', self.read_all(self.stream.HEADER_LEN + 1)[-1])
+
+    def test_coalesces_small_packets(self):
+        for x in range(50):
+            self.send('x' * 100)
+        expect = self.stream.pending_bytes()
+        side = self.stream.transmit_side
+        write = mock.Mock(side_effect=side.write)
+        side.write = write
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(1, write.call_count)
+        self.assertEquals(0, self.stream.pending_bytes())
+        self.assertFalse(self.broker.transmitting)
+        self.assertEquals(expect, len(self.read_all(expect)))
+
+    def test_order_preserved(self):
+        for x in range(10):
+            self.send(str(x))
+        self.stream.on_transmit(self.broker)
+        s = self.read_all(self.stream.HEADER_LEN * 10 + 10)
+        bodies = [s[i+self.stream.HEADER_LEN]
+                  for i in range(0, len(s), self.stream.HEADER_LEN + 1)]
+        self.assertEquals([str(x) for x in range(10)], bodies)
+
+    def test_partial_write(self):
+        self.send('x' * 100)
+        self.send('y' * 100)
+        side = self.stream.transmit_side
+        side.write = mock.Mock(return_value=10)
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(1, side.write.call_count)
+        self.assertEquals(10, self.stream._output_offset)
+        self.assertEquals(2 * (self.stream.HEADER_LEN + 100) - 10,
+                          self.stream.pending_bytes())
+
+    def test_eagain_stops_loop(self):
+        self.send('x' * 100)
+        side = self.stream.transmit_side
+        side.write = mock.Mock(return_value=0)
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(1, side.write.call_count)
+        self.assertEquals(self.stream.HEADER_LEN + 100,
+                          self.stream.pending_bytes())
+
+    def test_buffers_queued_separately(self):
+        buf = 'x' * mitogen.core.Message.oob_threshold
+        msg = mitogen.core.Message(dst_id=1, handle=123, data='d',
+                                   flags=mitogen.core.FLAG_OOB)
+        msg.buffers = [buf]
+        self.stream._send(msg)
+        self.assertEquals(2, len(self.stream._output_buf))
+        self.assertTrue(self.stream._output_buf[1] is buf)
+        side = self.stream.transmit_side
+        write = mock.Mock(side_effect=side.write)
+        side.write = write
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(2, write.call_count)
+        expect = self.stream.HEADER_LEN + 8 + 1 + len(buf)
+        s = self.read_all(expect)
+        self.assertEquals('d' + buf, s[self.stream.HEADER_LEN + 8:])
+
+    def test_large_packet_not_coalesced(self):
+        self.send('x' * (self.stream.max_transmit_size + 1))
+        self.send('y')
+        self.assertEquals(2, len(self.stream._output_buf))
+        side = self.stream.transmit_side
+        side.write = mock.Mock(return_value=0)
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(2, len(self.stream._output_buf))
+
+
+class WatermarkTest(StreamMixin, testlib.TestCase):
+    def setUp(self):
+        super(WatermarkTest, self).setUp()
+        self.stream.output_high_watermark = 1000
+        self.stream.output_low_watermark = 300
+        self.events = []
+        mitogen.core.listen(self.stream, 'pause',
+                            lambda: self.events.append('pause'))
+        mitogen.core.listen(self.stream, 'resume',
+                            lambda: self.events.append('resume'))
+
+    def test_pause_at_high_watermark(self):
+        self.send('x' * 400)
+        self.send('x' * 400)
+        self.assertEquals([], self.events)
+        self.assertFalse(self.stream.output_paused)
+        self.send('x' * 400)
+        self.assertEquals(['pause'], self.events)
+        self.assertTrue(self.stream.output_paused)
+        self.send('x' * 400)
+        self.assertEquals(['pause'], self.events)
+
+    def test_resume_at_low_watermark(self):
+        for x in range(3):
+            self.send('x' * 400)
+        side = self.stream.transmit_side
+        side.write = mock.Mock(return_value=500)
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(['pause'], self.events)
+        side.write = mock.Mock(return_value=0)
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(['pause'], self.events)
+        del side.write
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(['pause', 'resume'], self.events)
+        self.assertFalse(self.stream.output_paused)
+
+    def test_send_from_resume(self):
+        for x in range(3):
+            self.send('x' * 400)
+        mitogen.core.listen(self.stream, 'resume', lambda: self.send('y'))
+        self.stream.on_transmit(self.broker)
+        self.assertEquals(self.stream.HEADER_LEN + 1,
+                          self.stream.pending_bytes())
+        self.assertTrue(self.broker.transmitting)
+
+
+class DirectWriteTest(StreamMixin, testlib.TestCase):
+    def setUp(self):
+        super(DirectWriteTest, self).setUp()
+        self.router.direct_write = True
+
+    def send_direct(self, data):
+        msg = mitogen.core.Message(dst_id=1, handle=123, data=data)
+        self.stream._send_direct(msg)
+
+    def test_idle_writes_directly(self):
+        self.send_direct('x' * 100)
+        self.assertEquals([], self.broker.deferred)
+        self.assertEquals(0, self.stream.pending_bytes())
+        self.assertFalse(self.broker.transmitting)
+        s = self.read_all(self.stream.HEADER_LEN + 100)
+        self.assertEquals('x' * 100, s[self.stream.HEADER_LEN:])
+
+    def test_queued_defers(self):
+        self.send('a')
+        self.send_direct('b')
+        self.assertEquals(1, len(self.broker.deferred))
+        self.broker.run_deferred()
+        self.assertEquals([], self.stream._direct_deferred)
+        self.stream.on_transmit(self.broker)
+        s = self.read_all(2 * (self.stream.HEADER_LEN + 1))
+        self.assertEquals('b', s[-1])
+
+    def test_deferred_blocks_direct(self):
+        # Once a message is deferred, later ones must not overtake it even if
+        # the output buffer drains in the meantime.
+        self.send('a')
+        self.send_direct('b')
+        self.stream.on_transmit(self.broker)
+        self.send_direct('c')
+        self.assertEquals(2, len(self.broker.deferred))
+        self.broker.run_deferred()
+        self.stream.on_transmit(self.broker)
+        s = self.read_all(3 * (self.stream.HEADER_LEN + 1))
+        self.assertEquals('abc', s[self.stream.HEADER_LEN::
+                                   self.stream.HEADER_LEN + 1])
+
+    def test_contention_defers(self):
+        self.stream._output_lock.acquire()
+        try:
+            self.send_direct('a')
+        finally:
+            self.stream._output_lock.release()
+        self.assertEquals(1, len(self.broker.deferred))
+
+    def test_closed_defers(self):
+        self.stream._output_closed = True
+        self.send_direct('a')
+        self.assertEquals(1, len(self.broker.deferred))
+
+    def test_partial_write_queues_remainder(self):
+        side = self.stream.transmit_side
+        side.write = mock.Mock(return_value=10)
+        self.send_direct('x' * 100)
+        self.assertEquals(10, self.stream._output_offset)
+        self.assertEquals(self.stream.HEADER_LEN + 90,
+                          self.stream.pending_bytes())
+        self.broker.run_deferred()
+        self.assertTrue(self.broker.transmitting)
+
+    def test_partial_write_pauses(self):
+        events = []
+        mitogen.core.listen(self.stream, 'pause', lambda: events.append(1))
+        self.stream.output_high_watermark = 50
+        side = self.stream.transmit_side
+        side.write = mock.Mock(return_value=10)
+        self.send_direct('x' * 100)
+        self.broker.run_deferred()
+        self.assertEquals([1], events)
+        self.assertTrue(self.stream.output_paused)
+
+
+class PeerMixin(StreamMixin):
+    def setUp(self):
+        super(PeerMixin, self).setUp()
+        self.peer = self.klass(self.router, 2)
+        self.peer.receive_side = mitogen.core.Side(self.peer,
+                                                   os.dup(self.rsock.fileno()))
+
+    def tearDown(self):
+        self.peer.receive_side.close()
+        super(PeerMixin, self).tearDown()
+
+    def receive(self, n):
+        self.stream.on_transmit(self.broker)
+        while len(self.router.routed) < n:
+            self.peer.on_receive(self.broker)
+        return self.router.routed
+
+
+class CompressionTest(PeerMixin, testlib.TestCase):
+    def setUp(self):
+        super(CompressionTest, self).setUp()
+        self.stream.zlib_level = 6
+
+    def test_roundtrip(self):
+        data = '{"changed": true, "rc": 0, "stdout": "ok"}' * 100
+        for x in range(10):
+            self.send(data)
+        self.send('small')
+        self.assertTrue(self.stream.pending_bytes() < len(data))
+        msgs = self.receive(11)
+        self.assertEquals([data] * 10 + ['small'], [m.data for m in msgs])
+        self.assertEquals([0] * 11, [m.flags for m in msgs])
+
+    def test_below_threshold(self):
+        self.send('x' * (self.stream.zlib_threshold - 1))
+        pkt = self.stream._output_buf[0]
+        self.assertEquals(0, struct.unpack(self.stream.HEADER_FMT,
+                                           pkt[:self.stream.HEADER_LEN])[5])
+
+    def test_buffers(self):
+        buf = 'y' * mitogen.core.Message.oob_threshold
+        msg = mitogen.core.Message(dst_id=1, handle=123, data='d',
+                                   flags=mitogen.core.FLAG_OOB)
+        msg.buffers = [buf]
+        self.stream._send(msg)
+        self.assertEquals(1, len(self.stream._output_buf))
+        msg, = self.receive(1)
+        self.assertEquals(mitogen.core.FLAG_OOB, msg.flags)
+        self.assertEquals('d', msg.data)
+        self.assertEquals([buf], msg.buffers)
+
+    def test_corrupt_disconnects(self):
+        self.peer.on_disconnect = mock.Mock()
+        log = testlib.LogCapturer('mitogen')
+        log.start()
+        self.peer.receive_side.read = mock.Mock(return_value=struct.pack(
+            self.stream.HEADER_FMT, 1, 2, 3, 4, 0, mitogen.core.FLAG_ZLIB, 4,
+        ) + 'junk')
+        self.peer.on_receive(self.broker)
+        self.assertTrue('invalid compressed message' in log.stop())
+        self.assertEquals(1, self.peer.on_disconnect.call_count)
+        self.assertEquals([], self.router.routed)
+
+    def test_too_large_disconnects(self):
+        self.router.max_message_size = 1000
+        self.peer.on_disconnect = mock.Mock()
+        self.send('x' * 990)
+        self.send('x' * 1010)
+        log = testlib.LogCapturer('mitogen')
+        log.start()
+        self.stream.on_transmit(self.broker)
+        self.peer.on_receive(self.broker)
+        self.assertTrue('invalid compressed message' in log.stop())
+        self.assertEquals(1, len(self.router.routed))
+        self.assertEquals(1, self.peer.on_disconnect.call_count)
+
+
+class FragmentTest(PeerMixin, testlib.TestCase):
+    def setUp(self):
+        super(FragmentTest, self).setUp()
+        self.stream.fragment_size = 1000
+
+    def send(self, data, handle=123, dst_id=None):
+        if dst_id is None:
+            dst_id = mitogen.context_id
+        msg = mitogen.core.Message(dst_id=dst_id, handle=handle, data=data)
+        self.stream._send(msg)
+
+    def test_reassembled(self):
+        data = os.urandom(4500)
+        self.send(data)
+        self.assertEquals(0, len(self.stream._output_buf))
+        self.assertEquals(4500, self.stream.pending_bytes())
+        self.assertTrue(self.broker.transmitting)
+        msg, = self.receive(1)
+        self.assertEquals(data, msg.data)
+        self.assertEquals(0, msg.flags)
+        self.assertEquals({}, self.peer._reassembly)
+        self.assertEquals(0, self.stream.pending_bytes())
+        self.assertFalse(self.broker.transmitting)
+
+    def test_unverified_frames_dropped(self):
+        self.router.bad_src_ids = (66,)
+        forged = mitogen.core.Message(dst_id=mitogen.context_id, src_id=66,
+                                      auth_id=66, handle=123, data='x' * 2500)
+        for _, frame in self.stream._iter_fragments(forged):
+            self.stream._send(frame)
+        self.send('y')
+        msg, = self.receive(1)
+        self.assertEquals('y', msg.data)
+        self.assertEquals({}, self.peer._reassembly)
+
+    def test_interleaved(self):
+        self.send('x' * 5000, handle=1)
+        self.send('y', handle=2)
+        self.assertEquals(['y', 'x' * 5000],
+                          [m.data for m in self.receive(2)])
+
+    def test_same_handle_not_overtaken(self):
+        self.send('x' * 5000, handle=1)
+        self.send('y', handle=1)
+        self.send('z', handle=2)
+        self.assertEquals(['z', 'x' * 5000, 'y'],
+                          [m.data for m in self.receive(3)])
+
+    def test_concurrent(self):
+        self.send('x' * 3000, handle=1)
+        self.send('y' * 2000, handle=2)
+        self.assertEquals(['y' * 2000, 'x' * 3000],
+                          [m.data for m in self.receive(2)])
+
+    def test_buffers(self):
+        buf = 'y' * mitogen.core.Message.oob_threshold
+        msg = mitogen.core.Message(dst_id=mitogen.context_id, handle=123,
+                                   data='d', flags=mitogen.core.FLAG_OOB)
+        msg.buffers = [buf]
+        self.stream._send(msg)
+        msg, = self.receive(1)
+        self.assertEquals(mitogen.core.FLAG_OOB, msg.flags)
+        self.assertEquals('d', msg.data)
+        self.assertEquals([buf], msg.buffers)
+
+    def test_forwarded_unassembled(self):
+        self.send('x' * 2500, dst_id=1)
+        msgs = self.receive(3)
+        self.assertEquals([1004, 1004, 504], [len(m.data) for m in msgs])
+        self.assertEquals(
+            [mitogen.core.FLAG_FRAGMENT | mitogen.core.FLAG_MORE] * 2 +
+            [mitogen.core.FLAG_FRAGMENT],
+            [m.flags for m in msgs]
+        )
+
+    def test_not_fragmented_without_peer_support(self):
+        self.stream.fragment_size = None
+        self.send('x' * 2500)
+        self.assertEquals(1, len(self.stream._output_buf))
+
+    def forward(self, msgs):
+        # Frames from another context, arriving for a peer that cannot
+        # reassemble them.
+        self.stream.fragment_size = None
+        for msg in msgs:
+            self.stream._send(msg)
+
+    def test_reassembled_in_transit(self):
+        self.send('x' * 2500, dst_id=1)
+        frames = self.receive(3)
+        self.router.routed = []
+        self.forward(frames)
+        msg, = self.receive(1)
+        self.assertEquals('x' * 2500, msg.data)
+        self.assertEquals(0, msg.flags)
+        self.assertEquals({}, self.stream._reassembly)
+
+    def test_buffers_reassembled_in_transit(self):
+        buf = 'y' * mitogen.core.Message.oob_threshold
+        msg = mitogen.core.Message(dst_id=1, handle=123, data='d',
+                                   flags=mitogen.core.FLAG_OOB)
+        msg.buffers = [buf]
+        self.stream._send(msg)
+        self.stream.on_transmit(self.broker)
+        while not self.router.routed or \
+                self.router.routed[-1].flags & mitogen.core.FLAG_MORE:
+            self.peer.on_receive(self.broker)
+        frames, self.router.routed = self.router.routed, []
+        self.forward(frames)
+        msg, = self.receive(1)
+        self.assertEquals(mitogen.core.FLAG_OOB, msg.flags)
+        self.assertEquals('d', msg.data)
+        self.assertEquals([buf], msg.buffers)
+
+    def test_too_large_in_transit_dead_reply(self):
+        self.send('x' * 2500, dst_id=1)
+        frames = self.receive(3)
+        for frame in frames:
+            frame.reply_to = 55
+        self.router.routed = []
+        self.router.max_message_size = 2000
+        self.router.route = mock.Mock()
+        log = testlib.LogCapturer('mitogen')
+        log.start()
+        self.forward(frames)
+        self.assertTrue('Maximum message size exceeded' in log.stop())
+        self.assertEquals(0, self.stream.pending_bytes())
+        self.assertEquals({}, self.stream._reassembly)
+        self.assertEquals(set(), self.stream._dropping)
+        msg, = [c[1][0] for c in self.router.route.mock_calls]
+        self.assertTrue(msg.is_dead)
+        self.assertEquals(55, msg.handle)
+
+    def test_too_large_disconnects(self):
+        self.router.max_message_size = 2000
+        self.peer.on_disconnect = mock.Mock()
+        self.send('x' * 2500)
+        log = testlib.LogCapturer('mitogen')
+        log.start()
+        self.stream.on_transmit(self.broker)
+        self.peer.on_receive(self.broker)
+        self.assertTrue('Maximum message size exceeded' in log.stop())
+        self.assertEquals(1, self.peer.on_disconnect.call_count)
+        self.assertEquals([], self.router.routed)
+
+
+class ReassemblyLimitTest(StreamMixin, testlib.TestCase):
+    def frame(self, src_id, fragment_id, data, more=True):
+        flags = mitogen.core.FLAG_FRAGMENT
+        if more:
+            flags |= mitogen.core.FLAG_MORE
+        msg = mitogen.core.Message(src_id=src_id, flags=flags)
+        return self.stream._reassemble(msg, fragment_id + data)
+
+    def test_total_limited(self):
+        self.router.max_message_size = 1000
+        self.frame(5, 'aaaa', 'x' * 900)
+        self.frame(5, 'bbbb', 'x' * 900)
+        e = self.assertRaises(mitogen.core.StreamError,
+            lambda: self.frame(6, 'cccc', 'x' * 900))
+        self.assertTrue('Reassembly limit exceeded' in str(e))
+
+    def test_complete_released(self):
+        self.router.max_message_size = 1000
+        for x in range(5):
+            self.frame(5, 'aaaa', 'x' * 900)
+            self.assertEquals('x' * 1000,
+                              self.frame(5, 'aaaa', 'x' * 100, more=False))
+        self.assertEquals(0, self.stream._reassembly_size)
+
+    def test_discard(self):
+        self.frame(5, 'aaaa', 'x' * 900)
+        self.frame(5, 'bbbb', 'x' * 900)
+        self.frame(6, 'aaaa', 'y' * 100)
+        self.stream._discard_reassembly(5)
+        self.assertEquals([(6, 'aaaa')], list(self.stream._reassembly))
+        self.assertEquals(100, self.stream._reassembly_size)
+
+
+class LaneTest(PeerMixin, testlib.TestCase):
+    def send(self, data, handle=123, flags=0):
+        msg = mitogen.core.Message(dst_id=mitogen.context_id, handle=handle,
+                                   data=data, flags=flags)
+        self.stream._send(msg)
+
+    def test_control_overtakes_bulk(self):
+        for x in range(3):
+            self.send('bulk%d' % (x,), handle=1, flags=mitogen.core.FLAG_BULK)
+        self.send('control', handle=2)
+        self.assertEquals(['control', 'bulk0', 'bulk1', 'bulk2'],
+                          [m.data for m in self.receive(4)])
+        self.assertEquals(0, self.stream.pending_bytes())
+        self.assertFalse(self.broker.transmitting)
+
+    def test_bulk_counts_toward_watermark(self):
+        self.stream.output_high_watermark = 1000
+        self.send('x' * 1000, flags=mitogen.core.FLAG_BULK)
+        self.assertTrue(self.stream.output_paused)
+
+    def test_started_bulk_packet_completes_first(self):
+        self.send('x' * 100, handle=1, flags=mitogen.core.FLAG_BULK)
+        side = self.stream.transmit_side
+        write = side.write
+        side.write = mock.Mock(side_effect=lambda s: write(s[:10]))
+        self.stream.on_transmit(self.broker)
+        del side.write
+        self.assertEquals(10, self.stream._output_offset)
+        self.send('control', handle=2)
+        self.assertEquals(['x' * 100, 'control'],
+                          [m.data for m in self.receive(2)])
+
+    def test_bulk_fragments_yield_to_control(self):
+        self.stream.fragment_size = 1000
+        self.send('x' * 3000, handle=1, flags=mitogen.core.FLAG_BULK)
+        self.send('y' * 3000, handle=2)
+        self.send('z', handle=3, flags=mitogen.core.FLAG_BULK)
+        self.assertEquals(['y' * 3000, 'x' * 3000, 'z'],
+                          [m.data for m in self.receive(3)])
+
+
+class ReceiveTest(testlib.TestCase):
+    klass = mitogen.core.Stream
+
+    def setUp(self):
+        super(ReceiveTest, self).setUp()
+        self.router = FakeRouter()
+        self.broker = self.router.broker
+        self.stream = self.klass(self.router, 1)
+        self.stream.receive_side = mock.Mock()
+
+    def pack(self, data, handle=123, flags=0):
+        return struct.pack(self.stream.HEADER_FMT, 1, 2, 3, handle, 0,
+                           flags, len(data)) + data
+
+    def feed(self, s, size):
+        chunks = [s[i:i+size] for i in range(0, len(s), size)]
+        for chunk in chunks:
+            self.stream.receive_side.read.return_value = chunk
+            self.stream.on_receive(self.broker)
+
+    def test_many_per_read(self):
+        s = ''.join(self.pack(str(x), handle=x) for x in range(100))
+        self.feed(s, len(s))
+        self.assertEquals(range(100), [m.handle for m in self.router.routed])
+        self.assertEquals([str(x) for x in range(100)],
+                          [m.data for m in self.router.routed])
+        self.assertEquals(0, self.stream._input_buf_len)
+        self.assertEquals(0, len(self.stream._input_buf))
+
+    def test_byte_at_a_time(self):
+        s = self.pack('hello') + self.pack('') + self.pack('world')
+        self.feed(s, 1)
+        self.assertEquals(['hello', '', 'world'],
+                          [m.data for m in self.router.routed])
+        self.assertEquals(0, self.stream._input_buf_len)
+
+    def test_header_straddles_chunks(self):
+        s = self.pack('a' * 10) + self.pack('b' * 10)
+        self.feed(s, self.stream.HEADER_LEN + 13)
+        self.assertEquals(['a' * 10, 'b' * 10],
+                          [m.data for m in self.router.routed])
+
+    def test_large_message(self):
+        data = os.urandom(3 * mitogen.core.CHUNK_SIZE + 17)
+        s = self.pack(data) + self.pack('tail')
+        self.feed(s, mitogen.core.CHUNK_SIZE)
+        self.assertEquals([data, 'tail'],
+                          [m.data for m in self.router.routed])
+        self.assertEquals(0, self.stream._input_buf_len)
+
+    def test_flags(self):
+        self.feed(self.pack('x', flags=mitogen.core.FLAG_RAW), 1024)
+        msg, = self.router.routed
+        self.assertTrue(msg.is_raw)
+        self.assertEquals('x', msg.unpickle())
+
+    def test_oob_buffers(self):
+        bufs = [os.urandom(mitogen.core.CHUNK_SIZE), 'y' * 10]
+        body = struct.pack('>LLL', 2, len(bufs[0]), len(bufs[1])) + 'data'
+        s = self.pack(body + ''.join(bufs), flags=mitogen.core.FLAG_OOB)
+        self.feed(s + self.pack('tail'), 1000)
+        msg, tail = self.router.routed
+        self.assertEquals('data', msg.data)
+        self.assertEquals(bufs, msg.buffers)
+        self.assertEquals('tail', tail.data)
+        self.assertEquals(0, self.stream._input_buf_len)
+
+    def test_oob_bad_table_disconnects(self):
+        self.stream.on_disconnect = mock.Mock()
+        log = testlib.LogCapturer('mitogen')
+        log.start()
+        body = struct.pack('>LL', 1, 100) + 'data'
+        self.feed(self.pack(body, flags=mitogen.core.FLAG_OOB), 1024)
+        self.assertTrue('invalid out-of-band' in log.stop())
+        self.assertEquals(1, self.stream.on_disconnect.call_count)
+        self.assertEquals([], self.router.routed)
+
+    def test_too_large_disconnects(self):
+        self.router.max_message_size = 10
+        self.stream.on_disconnect = mock.Mock()
+        log = testlib.LogCapturer('mitogen')
+        log.start()
+        self.feed(self.pack('x' * 11), 1024)
+        self.assertTrue('Maximum message size exceeded' in log.stop())
+        self.assertEquals(1, self.stream.on_disconnect.call_count)
+        self.assertEquals([], self.router.routed)
+
+
+if __name__ == '__main__':
+    unittest2.main()
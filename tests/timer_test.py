@@ -0,0 +1,92 @@
+
+import threading
+import time
+
+import unittest2
+
+import mitogen.core
+
+import testlib
+
+
+class TimerTest(testlib.BrokerMixin, testlib.TestCase):
+    def test_call_later(self):
+        latch = mitogen.core.Latch()
+        t0 = time.time()
+        self.broker.call_later(0.1, lambda: latch.put(time.time()))
+        self.assertTrue(latch.get(timeout=5) >= t0 + 0.1)
+
+    def test_runs_on_broker_thread(self):
+        latch = mitogen.core.Latch()
+        self.broker.call_later(0, lambda: latch.put(threading.currentThread()))
+        self.assertEquals(self.broker._thread, latch.get(timeout=5))
+
+    def test_args(self):
+        latch = mitogen.core.Latch()
+        self.broker.call_later(0, latch.put, 123)
+        self.assertEquals(123, latch.get(timeout=5))
+
+    def test_order(self):
+        latch = mitogen.core.Latch()
+        now = time.time()
+        self.broker.call_at(now + 0.2, latch.put, 3)
+        self.broker.call_at(now + 0.1, latch.put, 2)
+        self.broker.call_at(now, latch.put, 1)
+        self.assertEquals([1, 2, 3], [latch.get(timeout=5) for x in range(3)])
+
+    def test_cancel(self):
+        latch = mitogen.core.Latch()
+        timer = self.broker.call_later(0.1, latch.put, 'cancelled')
+        self.broker.cancel(timer)
+        self.broker.call_later(0.2, latch.put, 'ok')
+        self.assertEquals('ok', latch.get(timeout=5))
+        self.assertTrue(latch.empty())
+
+    def test_cancelled_compacted(self):
+        timers = [self.broker.call_later(60, lambda: None) for x in range(10)]
+        for timer in timers[:6]:
+            self.broker.cancel(timer)
+        self.sync_with_broker()
+        self.assertEquals(set(timers[6:]),
+                          set(timer for _, _, timer in self.broker._timers))
+        self.assertEquals(0, self.broker._cancelled)
+        for timer in timers[6:]:
+            self.broker.cancel(timer)
+
+    def test_cancelled_head_skipped(self):
+        timer = self.broker.call_later(30, lambda: None)
+        timers = [self.broker.call_later(60, lambda: None) for x in range(3)]
+        self.broker.cancel(timer)
+        # The second sync ensures the broker loop has run again.
+        self.sync_with_broker()
+        self.sync_with_broker()
+        self.assertEquals(set(timers),
+                          set(timer for _, _, timer in self.broker._timers))
+        self.assertEquals(0, self.broker._cancelled)
+        for timer in timers:
+            self.broker.cancel(timer)
+
+    def test_periodic(self):
+        latch = mitogen.core.Latch()
+        timer = self.broker.periodic(0.01, latch.put, None)
+        for x in range(5):
+            latch.get(timeout=5)
+        timer.cancel()
+        self.sync_with_broker()
+        while not latch.empty():
+            latch.get()
+        time.sleep(0.05)
+        self.assertTrue(latch.empty())
+
+    def test_crash_logged(self):
+        log = testlib.LogCapturer()
+        log.start()
+        latch = mitogen.core.Latch()
+        self.broker.call_later(0, lambda: 1 / 0)
+        self.broker.call_later(0.01, latch.put, 'ok')
+        self.assertEquals('ok', latch.get(timeout=5))
+        self.assertTrue('ZeroDivisionError' in log.stop())
+
+
+if __name__ == '__main__':
+    unittest2.main()
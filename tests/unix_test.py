@@ -0,0 +1,80 @@
+
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import mitogen.core
+import mitogen.unix
+import unittest2
+
+import testlib
+
+
+class ListenerTest(testlib.RouterMixin, unittest2.TestCase):
+    def setUp(self):
+        super(ListenerTest, self).setUp()
+        self.listener = mitogen.unix.Listener(self.router)
+
+    def tearDown(self):
+        os.unlink(self.listener.path)
+        super(ListenerTest, self).tearDown()
+
+    def wait_clients(self, count, timeout=5.0):
+        deadline = time.time() + timeout
+        while len(self.listener.clients) != count:
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+
+    def handshake(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.listener.path)
+        sock.send(struct.pack('>L', os.getpid()))
+        self.assertEquals(12, len(sock.recv(12)))
+        return sock
+
+    def test_clients(self):
+        sock = self.handshake()
+        self.assertEquals(1, len(self.listener.clients))
+        sock.close()
+        self.wait_clients(0)
+
+    def test_connect_signal(self):
+        latch = mitogen.core.Latch()
+        mitogen.core.listen(self.listener, 'connect', latch.put)
+        sock = self.handshake()
+        self.assertTrue(latch.get(timeout=5.0) in self.listener.clients)
+        sock.close()
+        self.wait_clients(0)
+
+    def test_is_path_dead_survived(self):
+        self.assertFalse(mitogen.unix.is_path_dead(self.listener.path))
+        self.handshake().close()
+        self.wait_clients(0)
+
+    def test_child_id_allocation(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([
+            os.path.join(testlib.DATA_DIR, '..', '..'),
+            env.get('PYTHONPATH', ''),
+        ])
+        output = subprocess.check_output(
+            args=[
+                sys.executable,
+                os.path.join(testlib.DATA_DIR, 'unix_client.py'),
+                self.listener.path,
+            ],
+            env=env,
+        )
+        context_id, allocated_id, handles = map(int, output.split())
+        # The client's ID and its allocation both come from the listener, so
+        # the allocation cannot collide with IDs given to other clients.
+        self.assertTrue(allocated_id > context_id)
+        self.assertTrue(self.router.id_allocator.allocate() > allocated_id)
+        self.assertEquals(0, handles)
+
+
+if __name__ == '__main__':
+    unittest2.main()